@@ -1,11 +1,16 @@
-import argparse
+from __future__ import annotations     # annotations are not evaluated, typing is not imported
+
+from contextlib import contextmanager
 import enum
-from functools import partial
-import json
-import re
+from functools import lru_cache, partial
 import os
 import sys
-from typing import Set, Sequence, Tuple, Dict, List
+import time
+
+# argparse, json and ctypes are imported where they are used, to keep the startup fast
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Set, Sequence, Tuple, Dict, List
 
 
 __version__ = '0.0.1.dev0'
@@ -20,6 +25,7 @@ class ArgType(enum.Enum):
     COUNT = object()
     ONE = object()
     REST = object()
+    APPEND = object()   # repeatable, the values are collected
 
 
 class ValueType(enum.Enum):
@@ -27,6 +33,7 @@ class ValueType(enum.Enum):
     INT = object()
     # TODO: float
     BOOL = object()
+    ENUM = object()     # one of the choices
 
 
 def make_func(arg_type: ArgType):
@@ -39,28 +46,40 @@ flag = make_func(ArgType.BOOL)
 count = make_func(ArgType.COUNT)
 arg = make_func(ArgType.ONE)
 rest = make_func(ArgType.REST)
+append = make_func(ArgType.APPEND)
 
 
-UserArgInfo = Tuple[ArgType, Sequence[str], Dict]
+if TYPE_CHECKING:
+    UserArgInfo = Tuple[ArgType, Sequence[str], Dict]
 
 
 class ArgInfo:
     def __init__(
             self, *,
             name: str, options: Sequence[str], arg_type: ArgType,
-            value_type: ValueType, default
+            value_type: ValueType, default, choices: Sequence[str] = None, stream=False,
+            env: str = None, help: str = None, split: str = None
     ):
         self.name = name
         self.options = options
         self.arg_type = arg_type
         self.value_type = value_type
         self.default = default
+        self.choices = choices
+        self.stream = stream    # rest items are passed to a callback instead of being collected
+        self.env = env          # the environment variable that overrides the default
+        self.help = help        # the description in the usage text
+        self.split = split      # the separator of the values in one arg of an append option
 
     def to_tuple(self):
-        return self.name, self.options, self.arg_type, self.value_type, self.default
+        return (
+            self.name, self.options, self.arg_type, self.value_type, self.default, self.choices,
+            self.stream, self.env, self.help, self.split,
+        )
 
     def __repr__(self):
-        return "<ArgInfo name=%s options=%s arg_type=%s value_type=%s default=%s>" % self.to_tuple()
+        return "<ArgInfo name=%s options=%s arg_type=%s value_type=%s default=%s choices=%s " \
+               "stream=%s env=%s help=%r split=%r>" % self.to_tuple()
 
     def __hash__(self):
         return hash(self.to_tuple())
@@ -88,8 +107,21 @@ def get_option_name(options: Sequence[str], param: Dict) -> str:
     return name
 
 
+# character sets of the names in the config, instead of regex
+ascii_letters = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+ascii_alnum = ascii_letters | frozenset('0123456789')
+word_chars = ascii_alnum | {'_'}
+identifier_start_chars = ascii_letters | {'_'}
+choice_chars = word_chars | {'-'}
+
+
+def is_name(text: str, first: frozenset, rest: frozenset):
+    """Same as re.fullmatch('[first][rest]*', text)."""
+    return len(text) > 0 and text[0] in first and all(ch in rest for ch in text[1:])
+
+
 def verify_option_string(argname: str):
-    if re.fullmatch(r'-[a-zA-Z0-9]', argname):
+    if len(argname) == 2 and argname[0] == '-' and argname[1] in ascii_alnum:
         return
     else:
         long_option_to_name(argname)
@@ -103,16 +135,51 @@ def long_option_to_name(argname: str):
     words = argname.split('-')
     assert len(words) >= 1
     for wd in words:
-        if not re.fullmatch('[a-zA-Z0-9]+', wd):
+        if not is_name(wd, ascii_alnum, ascii_alnum):
             raise ArgError('bad word %s' % (wd,))
-    if not re.fullmatch('[a-zA-Z]', words[0][0]):
+    if words[0][0] not in ascii_letters:
         raise ArgError('bad leading word %s' % (words[0],))
 
     return '_'.join(words)
 
 
 def is_position_option(options):
-    return len(options) == 1 and re.fullmatch('[a-zA-Z][a-zA-Z0-9_]*', options[0])
+    return len(options) == 1 and is_name(options[0], ascii_letters, word_chars)
+
+
+def is_list_option(info: ArgInfo):
+    """Rest and append options take many values."""
+    return info.arg_type in (ArgType.REST, ArgType.APPEND)
+
+
+def choice_to_enumerator(choice: str):
+    """The c++ enumerator, kCamelCase, which never spells a macro such as NULL, EOF or DEBUG."""
+    return 'k' + ''.join(word[:1].upper() + word[1:] for word in choice.replace('-', '_').split('_'))
+
+
+def choice_to_c_enumerator(choice: str):
+    """Upper case, the c enumerators are prefixed by the struct and the field."""
+    return choice.upper().replace('-', '_')
+
+
+def enum_type_name(name: str):
+    return ''.join(word[:1].upper() + word[1:] for word in name.split('_'))
+
+
+def verify_choices(name: str, choices):
+    if not isinstance(choices, (list, tuple)) or len(choices) == 0:
+        raise ArgError('choices of %s should be a non-empty list' % (name,))
+
+    enumerators = set()     # type: Set[str]
+    c_enumerators = set()   # type: Set[str]
+    for choice in choices:
+        if not isinstance(choice, str) or not is_name(choice, ascii_letters, choice_chars):
+            raise ArgError('bad choice %r of %s' % (choice, name))
+        enumerator, c_enumerator = choice_to_enumerator(choice), choice_to_c_enumerator(choice)
+        if enumerator in enumerators or c_enumerator in c_enumerators:
+            raise ArgError('duplicated choice %s of %s' % (choice, name))
+        enumerators.add(enumerator)
+        c_enumerators.add(c_enumerator)
 
 
 def get_value_type_and_default(name: str, arg_type: ArgType, param: Dict):
@@ -125,28 +192,96 @@ def get_value_type_and_default(name: str, arg_type: ArgType, param: Dict):
     elif arg_type == ArgType.ONE:
         value_type = param.get('type', ValueType.STRING)
         default = param.get('default', None)
+        if 'choices' in param:
+            if 'type' in param:
+                raise ArgError('"type" param not allowed with "choices" in %s' % (name,))
+            value_type = ValueType.ENUM
+            verify_choices(name, param['choices'])
+            if default is not None and default not in param['choices']:
+                raise ArgError('default of %s is not one of the choices' % (name,))
+        elif value_type == ValueType.ENUM:
+            raise ArgError('"choices" param required by %s' % (name,))
     elif arg_type == ArgType.REST:
         value_type = param.get('type', ValueType.STRING)
         if value_type not in (ValueType.STRING, ValueType.INT):
             raise ArgError('only string & int are allowed in rest option')
         default = None
+    elif arg_type == ArgType.APPEND:
+        value_type = param.get('type', ValueType.STRING)
+        if value_type not in (ValueType.STRING, ValueType.INT):
+            raise ArgError('only string & int are allowed in append option')
+        default = None
     else:
         assert False, 'unreachable'
 
-    if arg_type in (ArgType.BOOL, ArgType.COUNT, ArgType.REST):
+    if not isinstance(value_type, ValueType):
+        raise ArgError('bad type %r of %s' % (value_type, name))
+    # checked by type, 1 == True and lists are not hashable, which would confuse the memo of generate()
+    if value_type == ValueType.INT and default is not None:
+        if not isinstance(default, int) or isinstance(default, bool):
+            raise ArgError('default of %s should be an int' % (name,))
+    elif value_type in (ValueType.STRING, ValueType.ENUM) and default is not None:
+        if not isinstance(default, str):
+            raise ArgError('default of %s should be a string' % (name,))
+
+    if arg_type in (ArgType.BOOL, ArgType.COUNT, ArgType.REST, ArgType.APPEND):
         if 'default' in param:
             raise ArgError('"default" param not allowed in %s' % (name,))
     if arg_type in (ArgType.BOOL, ArgType.COUNT):
         if 'type' in param:
             raise ArgError('"type" param not allowed in %s' % (name,))
+    if arg_type != ArgType.ONE:
+        if 'choices' in param:
+            raise ArgError('"choices" param not allowed in %s' % (name,))
+    if arg_type != ArgType.REST:
+        if 'stream' in param:
+            raise ArgError('"stream" param not allowed in %s' % (name,))
 
     return value_type, default
 
 
+def get_env_name(name: str, arg_type: ArgType, options: Sequence[str], param: Dict):
+    env = param.get('env')
+    if env is None:
+        return None
+
+    if arg_type in (ArgType.REST, ArgType.APPEND) or is_position_option(options):
+        raise ArgError('"env" param not allowed in %s' % (name,))
+    if not isinstance(env, str) or not is_name(env, identifier_start_chars, word_chars):
+        raise ArgError('bad environment variable %r of %s' % (env, name))
+    return env
+
+
+# separators of the split form of append options
+split_chars = ',;:+/|'
+
+
+def get_split(name: str, arg_type: ArgType, param: Dict):
+    split = param.get('split')
+    if split is None:
+        return None
+
+    if arg_type != ArgType.APPEND:
+        raise ArgError('"split" param not allowed in %s' % (name,))
+    if not isinstance(split, str) or len(split) != 1 or split not in split_chars:
+        raise ArgError('bad split %r of %s, expect one of %s' % (split, name, split_chars))
+    return split
+
+
+def get_help(name: str, param: Dict):
+    text = param.get('help')
+    if text is not None and not isinstance(text, str):
+        raise ArgError('help of %s should be a string' % (name,))
+    return text
+
+
 def process_config(conf: Sequence[UserArgInfo]):
     has_rest = False
     options_set = set()         # type: Set[str]
     name_set = set()            # type: Set[str]
+    # Stats is declared by the instrumentation, ArgType by for_each_field()
+    enum_type_set = {'Stats', 'ArgType'}    # type: Set[str]
+    env_set = set()             # type: Set[str]
     arginfo_list = []           # type: List[ArgInfo]
 
     for arg_type, options, param in conf:
@@ -168,12 +303,30 @@ def process_config(conf: Sequence[UserArgInfo]):
             if has_rest:
                 raise ArgError('multiple rest arg_type')
             has_rest = True
+        if arg_type == ArgType.APPEND and is_position_option(options):
+            raise ArgError('positional append option %s, use rest instead' % (name,))
 
         value_type, default = get_value_type_and_default(name, arg_type, param)
 
+        choices = None
+        if value_type == ValueType.ENUM:
+            choices = tuple(param['choices'])
+            type_name = enum_type_name(name)
+            if type_name in enum_type_set:
+                raise ArgError('enum type name %s of %s is taken' % (type_name, name))
+            enum_type_set.add(type_name)
+
+        env = get_env_name(name, arg_type, options, param)
+        if env is not None:
+            if env in env_set:
+                raise ArgError('duplicated environment variable %s' % (env,))
+            env_set.add(env)
+
         ai = ArgInfo(
             name=name, options=options,
-            arg_type=arg_type, value_type=value_type, default=default,
+            arg_type=arg_type, value_type=value_type, default=default, choices=choices,
+            stream=bool(param.get('stream', False)), env=env, help=get_help(name, param),
+            split=get_split(name, arg_type, param),
         )
 
         arginfo_list.append(ai)
@@ -205,6 +358,15 @@ class Label:
     def __init__(self, text):
         self.text = text
 
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and self.text == other.text
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return hash(self.text)
+
 
 class BaseNode:
     def __init__(self):
@@ -218,12 +380,22 @@ class BaseNode:
     def indent(self, level: int):
         return '    ' * level
 
+    def structural_key(self):
+        """A hashable value that is equal for subtrees that render the same."""
+        return self.__class__, tuple(
+            child.structural_key() if isinstance(child, BaseNode) else child
+            for child in self.children
+        )
+
     def __eq__(self, other):
-        return self.__class__ is other.__class__ and self.children == other.children
+        return self.__class__ is other.__class__ and self.structural_key() == other.structural_key()
 
     def __ne__(self, other):
         return not (self == other)
 
+    def __hash__(self):
+        return hash(self.structural_key())
+
 
 class Body(BaseNode):
     def to_source_body(self, level: int):
@@ -258,8 +430,8 @@ class Block(Body):
         else:
             yield self.indent(level) + '}'
 
-    def __eq__(self, other):
-        return super().__eq__(other) and self.head == other.head
+    def structural_key(self):
+        return super().structural_key() + (self.head, self.trailing_semicolon)
 
 
 class Condition(BaseNode):
@@ -303,23 +475,75 @@ class If(Block):
         super().__init__(f'if ({cond})')
         self.cond = cond
 
-    def __eq__(self, other):
-        return super().__eq__(other) and self.cond == other.cond
-
 
 class ElseIf(Body):
     def __init__(self, cond: str):
         super().__init__()
         self.cond = cond
 
-    def __eq__(self, other):
-        return super().__eq__(other) and self.cond == other.cond
+    def structural_key(self):
+        return super().structural_key() + (self.cond,)
 
 
 class Else(Body):
     pass
 
 
+class Suite(Body):
+    """An indented block without braces, like the compound statements of python."""
+
+    def __init__(self, head: str):
+        super().__init__()
+        self.head = head
+
+    def to_source(self, level: int):
+        yield self.indent(level) + self.head + ':'
+        if self.children:
+            yield from self.to_source_body(level + 1)
+        else:
+            yield self.indent(level + 1) + 'pass'
+
+    def structural_key(self):
+        return super().structural_key() + (self.head,)
+
+
+class Fragment(BaseNode):
+    """Statements that may be moved into a helper function shared by identical fragments.
+
+    `inline` is the code in place, `outlined` is the same code written in terms of `params`,
+    a list of (declaration, argument) pairs. See outline_fragments().
+    """
+
+    def __init__(
+            self, name: str, params: Sequence[Tuple[str, str]], inline: Root, outlined: Root,
+            template: str = None
+    ):
+        super().__init__()
+        self.name = name
+        self.params = params
+        self.inline = inline
+        self.outlined = outlined
+        self.template = template
+        self.call = None    # set if outlined
+
+    def helper_key(self):
+        return self.name, self.template, tuple(decl for decl, _ in self.params), self.outlined
+
+    def to_source(self, level: int):
+        if self.call is None:
+            yield from self.inline.to_source(level)
+        else:
+            yield self.indent(level) + self.call
+
+    def structural_key(self):
+        return super().structural_key() + (self.helper_key(), self.inline, self.call)
+
+
+class HelperSlot(Root):
+    """Where the helper functions of outlined fragments are placed."""
+    pass
+
+
 # noinspection PyPep8Naming
 class Context:
     def __init__(self):
@@ -362,6 +586,9 @@ class Context:
     def ELSE(self):
         return self.add_cur(Else())
 
+    def SUITE(self, head: str):
+        return self.add_cur(Suite(head))
+
 
 def collect_node(gen) -> Root:
     ctx = Context()
@@ -371,13 +598,121 @@ def collect_node(gen) -> Root:
     return ctx.root
 
 
+def node_stats(node, depth=0) -> Tuple[int, int]:
+    """Returns the number of nodes in the tree and its maximum nesting depth."""
+    node_count, max_depth = 1, depth
+    for child in node.children:
+        if isinstance(child, BaseNode):
+            child_count, child_depth = node_stats(child, depth + 1)
+            node_count += child_count
+            max_depth = max(max_depth, child_depth)
+    return node_count, max_depth
+
+
+def make_fragment(
+        name: str, params: Sequence[Tuple[str, str]], inline_gen, outlined_gen,
+        template: str = None
+) -> Fragment:
+    return Fragment(
+        name, params, collect_node(inline_gen), collect_node(outlined_gen), template=template,
+    )
+
+
+def walk_nodes(node):
+    yield node
+    for child in node.children:
+        if isinstance(child, BaseNode):
+            yield from walk_nodes(child)
+
+
+def outline_fragments(root: Root, min_count=2):
+    """Moves the fragments that occur at least min_count times into helper functions,
+    one function per group of structurally identical fragments."""
+    groups = dict()     # type: Dict[Tuple, List[Fragment]]
+    slot = None
+    for node in walk_nodes(root):
+        if isinstance(node, Fragment):
+            groups.setdefault(node.helper_key(), []).append(node)
+        elif isinstance(node, HelperSlot):
+            slot = node
+    if slot is None:
+        return
+
+    name_count = dict()     # type: Dict[str, int]
+    for fragments in groups.values():
+        if len(fragments) < min_count:
+            continue
+
+        first = fragments[0]
+        name_count[first.name] = name_count.get(first.name, 0) + 1
+        helper = first.name
+        if name_count[first.name] > 1:
+            helper += '_%d' % (name_count[first.name],)
+
+        if first.template is not None:
+            slot.add_child(first.template)
+        decls = ', '.join(decl for decl, _ in first.params)
+        func = Block(f'static inline void {helper}({decls})')
+        func.children = list(first.outlined.children)
+        slot.add_child(func)
+        slot.add_child('')
+
+        for fragment in fragments:
+            fragment.call = '%s(%s);' % (helper, ', '.join(arg for _, arg in fragment.params))
+
+
 # end source generation utils
 
+
+class GenOptions:
+    """Switches of the generated code that are given by the user of arggen, prog may also be
+    set by the config file, see parse_config_string()."""
+
+    def __init__(self, *, instrument=False, compact=False, prog=None):
+        self.instrument = instrument
+        self.compact = compact      # order the fields by size and pack the flags into bitfields
+        self.prog = prog            # the program name in the usage text, the file name if None
+
+    def to_tuple(self):
+        return self.instrument, self.compact, self.prog
+
+    def __repr__(self):
+        return '<GenOptions instrument=%s compact=%s prog=%r>' % self.to_tuple()
+
+    def with_config(self, configs: Dict):
+        """The settings of the config file under the ones given here."""
+        prog = getattr(configs, 'prog', None)
+        if self.prog is not None or prog is None:
+            return self
+        return GenOptions(instrument=self.instrument, compact=self.compact, prog=prog)
+
+    def __hash__(self):
+        return hash(self.to_tuple())
+
+    def __eq__(self, other: 'GenOptions'):
+        return self.to_tuple() == other.to_tuple()
+
+    def __ne__(self, other):
+        return not (self == other)
+
+
 # begin xxx_gen
 
 
+# character -> its escape in c string literals, non-ascii characters are taken byte by byte
+c_string_escapes = {idx: '\\%03o' % (idx,) for idx in list(range(0x20)) + list(range(0x7f, 0x100))}
+c_string_escapes.update({ord('"'): '\\"', ord('\\'): '\\\\', ord('\n'): '\\n', ord('\t'): '\\t'})
+
+
 def repr_c_string(string: str):
-    return json.dumps(string)
+    """The c/c++ string literal of the utf-8 of string. Octal escapes have no more than 3 digits,
+    so that the next character is never taken in, and sizeof() is the same for any charset."""
+    if not string.isascii():
+        string = string.encode('utf8').decode('latin1')
+    literal = string.translate(c_string_escapes)
+    if '??' in literal:
+        literal = literal.replace('?', '\\?')     # no trigraph
+    return '"' + literal + '"'
 
 
 value_type_to_cxx_type = {
@@ -387,66 +722,487 @@ value_type_to_cxx_type = {
 }
 
 
-def struct_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+def cxx_value_type(info: ArgInfo, struct_name: str = None):
+    """The type of the field, qualified by struct_name if given."""
+    if info.value_type == ValueType.ENUM:
+        type_name = enum_type_name(info.name)
+        return type_name if struct_name is None else f'{struct_name}::{type_name}'
+    return value_type_to_cxx_type[info.value_type]
+
+
+def fnv1a_hash(data: bytes, seed: int):
+    value = seed
+    for byte in data:
+        value = ((value ^ byte) * 16777619) & 0xffffffff
+    return value
+
+
+def find_perfect_hash(keys: Sequence[str]) -> Tuple[int, int]:
+    """Returns (seed, size) so that fnv1a_hash(key, seed) % size is distinct for every key,
+    size is a power of 2."""
+    size = 1
+    while size < len(keys):
+        size *= 2
+    while True:
+        # starts from the offset basis of FNV-1a
+        for seed in range(2166136261, 2166136261 + 1000):
+            slots = {fnv1a_hash(key.encode(), seed) & (size - 1) for key in keys}
+            if len(slots) == len(keys):
+                return seed, size
+        size *= 2
+
+
+def choices_lookup_gen(ctx: Context, info: ArgInfo, null: str):
+    """Sets `index` to the position of the c string `value` in the choices, or -1.
+
+    Shared by the c and c++ targets. The hash is perfect on the choices, so a single
+    strcmp() decides the match.
+    """
+    seed, size = find_perfect_hash(info.choices)
+    table = [(null, -1)] * size
+    for idx, choice in enumerate(info.choices):
+        table[fnv1a_hash(choice.encode(), seed) & (size - 1)] = (repr_c_string(choice), idx)
+
+    yield f'// perfect hash of the choices of {info.name}, computed by arggen'
+    with ctx.BLOCK(
+        f'static const struct {{ const char *name; int index; }} table[{size}] =',
+        trailing_semiconlon=True,
+    ):
+        for name, idx in table:
+            yield f'{{{name}, {idx}}},'
+    yield f'uint32_t hash = {seed}u;'
+    with ctx.BLOCK("for (const char *it = value; *it != '\\0'; ++it)"):
+        yield 'hash = (hash ^ (unsigned char)*it) * 16777619u;'
+    yield f'const int slot = (int)(hash & {size - 1}u);'
+    yield f'const int index = table[slot].name != {null} && strcmp(table[slot].name, value) == 0'
+    yield '    ? table[slot].index : -1;'
+
+
+def instrument_decl_gen(ctx: Context, argsinfo: Sequence[ArgInfo]):
+    yield '#ifdef ARGGEN_INSTRUMENT'
+    yield '// counters of the generated parser, only compiled in if ARGGEN_INSTRUMENT is defined'
+    with ctx.BLOCK('struct Stats', trailing_semiconlon=True):
+        with ctx.BLOCK('enum Option', trailing_semiconlon=True):
+            for info in sorted(argsinfo, key=lambda ai: ai.name):
+                yield f'opt_{info.name},'
+            yield 'option_count'
+        with ctx.BLOCK('enum Error', trailing_semiconlon=True):
+            for error in instrument_errors:
+                yield f'err_{error},'
+            yield 'error_count'
+        yield ''
+        yield 'std::atomic<unsigned long> option_hits[option_count];'
+        yield 'std::atomic<unsigned long> errors[error_count];'
+        yield '// called with the duration of every parse, if set'
+        yield 'std::atomic<void (*)(std::chrono::nanoseconds)> on_parse_time;'
+    yield 'static Stats stats;'
+    yield '#endif'
+
+
+def instrument_def_gen(ctx: Context, struct_name: str):
+    yield '#ifdef ARGGEN_INSTRUMENT'
+    yield f'{struct_name}::Stats {struct_name}::stats;'
+    yield ''
+    yield '#define ARGGEN_HIT(option) \\'
+    yield f'    {struct_name}::stats.option_hits[{struct_name}::Stats::option].fetch_add(1, std::memory_order_relaxed)'
+    yield '#define ARGGEN_ERROR(error) \\'
+    yield f'    {struct_name}::stats.errors[{struct_name}::Stats::error].fetch_add(1, std::memory_order_relaxed)'
+    yield '#define ARGGEN_TIME_PARSE() ParseTimer arggen_parse_timer'
+    yield ''
+    with ctx.BLOCK('namespace'):
+        with ctx.BLOCK('struct ParseTimer', trailing_semiconlon=True):
+            yield 'std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();'
+            yield ''
+            with ctx.BLOCK('~ParseTimer()'):
+                with ctx.IF(f'auto callback = {struct_name}::stats.on_parse_time.load(std::memory_order_relaxed)'):
+                    yield 'callback(std::chrono::duration_cast<std::chrono::nanoseconds>('
+                    yield '    std::chrono::steady_clock::now() - start));'
+    yield '#else'
+    yield '#define ARGGEN_HIT(option) ((void)0)'
+    yield '#define ARGGEN_ERROR(error) ((void)0)'
+    yield '#define ARGGEN_TIME_PARSE() ((void)0)'
+    yield '#endif'
+
+
+def cxx_default_value(info: ArgInfo):
+    """The default of a non-list field inside the struct, or its zero value if there is no default."""
+    assert not is_list_option(info)
+    if info.value_type == ValueType.STRING:
+        return repr_c_string(info.default or '')
+    elif info.value_type == ValueType.INT:
+        return str(info.default or 0)
+    elif info.value_type == ValueType.BOOL:
+        return 'true' if info.default else 'false'
+    elif info.value_type == ValueType.ENUM:
+        return f'{cxx_value_type(info)}::{choice_to_enumerator(info.default or info.choices[0])}'
+    else:
+        assert False, 'unreachable'
+
+
+def layout_rank(info: ArgInfo):
+    if is_list_option(info) or info.value_type == ValueType.STRING:
+        return 0    # pointer aligned
+    elif info.value_type == ValueType.BOOL:
+        return 2    # bitfields
+    else:
+        return 1    # int and enum
+
+
+def layout_order(argsinfo: Sequence[ArgInfo], options: GenOptions):
+    """The order of the fields in the struct: by name, or grouped by alignment if compact,
+    so that there is no padding between them and the flags share bytes."""
+    if options.compact:
+        return sorted(argsinfo, key=lambda ai: (layout_rank(ai), ai.name))
+    return sorted(argsinfo, key=lambda ai: ai.name)
+
+
+def compact_field_gen(ctx: Context, info: ArgInfo):
+    # no default member initializers, they are set by the constructor
+    cxx_type = cxx_value_type(info)
+    if info.stream:
+        arg_type = 'const std::string &' if info.value_type == ValueType.STRING else cxx_type
+        yield f'std::function<void({arg_type})> {info.name};'
+    elif is_list_option(info):
+        yield f'std::vector<{cxx_type}> {info.name};'
+    elif info.value_type == ValueType.BOOL:
+        yield f'bool {info.name} : 1;'
+    else:
+        yield f'{cxx_type} {info.name};'
+
+
+def constructor_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], options: GenOptions):
+    # in the order of declaration
+    inits = []
+    for info in layout_order(argsinfo, options):
+        if is_list_option(info):
+            continue
+        if info.value_type == ValueType.STRING and info.default is None:
+            continue
+        inits.append(f'{info.name}({cxx_default_value(info)})')
+
+    yield f'{struct_name}::{struct_name}()'
+    for idx, init in enumerate(inits):
+        yield ('    : ' if idx == 0 else '    , ') + init
+    yield '{}'
+
+
+def for_each_field_gen(ctx: Context, argsinfo: Sequence[ArgInfo], options: GenOptions, const: bool):
+    yield 'template <class Visitor>'
+    with ctx.BLOCK('void for_each_field(Visitor &&visitor)' + (' const' if const else '')):
+        for info in layout_order(argsinfo, options):
+            opts = ', '.join(repr_c_string(opt) for opt in info.options)
+            args = '%s, std::initializer_list<const char *>{%s}, ArgType::%s' % (
+                repr_c_string(info.name), opts, choice_to_enumerator(info.arg_type.name.lower()),
+            )
+            if options.compact and info.value_type == ValueType.BOOL:
+                # no reference to a bitfield, the visitor gets a copy that is written back
+                copy = f'field_{info.name}'
+                yield f'{"const " if const else ""}bool {copy} = this->{info.name};'
+                yield f'visitor({args}, {copy});'
+                if not const:
+                    yield f'this->{info.name} = {copy};'
+            else:
+                yield f'visitor({args}, this->{info.name});'
+
+
+def struct_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str, options: GenOptions
+):
+    enum_infos = [info for info in argsinfo if info.value_type == ValueType.ENUM]
+
     with ctx.BLOCK(f'struct {struct_name}', trailing_semiconlon=True):
-        for info in sorted(argsinfo, key=lambda ai: ai.name):   # sort by name
-            cxx_type = value_type_to_cxx_type[info.value_type]
+        yield '// kinds of options, see for_each_field()'
+        with ctx.BLOCK('enum class ArgType', trailing_semiconlon=True):
+            for arg_type in ArgType:
+                # kCamelCase like the enums of choices, BOOL is a common macro
+                yield f'{choice_to_enumerator(arg_type.name.lower())},'
+        yield ''
+
+        for info in enum_infos:
+            with ctx.BLOCK(f'enum class {enum_type_name(info.name)}', trailing_semiconlon=True):
+                for choice in info.choices:
+                    yield f'{choice_to_enumerator(choice)},'
+            yield ''
+
+        for info in layout_order(argsinfo, options):
+            cxx_type = cxx_value_type(info)
             yield f'// options: {info.options}, arg_type: {info.arg_type}'
-            if info.default is None:
-                if info.arg_type == ArgType.REST:
+            if options.compact:
+                yield from compact_field_gen(ctx, info)
+            elif info.default is None:
+                if info.stream:
+                    arg_type = 'const std::string &' if info.value_type == ValueType.STRING else cxx_type
+                    yield '// called with each item as soon as it is parsed, nothing is collected.'
+                    yield '// parsing an item without a callback throws ArgError'
+                    yield f'std::function<void({arg_type})> {info.name};'
+                elif is_list_option(info):
                     yield f'std::vector<{cxx_type}> {info.name};'
                 else:
                     yield f'{cxx_type} {info.name};'
             else:
-                assert info.arg_type != ArgType.REST
-                default = info.default
-                if info.value_type == ValueType.STRING:
-                    default = repr_c_string(default)
-                elif info.value_type == ValueType.BOOL:
-                    default = 'true' if default else 'false'
-                yield f'{cxx_type} {info.name} = {default};'
+                yield f'{cxx_type} {info.name} = {cxx_default_value(info)};'
 
         yield ''
+        if options.compact:
+            yield f'{struct_name}();'
         yield 'std::string to_string() const;'
+        for info in enum_infos:
+            yield f'static const char *to_string({enum_type_name(info.name)} value);'
         yield f'bool operator==(const {struct_name} &rhs) const;'
         yield f'bool operator!=(const {struct_name} &rhs) const;'
         yield f'static {struct_name} parse_args(const std::vector<std::string> &args);'
+        yield f'static void parse_into({struct_name} &out, const std::vector<std::string> &args);'
+        yield f'static {struct_name} parse_line(const std::string &line);'
+        yield f'static void parse_line_into({struct_name} &out, const std::string &line);'
         yield f'static {struct_name} parse_argv(int argc, const char *const argv[]);'
+        yield f'static void parse_argv_into({struct_name} &out, int argc, const char *const argv[]);'
+        yield '// binary format, see serialize_method_gen() of arggen.py'
+        yield 'void serialize(std::string &buffer) const;'
+        yield f'static {struct_name} deserialize(const std::string &buffer);'
+        yield f'static void deserialize_into({struct_name} &out, const char *data, size_t size);'
+        yield ''
+        yield '// laid out by arggen, printed with a single write, e.g.'
+        yield '// fwrite(usage, 1, sizeof(usage) - 1, stdout)'
+        usage = usage_text(options.prog or source_name, argsinfo)
+        yield from usage_decl_gen('static constexpr char usage[]', usage)
+        yield ''
+        yield '// calls visitor(name, options, arg_type, field) on each field in the order of declaration,'
+        yield '// everything is resolved at compile time'
+        yield from for_each_field_gen(ctx, argsinfo, options, const=False)
+        yield ''
+        yield from for_each_field_gen(ctx, argsinfo, options, const=True)
+
+        if options.instrument:
+            yield ''
+            yield from instrument_decl_gen(ctx, argsinfo)
 
 
-def accecpt_rest_gen(ctx: Context, info: ArgInfo):
+def accecpt_rest_gen(ctx: Context, info: ArgInfo, options: GenOptions):
     if info.value_type == ValueType.STRING:
-        yield f'ans.{info.name}.emplace_back(piece);'
+        value = 'piece'
     elif info.value_type == ValueType.INT:
         # FIXME: atol
-        yield f'ans.{info.name}.emplace_back(atol(piece.data()))'
+        value = 'atol(piece.data())'
     else:
         assert False, 'unreachable'
 
+    if info.stream:
+        # parse_args() and the like return a new struct without callback, the items are not dropped silently
+        with ctx.IF(f'!ans.{info.name}'):
+            yield from throw_gen(options, 'no_callback', repr_c_string(f'no callback for {info.name}'))
+        yield f'ans.{info.name}({value});'
+        return
 
-def accept_arg_gen(ctx: Context, info: ArgInfo, source: str):
-    if info.value_type == ValueType.STRING:
-        yield f'ans.{info.name} = {source};'
+    # overwrite the existing items before growing the vector, so that their capacity is reused
+    with ctx.CONDITION():
+        with ctx.IF(f'n_{info.name} < ans.{info.name}.size()'):
+            yield f'ans.{info.name}[n_{info.name}] = {value};'
+        with ctx.ELSE():
+            yield f'ans.{info.name}.emplace_back({value});'
+    yield f'n_{info.name}++;'
+
+
+def reset_value_gen(ctx: Context, info: ArgInfo, struct_name: str):
+    if info.stream:
+        yield f'// the callback {info.name} is kept'
+    elif is_list_option(info):
+        # truncated after parsing, see accecpt_rest_gen() and append_utils_gen()
+        yield f'size_t n_{info.name} = 0;'
+    elif info.value_type == ValueType.STRING:
+        if info.default is None:
+            yield f'ans.{info.name}.clear();'
+        else:
+            yield f'ans.{info.name} = {repr_c_string(info.default)};'
+    elif info.value_type == ValueType.INT:
+        yield f'ans.{info.name} = {info.default or 0};'
+    elif info.value_type == ValueType.BOOL:
+        yield f'ans.{info.name} = {"true" if info.default else "false"};'
+    elif info.value_type == ValueType.ENUM:
+        enumerator = choice_to_enumerator(info.default or info.choices[0])
+        yield f'ans.{info.name} = {cxx_value_type(info, struct_name)}::{enumerator};'
+    else:
+        assert False, 'unreachable'
+
+
+def append_utils_gen(ctx: Context):
+    yield '// append options, the items left by previous parses are overwritten before the vector grows.'
+    yield '// inline, since some may not be used by the fields'
+    with ctx.BLOCK('inline void append_value(std::vector<std::string> &field, size_t &n, const char *value)'):
+        with ctx.CONDITION():
+            with ctx.IF('n < field.size()'):
+                yield 'field[n].assign(value);'
+            with ctx.ELSE():
+                yield 'field.emplace_back(value);'
+        yield 'n++;'
+    yield ''
+    with ctx.BLOCK('inline void append_int(std::vector<int> &field, size_t &n, int item)'):
+        with ctx.CONDITION():
+            with ctx.IF('n < field.size()'):
+                yield 'field[n] = item;'
+            with ctx.ELSE():
+                yield 'field.push_back(item);'
+        yield 'n++;'
+    yield ''
+    # FIXME: atol, like the other int options
+    with ctx.BLOCK('inline void append_value(std::vector<int> &field, size_t &n, const char *value)'):
+        yield 'append_int(field, n, atol(value));'
+    yield ''
+    with ctx.BLOCK(
+        'inline void append_range(std::vector<std::string> &field, size_t &n, const char *begin, const char *end)'
+    ):
+        with ctx.CONDITION():
+            with ctx.IF('n < field.size()'):
+                yield 'field[n].assign(begin, end);'
+            with ctx.ELSE():
+                yield 'field.emplace_back(begin, end);'
+        yield 'n++;'
+    yield ''
+    with ctx.BLOCK('inline void append_range(std::vector<int> &field, size_t &n, const char *begin, const char *end)'):
+        yield "// as atol() on [begin, end), without copying the item. unsigned, so that overflow wraps"
+        with ctx.BLOCK("while (begin < end && (*begin == ' ' || (*begin >= '\\t' && *begin <= '\\r')))"):
+            yield '++begin;'
+        yield "const bool negative = begin < end && *begin == '-';"
+        with ctx.IF("begin < end && (*begin == '+' || *begin == '-')"):
+            yield '++begin;'
+        yield 'unsigned long value = 0;'
+        with ctx.BLOCK("for (; begin < end && *begin >= '0' && *begin <= '9'; ++begin)"):
+            yield "value = value * 10 + static_cast<unsigned long>(*begin - '0');"
+        yield 'append_int(field, n, static_cast<int>(negative ? 0 - value : value));'
+    yield ''
+    yield '// the split form, the items are taken from value in place, without substrings'
+    yield 'template <class T>'
+    with ctx.BLOCK('void append_split(std::vector<T> &field, size_t &n, const char *value, char sep)'):
+        with ctx.BLOCK('for (const char *it = value; ; ++it)'):
+            with ctx.IF("*it == sep || *it == '\\0'"):
+                yield 'append_range(field, n, value, it);'
+                with ctx.IF("*it == '\\0'"):
+                    yield 'return;'
+                yield 'value = it + 1;'
+
+
+def accept_arg_gen(ctx: Context, info: ArgInfo, source: str, field: str = None, count: str = None):
+    if field is None:
+        field = f'ans.{info.name}'
+    if count is None:
+        count = f'n_{info.name}'
+
+    if info.arg_type == ArgType.APPEND:
+        if info.split is None:
+            yield f'append_value({field}, {count}, {source});'
+        else:
+            yield f"append_split({field}, {count}, {source}, '{info.split}');"
+    elif info.value_type == ValueType.STRING:
+        yield f'{field} = {source};'
     elif info.value_type == ValueType.INT:
         # FIXME: atol
-        yield f'ans.{info.name} = atol({source});'
+        yield f'{field} = atol({source});'
+    elif info.value_type == ValueType.ENUM:
+        yield f'{field} = {info.name}_from_string({source});'
     else:
         assert False, 'unreachable'
 
 
+def choices_func_gen(ctx: Context, struct_name: str, info: ArgInfo, options: GenOptions):
+    enum_type = cxx_value_type(info, struct_name)
+    with ctx.BLOCK(f'{enum_type} {info.name}_from_string(const char *value)'):
+        yield from choices_lookup_gen(ctx, info, 'nullptr')
+        with ctx.IF('index < 0'):
+            message = 'std::string(%s) + value + %s' % (
+                repr_c_string(f'bad value for {info.name}: '),
+                repr_c_string(', expect one of ' + ', '.join(info.choices)),
+            )
+            yield from throw_gen(options, 'bad_choice', message)
+        yield f'return static_cast<{enum_type}>(index);'
+
+
+def enum_to_string_method_gen(ctx: Context, struct_name: str, info: ArgInfo):
+    type_name = enum_type_name(info.name)
+    with ctx.BLOCK(f'const char *{struct_name}::to_string({type_name} value)'):
+        with ctx.BLOCK('switch (value)'):
+            for choice in info.choices:
+                yield Label(f'case {type_name}::{choice_to_enumerator(choice)}:')
+                yield f'return {repr_c_string(choice)};'
+        yield 'return "";'
+
+
+# error kinds counted by the instrumentation hooks
+instrument_errors = [
+    'unknown_option', 'unknown_flag', 'no_value', 'too_many_args',
+    'required', 'expect_more', 'bad_line', 'bad_choice', 'no_callback',
+]
+
+
+def throw_gen(options: GenOptions, error: str, message: str):
+    assert error in instrument_errors
+    if options.instrument:
+        yield f'ARGGEN_ERROR(err_{error});'
+    yield f'throw ArgError({message});'
+
+
+def hit_gen(options: GenOptions, info: ArgInfo):
+    if options.instrument:
+        yield f'ARGGEN_HIT(opt_{info.name});'
+
+
 def accept_arg_gen_with_default_check(ctx: Context, info: ArgInfo, source: str):
     yield from accept_arg_gen(ctx, info, source)
-    if info.default is None:
+    if info.arg_type == ArgType.ONE and info.default is None:
         yield f'has_{info.name} = true;'
 
 
-def use_next_arg_gen(ctx: Context, info: ArgInfo):
-    yield 'i++;'
-    with ctx.CONDITION():
-        with ctx.IF("i == args.size() || args[i][0] == '-'"):
-            yield 'throw ArgError("no value for " + piece);'
-        with ctx.ELSE():
-            yield from accept_arg_gen_with_default_check(ctx, info, 'args[i].data()')
+def env_layer_gen(ctx: Context, argsinfo: Sequence[ArgInfo]):
+    env_infos = sorted((info for info in argsinfo if info.env is not None), key=lambda ai: ai.name)
+    if not env_infos:
+        return
+
+    yield '// environment variables, over the defaults and under the args'
+    for info in env_infos:
+        # the value is taken from the environment in place, without copying it first
+        with ctx.IF(f'const char *env = getenv({repr_c_string(info.env)})'):
+            if info.arg_type == ArgType.BOOL:
+                yield f"ans.{info.name} = env[0] != '\\0' && strcmp(env, \"0\") != 0;"
+            elif info.arg_type == ArgType.COUNT:
+                yield f'ans.{info.name} = atol(env);'
+            else:
+                yield from accept_arg_gen_with_default_check(ctx, info, 'env')
+
+
+def use_next_arg_gen(ctx: Context, struct_name: str, info: ArgInfo, opt: str, options: GenOptions):
+    def take_gen(c: Context, message: str, field: str, has: str, count: str):
+        # the cursor may reuse the storage of piece, so piece is not referenced after this
+        yield 'const std::string *value = cursor.next();'
+        with c.IF("value == nullptr || (*value)[0] == '-'"):
+            yield from throw_gen(options, 'no_value', message)
+        yield from accept_arg_gen(c, info, 'value->data()', field, count)
+        if has is not None:
+            yield f'{has} = true;'
+
+    # the same block for every option of the same type, parameterized by the option
+    field, has, count = f'ans.{info.name}', None, None
+    field_type = cxx_value_type(info, struct_name)
+    if info.arg_type == ArgType.APPEND:
+        field_type = f'std::vector<{field_type}>'
+    params = [
+        ('Cursor &cursor', 'cursor'),
+        ('const char *opt', repr_c_string(opt)),
+        (f'{field_type} &field', field),
+    ]
+    if info.arg_type == ArgType.APPEND:
+        count = f'n_{info.name}'
+        params.append(('size_t &n', count))
+    elif info.default is None:
+        has = f'has_{info.name}'
+        params.append(('bool &has', has))
+
+    yield make_fragment(
+        'take_next_value', params,
+        partial(take_gen, message=repr_c_string('no value for ' + opt), field=field, has=has, count=count),
+        partial(
+            take_gen, message='std::string("no value for ") + opt', field='field',
+            has=None if has is None else 'has', count=None if count is None else 'n',
+        ),
+        template='template <class Cursor>',
+    )
 
 
 def use_this_arg_gen(ctx: Context, info: ArgInfo, offset: str):
@@ -471,7 +1227,100 @@ def classify_to(options: Sequence[str], short_list: List[str], long_long: List[s
     long_long.extend(long)
 
 
-def parse_args_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+def args_cursor_gen(ctx: Context):
+    yield '// yields the items of a vector'
+    with ctx.BLOCK('struct ArgsCursor', trailing_semiconlon=True):
+        yield 'const std::vector<std::string> &args;'
+        yield 'size_t i;'
+        yield ''
+        with ctx.BLOCK('const std::string *next()'):
+            yield 'return i < args.size() ? &args[i++] : nullptr;'
+
+
+def argv_cursor_gen(ctx: Context):
+    yield '// yields the items of argv one at a time into a reused buffer, without copying argv'
+    with ctx.BLOCK('struct ArgvCursor', trailing_semiconlon=True):
+        yield 'const char *const *argv;'
+        yield 'int argc;'
+        yield 'int i;'
+        yield 'std::string piece;'
+        yield ''
+        with ctx.BLOCK('const std::string *next()'):
+            with ctx.IF('i >= argc'):
+                yield 'return nullptr;'
+            yield 'piece.assign(argv[i++]);'
+            yield 'return &piece;'
+
+
+def line_cursor_gen(ctx: Context, options: GenOptions):
+    yield '// splits a command line like a POSIX shell (quotes and backslashes, no expansions),'
+    yield '// one argument at a time into a reused buffer'
+    with ctx.BLOCK('struct LineCursor', trailing_semiconlon=True):
+        yield 'const char *it;'
+        yield 'const char *end;'
+        yield 'std::string piece;'
+        yield ''
+        with ctx.BLOCK('static bool is_space(char ch)'):
+            yield "return ch == ' ' || ch == '\\t' || ch == '\\n';"
+        yield ''
+        yield '// characters that keep the special meaning of backslash inside double quotes'
+        with ctx.BLOCK('static bool is_dquote_escape(char ch)'):
+            yield "return ch == '\"' || ch == '\\\\' || ch == '$' || ch == '`' || ch == '\\n';"
+        yield ''
+        with ctx.BLOCK('const std::string *next()'):
+            with ctx.BLOCK('while (it != end && is_space(*it))'):
+                yield '++it;'
+            with ctx.IF('it == end'):
+                yield 'return nullptr;'
+            yield ''
+            yield 'piece.clear();'
+            with ctx.BLOCK('while (it != end && !is_space(*it))'):
+                yield 'char ch = *it++;'
+                with ctx.CONDITION():
+                    with ctx.IF("ch == '\\\\'"):
+                        with ctx.IF('it == end'):
+                            yield from throw_gen(options, 'bad_line', '"trailing backslash"')
+                        yield '// backslash-newline is a line continuation'
+                        with ctx.IF("*it != '\\n'"):
+                            yield 'piece += *it;'
+                        yield '++it;'
+                    with ctx.ELSEIF("ch == '\\''"):
+                        yield "const char *close = std::find(it, end, '\\'');"
+                        with ctx.IF('close == end'):
+                            yield from throw_gen(options, 'bad_line', '"unterminated single quote"')
+                        yield 'piece.append(it, close);'
+                        yield 'it = close + 1;'
+                    with ctx.ELSEIF("ch == '\"'"):
+                        with ctx.BLOCK('for (;;)'):
+                            with ctx.IF('it == end'):
+                                yield from throw_gen(options, 'bad_line', '"unterminated double quote"')
+                            yield 'ch = *it++;'
+                            with ctx.IF("ch == '\"'"):
+                                yield 'break;'
+                            with ctx.CONDITION():
+                                with ctx.IF("ch == '\\\\' && it != end && is_dquote_escape(*it)"):
+                                    with ctx.IF("*it != '\\n'"):
+                                        yield 'piece += *it;'
+                                    yield '++it;'
+                                with ctx.ELSE():
+                                    yield 'piece += ch;'
+                    with ctx.ELSE():
+                        yield 'piece += ch;'
+            yield 'return &piece;'
+
+
+def count_required_positions(position_infos: Sequence[ArgInfo]):
+    count = 0
+    for info in position_infos:
+        if info.default is not None:
+            break
+        count += 1
+    return count
+
+
+def parse_cursor_func_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], options: GenOptions
+):
     option_to_arginfo = dict()  # type: Dict[str, ArgInfo]
     short_flags = []
     short_args = []
@@ -482,6 +1331,7 @@ def parse_args_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[Arg
     position_args = []
     rest_arg = None
     required_options = []
+    append_names = []
 
     for info in argsinfo:
         for opt in info.options:
@@ -501,6 +1351,10 @@ def parse_args_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[Arg
         elif info.arg_type == ArgType.REST:
             assert rest_arg is None
             rest_arg = info
+        elif info.arg_type == ArgType.APPEND:
+            # takes a value like ONE
+            classify_to(info.options, short_args, long_args)
+            append_names.append(info.name)
         else:
             assert False, 'unreachable'
 
@@ -511,20 +1365,50 @@ def parse_args_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[Arg
     long_args.sort()
     long_count.sort()
     required_options.sort()
-
-    with ctx.BLOCK(f'{struct_name} {struct_name}::parse_args(const std::vector<std::string> &args)'):
-        yield f'{struct_name}' ' ans {};   // initialized'
+    append_names.sort()
+
+    yield 'template <class Cursor>'
+    with ctx.BLOCK(f'void parse_cursor({struct_name} &ans, Cursor &cursor)'):
+        if options.instrument:
+            yield 'ARGGEN_TIME_PARSE();'
+        yield '// reset to defaults, keeping the capacity of strings and vectors'
+        for info in sorted(argsinfo, key=lambda ai: ai.name):
+            yield from reset_value_gen(ctx, info, struct_name)
+        yield ''
         yield 'int position_count = 0;'
+        yield 'bool options_done = false;'
         yield '// required options'
         for opt in required_options:
             yield f'bool has_{opt} = false;'
+        yield from env_layer_gen(ctx, argsinfo)
 
-        with ctx.BLOCK('for (size_t i = 0; i < args.size(); i++)'):
-            yield 'const std::string &piece = args[i];'
+        with ctx.BLOCK('while (const std::string *cur = cursor.next())'):
+            yield 'const std::string &piece = *cur;'
 
             with ctx.CONDITION():
+                # positional args, everything after "--" included
+                with ctx.IF("options_done || piece.size() < 2 || piece[0] != '-'"):
+                    yield '// positional args'
+                    with ctx.CONDITION():
+                        for idx, opt in enumerate(position_args):
+                            info = option_to_arginfo[opt]
+                            with ctx.MATCH(f'position_count == {idx}'):
+                                yield from hit_gen(options, info)
+                                yield from accept_arg_gen(ctx, info, 'piece.data()')
+                        with ctx.ELSE():
+                            if rest_arg is not None:
+                                yield from hit_gen(options, rest_arg)
+                                yield from accecpt_rest_gen(ctx, rest_arg, options)
+                            else:
+                                yield from throw_gen(options, 'too_many_args', '"too many args: " + piece')
+                    yield 'position_count++;'
+
+                with ctx.ELSEIF("piece.size() == 2 && piece[1] == '-'"):
+                    yield '// "--", the rest are positional args'
+                    yield 'options_done = true;'
+
                 # long options
-                with ctx.IF("piece.size() > 2 && piece[0] == '-' && piece[1] == '-'"):
+                with ctx.ELSEIF("piece[1] == '-'"):
                     yield '// long options'
                     with ctx.CONDITION():
                         for opt in long_args:
@@ -532,38 +1416,47 @@ def parse_args_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[Arg
                             opt_str = repr_c_string(opt)
                             opt_eq_str = repr_c_string(opt + '=')
                             with ctx.MATCH(f'piece == {opt_str}'):
-                                yield from use_next_arg_gen(ctx, info)
+                                yield from hit_gen(options, info)
+                                yield from use_next_arg_gen(ctx, struct_name, info, opt, options)
                             with ctx.MATCH(
                                 f'piece.compare(0, strlen({opt_eq_str}), {opt_eq_str}) == 0'
                             ):
+                                yield from hit_gen(options, info)
                                 yield from use_this_arg_gen(ctx, info, f'strlen({opt_eq_str})')
                         for opt in long_flags:
                             info = option_to_arginfo[opt]
                             opt_str = repr_c_string(opt)
                             with ctx.MATCH(f'piece == {opt_str}'):
+                                yield from hit_gen(options, info)
                                 yield f'ans.{info.name} = true;'
                         for opt in long_count:
                             info = option_to_arginfo[opt]
                             opt_str = repr_c_string(opt)
                             with ctx.MATCH(f'piece == {opt_str}'):
+                                yield from hit_gen(options, info)
                                 yield f'ans.{info.name}++;'
 
                         with ctx.ELSE():
-                            yield 'throw ArgError("Unknown option: " + piece);'
+                            message = '"Unknown option: " + piece'
+                            if suggestion_table(argsinfo):
+                                yield 'const char *suggestion = suggest_option(piece.c_str());'
+                                message += ' + (suggestion ? std::string(", did you mean ") + suggestion + "?" : "")'
+                            yield from throw_gen(options, 'unknown_option', message)
 
                 # short options
-                with ctx.ELSEIF("piece.size() >= 2 && piece[0] == '-'"):
+                with ctx.ELSE():
                     yield '// short options'
                     with ctx.CONDITION():
                         for opt in short_args:
                             opt_char = opt[1]
                             info = option_to_arginfo[opt]
                             with ctx.MATCH(f"piece[1] == '{opt_char}'"):
+                                yield from hit_gen(options, info)
                                 with ctx.CONDITION():
                                     with ctx.IF('piece.size() > 2'):
                                         yield from use_this_arg_gen(ctx, info, '2')
                                     with ctx.ELSE():
-                                        yield from use_next_arg_gen(ctx, info)
+                                        yield from use_next_arg_gen(ctx, struct_name, info, opt, options)
                         with ctx.ELSE():
                             with ctx.BLOCK('for (auto it = piece.begin() + 1; it != piece.end(); ++it)'):
                                 with ctx.CONDITION():
@@ -571,56 +1464,175 @@ def parse_args_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[Arg
                                         info = option_to_arginfo[opt]
                                         opt_char = opt[1]
                                         with ctx.MATCH(f"*it == '{opt_char}'"):
+                                            yield from hit_gen(options, info)
                                             yield f'ans.{info.name} = true;'
                                     for opt in short_count:
                                         info = option_to_arginfo[opt]
                                         opt_char = opt[1]
                                         with ctx.MATCH(f"*it == '{opt_char}'"):
-                                                yield f'ans.{info.name}++;'
+                                            yield from hit_gen(options, info)
+                                            yield f'ans.{info.name}++;'
 
                                     with ctx.ELSE():
-                                        yield 'throw ArgError("Unknown flag: " + std::string(1, *it));'
-
-                # positional args
-                with ctx.ELSE():
-                    yield '// positional args'
-                    with ctx.CONDITION():
-                        for idx, opt in enumerate(position_args):
-                            info = option_to_arginfo[opt]
-                            with ctx.MATCH(f'position_count == {idx}'):
-                                yield from accept_arg_gen(ctx, info, 'piece.data()')
-                        with ctx.ELSE():
-                            if rest_arg is not None:
-                                yield from accecpt_rest_gen(ctx, rest_arg)
-                            else:
-                                yield 'throw ArgError("too many args: " + piece);'
-                    yield 'position_count++;'
+                                        yield from throw_gen(
+                                            options, 'unknown_flag', '"Unknown flag: " + std::string(1, *it)'
+                                        )
 
         yield ''
         yield '// check required options'
         for opt in required_options:
             with ctx.IF(f'!has_{opt}'):
-                yield f'throw ArgError("{opt} required");'
+                yield from throw_gen(options, 'required', f'"{opt} required"')
 
         yield '// check positional args'
-        required_position_count = 0
-        for opt in position_args:
-            if option_to_arginfo[opt].default is None:
-                required_position_count += 1
-            else:
-                break
+        required_position_count = count_required_positions(
+            [option_to_arginfo[opt] for opt in position_args]
+        )
         with ctx.IF(f'position_count < {required_position_count}'):
-            yield 'throw ArgError("expect more argument");'
+            yield from throw_gen(options, 'expect_more', '"expect more argument"')
+
+        list_names = append_names[:]
+        if rest_arg is not None and not rest_arg.stream:
+            list_names = sorted(list_names + [rest_arg.name])
+        if list_names:
+            yield ''
+            yield '// drop the items left over from previous parses'
+        for name in list_names:
+            yield f'ans.{name}.resize(n_{name});'
+
+
+def reserved_fields(argsinfo: Sequence[ArgInfo]):
+    """The vectors reserved by the first pass over the args: the rest and append options."""
+    return [info for info in argsinfo if is_list_option(info) and not info.stream]
+
+
+def reserve_vectors_func_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    rest_arg = None
+    position_count = 0
+    long_args, short_args = [], []      # type: List[Tuple[str, ArgInfo]]
+    for info in argsinfo:
+        if info.arg_type == ArgType.REST:
+            rest_arg = None if info.stream else info
+        elif info.arg_type == ArgType.ONE and is_position_option(info.options):
+            position_count += 1
+        elif info.arg_type in (ArgType.ONE, ArgType.APPEND):
+            short, long = classify_options(info.options)
+            short_args.extend((opt, info) for opt in short)
+            long_args.extend((opt, info) for opt in long)
+    long_args.sort(key=lambda item: item[0])
+    short_args.sort(key=lambda item: item[0])
+    append_infos = sorted(
+        (info for info in argsinfo if info.arg_type == ArgType.APPEND), key=lambda ai: ai.name,
+    )
+
+    def add_items_gen(info: ArgInfo, value: str):
+        if info.split is None:
+            yield f'n_{info.name}++;'
+        else:
+            yield f"n_{info.name} += count_items({value}, '{info.split}');"
+
+    if any(info.split is not None for info in append_infos):
+        with ctx.BLOCK('inline size_t count_items(const char *value, char sep)'):
+            yield 'size_t count = 1;'
+            with ctx.BLOCK("for (; *value != '\\0'; ++value)"):
+                yield 'count += *value == sep;'
+            yield 'return count;'
+        yield ''
+
+    yield '// the first pass over the args: counts the positional args, those after "--" included,'
+    yield '// and the values of append options, skipping the values of the other options, so that'
+    yield '// the vectors are reserved exactly. linear and allocates nothing, the parse that follows'
+    yield '// checks everything.'
+    yield 'template <class Get>'
+    with ctx.BLOCK(f'void reserve_vectors({struct_name} &ans, size_t size, Get get)'):
+        if rest_arg is not None:
+            yield 'size_t count = 0;'
+        for info in append_infos:
+            yield f'size_t n_{info.name} = 0;'
+        with ctx.BLOCK('for (size_t i = 0; i < size; i++)'):
+            yield 'const char *piece = get(i);'
+            with ctx.CONDITION():
+                with ctx.IF("piece[0] != '-' || piece[1] == '\\0'"):
+                    if rest_arg is not None:
+                        yield 'count++;'
+                    else:
+                        yield '// positional'
+                with ctx.ELSEIF("piece[1] == '-' && piece[2] == '\\0'"):
+                    if rest_arg is not None:
+                        yield 'count += size - i - 1;'
+                    yield 'break;'
+                for opt, info in long_args:
+                    with ctx.ELSEIF(f'strcmp(piece, {repr_c_string(opt)}) == 0'):
+                        if info.arg_type == ArgType.APPEND:
+                            with ctx.IF('i + 1 < size'):
+                                yield from add_items_gen(info, 'get(i + 1)')
+                        yield 'i++;    // the value'
+                    if info.arg_type == ArgType.APPEND:
+                        opt_eq = opt + '='
+                        with ctx.ELSEIF(f'strncmp(piece, {repr_c_string(opt_eq)}, {len(opt_eq)}) == 0'):
+                            yield from add_items_gen(info, f'piece + {len(opt_eq)}')
+                for opt, info in short_args:
+                    if info.arg_type == ArgType.APPEND:
+                        with ctx.ELSEIF(f"piece[1] == '{opt[1]}'"):
+                            with ctx.CONDITION():
+                                with ctx.IF("piece[2] != '\\0'"):
+                                    yield from add_items_gen(info, 'piece + 2')
+                                with ctx.ELSE():
+                                    with ctx.IF('i + 1 < size'):
+                                        yield from add_items_gen(info, 'get(i + 1)')
+                                    yield 'i++;    // the value'
+                one_chars = [opt[1] for opt, info in short_args if info.arg_type == ArgType.ONE]
+                if one_chars:
+                    chars = ' || '.join(f"piece[1] == '{ch}'" for ch in one_chars)
+                    with ctx.ELSEIF(f"piece[2] == '\\0' && ({chars})"):
+                        yield 'i++;    // the value'
+        if rest_arg is not None and position_count == 0:
+            yield f'ans.{rest_arg.name}.reserve(count);'
+        elif rest_arg is not None:
+            with ctx.IF(f'count > {position_count}'):
+                yield f'ans.{rest_arg.name}.reserve(count - {position_count});'
+        for info in append_infos:
+            yield f'ans.{info.name}.reserve(n_{info.name});'
+
+
+def parse_args_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    with ctx.BLOCK(f'{struct_name} {struct_name}::parse_args(const std::vector<std::string> &args)'):
+        yield f'{struct_name}' ' ans {};   // initialized'
+        yield f'{struct_name}::parse_into(ans, args);'
+        yield 'return ans;'
+
+    yield ''
+    with ctx.BLOCK(f'void {struct_name}::parse_into({struct_name} &out, const std::vector<std::string> &args)'):
+        if reserved_fields(argsinfo):
+            yield 'reserve_vectors(out, args.size(), [&args](size_t i) { return args[i].c_str(); });'
+        yield 'ArgsCursor cursor {args, 0};'
+        yield 'parse_cursor(out, cursor);'
 
+
+def parse_line_method_gen(ctx: Context, struct_name: str):
+    with ctx.BLOCK(f'{struct_name} {struct_name}::parse_line(const std::string &line)'):
+        yield f'{struct_name}' ' ans {};   // initialized'
+        yield f'{struct_name}::parse_line_into(ans, line);'
         yield 'return ans;'
 
+    yield ''
+    with ctx.BLOCK(f'void {struct_name}::parse_line_into({struct_name} &out, const std::string &line)'):
+        yield 'LineCursor cursor {line.data(), line.data() + line.size(), {}};'
+        yield 'parse_cursor(out, cursor);'
+
 
-def parse_argv_method_gen(ctx: Context, struct_name: str):
+def parse_argv_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
     with ctx.BLOCK(f'{struct_name} {struct_name}::parse_argv(int argc, const char *const argv[])'):
-        yield 'std::vector<std::string> args;'
-        with ctx.BLOCK('for (int i = 1; i < argc; i++)'):
-            yield 'args.emplace_back(argv[i]);'
-        yield f'return {struct_name}::parse_args(args);'
+        yield f'{struct_name}' ' ans {};   // initialized'
+        yield f'{struct_name}::parse_argv_into(ans, argc, argv);'
+        yield 'return ans;'
+
+    yield ''
+    with ctx.BLOCK(f'void {struct_name}::parse_argv_into({struct_name} &out, int argc, const char *const argv[])'):
+        if reserved_fields(argsinfo):
+            yield 'reserve_vectors(out, argc > 1 ? (size_t)(argc - 1) : 0, [argv](size_t i) { return argv[i + 1]; });'
+        yield 'ArgvCursor cursor {argv, argc, 1, {}};'
+        yield 'parse_cursor(out, cursor);'
 
 
 def to_string_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
@@ -630,9 +1642,11 @@ def to_string_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgI
         yield f'std::string ans = "<{struct_name}";'
 
         for info in argsinfo:
+            if info.stream:
+                continue
             yield 'ans += %s;' % (repr_c_string(' ' + info.name + '='),)
 
-            if info.arg_type == ArgType.REST:
+            if is_list_option(info):
                 with ctx.BLOCK(f'for (const auto &item : this->{info.name})'):
                     if info.value_type == ValueType.STRING:
                         yield 'ans += item + ",";'
@@ -647,6 +1661,8 @@ def to_string_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgI
                     yield f'ans += std::to_string(this->{info.name});'
                 elif info.value_type == ValueType.STRING:
                     yield f'ans += \'"\' + this->{info.name} + \'"\';'
+                elif info.value_type == ValueType.ENUM:
+                    yield f'ans += to_string(this->{info.name});'
                 else:
                     assert False, 'unreachable'
 
@@ -657,68 +1673,1432 @@ def prefix_list(prefix: str, arr: List):
     return [(prefix + x) for x in arr]
 
 
-def comparison_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
-    names = sorted(info.name for info in argsinfo)
+def comparison_method_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], options: GenOptions
+):
+    # callbacks are not comparable
+    names = [info.name for info in layout_order(argsinfo, options) if not info.stream]
     lhs_tuple = ', '.join(prefix_list('this->', names))
     rhs_tuple = ', '.join(prefix_list('rhs.', names))
 
     with ctx.BLOCK(f'bool {struct_name}::operator==(const {struct_name} &rhs) const'):
-        yield f'return std::tie({lhs_tuple}) \\'
-        yield f'    == std::tie({rhs_tuple});'
+        if not options.compact:
+            yield f'return std::tie({lhs_tuple}) \\'
+            yield f'    == std::tie({rhs_tuple});'
+        elif len(names) == 0:
+            yield 'return true;'
+        else:
+            # std::tie() does not bind bitfields, compared in the order of layout
+            for idx, name in enumerate(names):
+                head = 'return ' if idx == 0 else '    && '
+                tail = ';' if idx == len(names) - 1 else ''
+                yield f'{head}this->{name} == rhs.{name}{tail}'
 
     with ctx.BLOCK(f'bool {struct_name}::operator!=(const {struct_name} &rhs) const'):
         yield 'return !(*this == rhs);'
 
 
-def warning_gen():
-    yield '// WARNING: Automatically generated code by arggen.py. Do not edit.'
-
+serialize_format_version = 1
 
-def header_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str):
-    yield f'#ifndef ARGGEN_{source_name.upper()}_H'
-    yield f'#define ARGGEN_{source_name.upper()}_H'
-    yield ''
-    yield from warning_gen()
-    yield ''
-    yield '#include <stdexcept>'
-    yield '#include <string>'
-    yield '#include <tuple>'
-    yield '#include <vector>'
-    yield from ('', '')
 
-    with ctx.BLOCK('class ArgError : public std::runtime_error', trailing_semiconlon=True):
-        yield Label('public:')
-        yield 'ArgError(const std::string &msg) : std::runtime_error(msg) {}'
-    yield from ('', '')
+def serialized_fields(argsinfo: Sequence[ArgInfo]):
+    """The fields in the serialized data: the flags first, then the others, each by name.
+    Independent of the layout, callbacks are left out."""
+    fields = sorted((info for info in argsinfo if not info.stream), key=lambda ai: ai.name)
+    flags = [info for info in fields if info.value_type == ValueType.BOOL]
+    others = [info for info in fields if info.value_type != ValueType.BOOL]
+    return flags, others
 
-    yield from struct_gen(ctx, struct_name, argsinfo)
-    yield ''
 
-    yield f'#endif // ARGGEN_{source_name.upper()}_H'
-    yield ''
+def schema_fingerprint(argsinfo: Sequence[ArgInfo]):
+    flags, others = serialized_fields(argsinfo)
+    schema = ';'.join(
+        f'{info.name}:{info.arg_type.name}:{info.value_type.name}:{",".join(info.choices or ())}'
+        for info in flags + others
+    )
+    # 64 bit FNV-1a
+    value = 14695981039346656037
+    for byte in schema.encode():
+        value = ((value ^ byte) * 1099511628211) & 0xffffffffffffffff
+    return value
 
 
-def source_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str):
-    yield '#include <cstdlib>   // atol'
-    yield '#include <cstring>   // strlen'
-    yield '#include <string>    // to_string'
-    yield f'#include "{source_name}.h"'
+def serialize_utils_gen(ctx: Context, argsinfo: Sequence[ArgInfo]):
+    yield f'const uint64_t schema_fingerprint = {hex(schema_fingerprint(argsinfo))}ull;'
     yield ''
-    yield from warning_gen()
-    yield from ('', '')
-
-    yield from comparison_method_gen(ctx, struct_name, argsinfo)
+    yield '// inline, since some may not be used by the fields'
+    with ctx.BLOCK('inline void put_varint(std::string &buffer, uint64_t value)'):
+        with ctx.BLOCK('while (value >= 0x80)'):
+            yield 'buffer += static_cast<char>(value | 0x80);'
+            yield 'value >>= 7;'
+        yield 'buffer += static_cast<char>(value);'
+    yield ''
+    with ctx.BLOCK('inline void put_int(std::string &buffer, int value)'):
+        yield '// zigzag, small negative numbers stay short'
+        yield 'int64_t wide = value;'
+        yield 'put_varint(buffer, wide < 0'
+        yield '    ? (static_cast<uint64_t>(-(wide + 1)) << 1) | 1 : static_cast<uint64_t>(wide) << 1);'
+    yield ''
+    with ctx.BLOCK('inline void put_string(std::string &buffer, const std::string &value)'):
+        yield 'put_varint(buffer, value.size());'
+        yield 'buffer += value;'
+    yield ''
+    with ctx.BLOCK('inline void put_fixed64(std::string &buffer, uint64_t value)'):
+        with ctx.BLOCK('for (int i = 0; i < 8; i++)'):
+            yield 'buffer += static_cast<char>(value >> (8 * i));'
+    yield ''
+    with ctx.BLOCK('struct Reader', trailing_semiconlon=True):
+        yield 'const char *it;'
+        yield 'const char *end;'
+        yield ''
+        with ctx.BLOCK('unsigned char byte()'):
+            with ctx.IF('it == end'):
+                yield 'throw ArgError("truncated data");'
+            yield 'return static_cast<unsigned char>(*it++);'
+        yield ''
+        with ctx.BLOCK('uint64_t varint()'):
+            yield 'uint64_t value = 0;'
+            with ctx.BLOCK('for (int shift = 0; shift < 64; shift += 7)'):
+                yield 'unsigned char ch = byte();'
+                yield 'value |= static_cast<uint64_t>(ch & 0x7f) << shift;'
+                with ctx.IF('!(ch & 0x80)'):
+                    yield 'return value;'
+            yield 'throw ArgError("bad varint");'
+        yield ''
+        with ctx.BLOCK('int integer()'):
+            yield 'uint64_t value = varint();'
+            yield 'int64_t wide = value & 1 ? -static_cast<int64_t>(value >> 1) - 1 : static_cast<int64_t>(value >> 1);'
+            with ctx.IF('wide < INT_MIN || wide > INT_MAX'):
+                yield 'throw ArgError("int out of range");'
+            yield 'return static_cast<int>(wide);'
+        yield ''
+        with ctx.BLOCK('int index(uint64_t count)'):
+            yield 'uint64_t value = varint();'
+            with ctx.IF('value >= count'):
+                yield 'throw ArgError("bad enum value");'
+            yield 'return static_cast<int>(value);'
+        yield ''
+        yield '// every item takes a byte at least, so a bad count is not allocated'
+        with ctx.BLOCK('size_t count()'):
+            yield 'uint64_t value = varint();'
+            with ctx.IF('value > static_cast<uint64_t>(end - it)'):
+                yield 'throw ArgError("truncated data");'
+            yield 'return static_cast<size_t>(value);'
+        yield ''
+        with ctx.BLOCK('void string(std::string &out)'):
+            yield 'size_t size = count();'
+            yield 'out.assign(it, size);'
+            yield 'it += size;'
+        yield ''
+        with ctx.BLOCK('uint64_t fixed64()'):
+            yield 'uint64_t value = 0;'
+            with ctx.BLOCK('for (int i = 0; i < 8; i++)'):
+                yield 'value |= static_cast<uint64_t>(byte()) << (8 * i);'
+            yield 'return value;'
+
+
+def serialize_method_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    """Format: version byte, 8 bytes of schema fingerprint (little endian), the flags packed
+    8 per byte, then the other fields: ints as zigzag varints, enums as varint indexes,
+    strings as varint length and bytes, rest and append as varint count and items."""
+    flags, others = serialized_fields(argsinfo)
+
+    with ctx.BLOCK(f'void {struct_name}::serialize(std::string &buffer) const'):
+        yield f'buffer += static_cast<char>({serialize_format_version});   // version'
+        yield 'put_fixed64(buffer, schema_fingerprint);'
+        for start in range(0, len(flags), 8):
+            yield 'buffer += static_cast<char>(0'
+            for bit, info in enumerate(flags[start:start + 8]):
+                yield f'    | (this->{info.name} ? {hex(1 << bit)} : 0)'
+            yield ');'
+        for info in others:
+            field = f'this->{info.name}'
+            if is_list_option(info):
+                yield f'put_varint(buffer, {field}.size());'
+                with ctx.BLOCK(f'for (const auto &item : {field})'):
+                    if info.value_type == ValueType.STRING:
+                        yield 'put_string(buffer, item);'
+                    else:
+                        yield 'put_int(buffer, item);'
+            elif info.value_type == ValueType.STRING:
+                yield f'put_string(buffer, {field});'
+            elif info.value_type == ValueType.INT:
+                yield f'put_int(buffer, {field});'
+            elif info.value_type == ValueType.ENUM:
+                yield f'put_varint(buffer, static_cast<uint64_t>({field}));'
+            else:
+                assert False, 'unreachable'
+
     yield from ('', '')
+    with ctx.BLOCK(f'{struct_name} {struct_name}::deserialize(const std::string &buffer)'):
+        yield f'{struct_name}' ' ans {};   // initialized'
+        yield f'{struct_name}::deserialize_into(ans, buffer.data(), buffer.size());'
+        yield 'return ans;'
+
+    yield ''
+    with ctx.BLOCK(f'void {struct_name}::deserialize_into({struct_name} &out, const char *data, size_t size)'):
+        yield 'Reader reader {data, data + size};'
+        with ctx.IF(f'reader.byte() != {serialize_format_version}'):
+            yield 'throw ArgError("unsupported serialization format");'
+        with ctx.IF('reader.fixed64() != schema_fingerprint'):
+            yield f'throw ArgError("serialized by another schema of {struct_name}");'
+        for start in range(0, len(flags), 8):
+            yield f'{"unsigned char " if start == 0 else ""}bits = reader.byte();'
+            for bit, info in enumerate(flags[start:start + 8]):
+                yield f'out.{info.name} = (bits & {hex(1 << bit)}) != 0;'
+        for info in others:
+            field = f'out.{info.name}'
+            if is_list_option(info):
+                yield '// the existing items are reused'
+                yield f'{field}.resize(reader.count());'
+                with ctx.BLOCK(f'for (auto &item : {field})'):
+                    if info.value_type == ValueType.STRING:
+                        yield 'reader.string(item);'
+                    else:
+                        yield 'item = reader.integer();'
+            elif info.value_type == ValueType.STRING:
+                yield f'reader.string({field});'
+            elif info.value_type == ValueType.INT:
+                yield f'{field} = reader.integer();'
+            elif info.value_type == ValueType.ENUM:
+                yield f'{field} = static_cast<{cxx_value_type(info)}>(reader.index({len(info.choices)}));'
+            else:
+                assert False, 'unreachable'
+        with ctx.IF('reader.it != reader.end'):
+            yield 'throw ArgError("trailing bytes");'
+
+
+def warning_gen():
+    yield '// WARNING: Automatically generated code by arggen.py. Do not edit.'
+
+
+usage_width = 80
+usage_help_column = 24      # where the help starts, as argparse does
+
+
+def wrap_words(words: Sequence[str], width: int) -> List[str]:
+    lines = []  # type: List[str]
+    for word in words:
+        if lines and len(lines[-1]) + 1 + len(word) <= width:
+            lines[-1] += ' ' + word
+        else:
+            lines.append(word)
+    return lines
+
+
+def usage_metavar(info: ArgInfo):
+    if info.value_type == ValueType.ENUM:
+        return '{%s}' % (','.join(info.choices),)
+    return info.name.upper()
+
+
+def usage_entry(info: ArgInfo) -> Tuple[str, str]:
+    """Returns (synopsis in the usage line, invocation in the list of options)."""
+    if info.arg_type == ArgType.REST:
+        return f'[{info.options[0]} ...]', f'{info.options[0]} ...'
+    if is_position_option(info.options):
+        synopsis = info.options[0] if info.default is None else f'[{info.options[0]}]'
+        return synopsis, info.options[0]
+
+    short, long = classify_options(info.options)
+    synopsis, invocation = (short + long)[0], ', '.join(short + long)
+    if info.arg_type == ArgType.APPEND:
+        metavar = usage_metavar(info)
+        if info.split is not None:
+            metavar = f'{metavar}[{info.split}{metavar}...]'
+        return f'[{synopsis} {metavar}]...', f'{invocation} {metavar}'
+    if info.arg_type == ArgType.ONE:
+        synopsis += ' ' + usage_metavar(info)
+        invocation += ' ' + usage_metavar(info)
+        if info.default is None:
+            return synopsis, invocation
+    return f'[{synopsis}]', invocation
+
+
+def usage_help(info: ArgInfo) -> List[str]:
+    words = (info.help or '').split()
+    # not broken across lines
+    if info.arg_type == ArgType.ONE and info.default is not None:
+        words.append(f'(default: {info.default})')
+    if info.env is not None:
+        words.append(f'[env: {info.env}]')
+    return words
+
+
+def usage_text(prog: str, argsinfo: Sequence[ArgInfo]) -> str:
+    """The usage line and the options with their help, wrapped and aligned like argparse."""
+    positions, others = [], []
+    for info in argsinfo:
+        if info.arg_type == ArgType.REST or is_position_option(info.options):
+            positions.append(info)
+        else:
+            others.append(info)
+
+    prefix = f'usage: {prog}'
+    synopses = wrap_words(
+        [usage_entry(info)[0] for info in others + positions], usage_width - len(prefix) - 1,
+    )
+    lines = [prefix + ''.join(' ' + line for line in synopses[:1])]
+    lines.extend(' ' * len(prefix) + ' ' + line for line in synopses[1:])
+
+    for title, group in (('positional arguments:', positions), ('options:', others)):
+        if not group:
+            continue
+        lines.extend(['', title])
+        for info in group:
+            head = '  ' + usage_entry(info)[1]
+            help_lines = wrap_words(usage_help(info), usage_width - usage_help_column)
+            if help_lines and len(head) + 2 <= usage_help_column:
+                lines.append(head.ljust(usage_help_column) + help_lines.pop(0))
+            else:
+                lines.append(head)
+            lines.extend(' ' * usage_help_column + line for line in help_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def c_string_lines(text: str) -> List[str]:
+    """The text as adjacent string literals, one per line."""
+    return [repr_c_string(line) for line in text.splitlines(keepends=True)]
+
+
+def usage_decl_gen(decl: str, text: str):
+    yield decl + ' ='
+    lines = c_string_lines(text)
+    for line in lines[:-1]:
+        yield '    ' + line
+    yield '    ' + lines[-1] + ';'
+
+
+def suggestion_table(argsinfo: Sequence[ArgInfo]) -> List[Tuple[str, int]]:
+    """(long option, max edit distance) of the candidates of "did you mean", by option."""
+    table = []
+    for info in argsinfo:
+        if info.arg_type == ArgType.REST or is_position_option(info.options):
+            continue
+        _, long = classify_options(info.options)
+        # a third of the word may be mistyped, at least one character
+        table.extend((opt, max(1, (len(opt) - 2) // 3)) for opt in long)
+    return sorted(table)
+
+
+def suggest_option_gen(ctx: Context, table: Sequence[Tuple[str, int]], null: str):
+    """Returns the closest option to the c string `piece` by edit distance, or null.
+
+    Shared by the c and c++ targets, only called on errors. The candidates, their lengths and
+    the distances allowed are computed by arggen, the part of piece after '=' is ignored.
+    """
+    yield '// candidates: (option, length, max edit distance), computed by arggen'
+    with ctx.BLOCK(
+        f'static const struct {{ const char *option; size_t length; size_t max_distance; }} '
+        f'table[{len(table)}] =',
+        trailing_semiconlon=True,
+    ):
+        for opt, max_distance in table:
+            yield f'{{{repr_c_string(opt)}, {len(opt)}, {max_distance}}},'
+    yield 'const size_t length = strcspn(piece, "=");'
+    yield f'const char *best = {null};'
+    yield 'size_t best_distance = (size_t)-1;'
+    yield '// a row of the levenshtein matrix, over the longest option'
+    yield f'size_t row[{max(len(opt) for opt, _ in table) + 1}];'
+    with ctx.BLOCK(f'for (size_t k = 0; k < {len(table)}; k++)'):
+        yield 'const char *option = table[k].option;'
+        yield 'const size_t n = table[k].length;'
+        with ctx.IF('(length > n ? length - n : n - length) > table[k].max_distance'):
+            yield 'continue;'
+        with ctx.BLOCK('for (size_t j = 0; j <= n; j++)'):
+            yield 'row[j] = j;'
+        with ctx.BLOCK('for (size_t i = 1; i <= length; i++)'):
+            yield 'size_t diagonal = row[0];'
+            yield 'row[0] = i;'
+            with ctx.BLOCK('for (size_t j = 1; j <= n; j++)'):
+                yield 'const size_t above = row[j];'
+                yield 'size_t value = diagonal + (piece[i - 1] == option[j - 1] ? 0 : 1);'
+                with ctx.IF('above + 1 < value'):
+                    yield 'value = above + 1;'
+                with ctx.IF('row[j - 1] + 1 < value'):
+                    yield 'value = row[j - 1] + 1;'
+                yield 'row[j] = value;'
+                yield 'diagonal = above;'
+        yield '// an exact match is a known option misused, nothing to suggest'
+        with ctx.IF('row[n] > 0 && row[n] <= table[k].max_distance && row[n] < best_distance'):
+            yield 'best = option;'
+            yield 'best_distance = row[n];'
+    yield 'return best;'
+
+
+def header_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str,
+        options: GenOptions
+):
+    yield f'#ifndef ARGGEN_{source_name.upper()}_H'
+    yield f'#define ARGGEN_{source_name.upper()}_H'
+    yield ''
+    yield from warning_gen()
+    yield ''
+    if any(info.stream for info in argsinfo):
+        yield '#include <functional>'
+    yield '#include <initializer_list>'
+    yield '#include <stdexcept>'
+    yield '#include <string>'
+    yield '#include <tuple>'
+    yield '#include <vector>'
+    if options.instrument:
+        yield '#ifdef ARGGEN_INSTRUMENT'
+        yield '#include <atomic>'
+        yield '#include <chrono>'
+        yield '#endif'
+    yield from ('', '')
+
+    with ctx.BLOCK('class ArgError : public std::runtime_error', trailing_semiconlon=True):
+        yield Label('public:')
+        yield 'ArgError(const std::string &msg) : std::runtime_error(msg) {}'
+    yield from ('', '')
+
+    yield from struct_gen(ctx, struct_name, argsinfo, source_name, options)
+    yield ''
+
+    yield f'#endif // ARGGEN_{source_name.upper()}_H'
+    yield ''
+
+
+def source_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str,
+        options: GenOptions
+):
+    enum_infos = [info for info in argsinfo if info.value_type == ValueType.ENUM]
+
+    yield '#include <algorithm> // find'
+    yield '#include <climits>   // INT_MIN, INT_MAX'
+    yield '#include <cstdint>   // uint32_t, uint64_t'
+    yield '#include <cstdlib>   // atol, getenv'
+    yield '#include <cstring>   // strlen, strcspn'
+    yield '#include <string>    // to_string'
+    yield f'#include "{source_name}.h"'
+    yield ''
+    yield from warning_gen()
+    yield from ('', '')
+
+    yield '// the definition of the static member, required before c++17'
+    yield f'constexpr char {struct_name}::usage[];'
+    yield from ('', '')
+
+    if options.instrument:
+        yield from instrument_def_gen(ctx, struct_name)
+        yield from ('', '')
+
+    if options.compact:
+        yield from constructor_gen(ctx, struct_name, argsinfo, options)
+        yield from ('', '')
+    yield from comparison_method_gen(ctx, struct_name, argsinfo, options)
+    yield from ('', '')
+    for info in enum_infos:
+        yield from enum_to_string_method_gen(ctx, struct_name, info)
+        yield from ('', '')
     yield from to_string_method_gen(ctx, struct_name, argsinfo)
     yield from ('', '')
+    with ctx.BLOCK('namespace'):
+        yield ''
+        yield from args_cursor_gen(ctx)
+        yield ''
+        yield from argv_cursor_gen(ctx)
+        yield ''
+        yield from line_cursor_gen(ctx, options)
+        yield ''
+        yield from serialize_utils_gen(ctx, argsinfo)
+        yield ''
+        if any(info.arg_type == ArgType.APPEND for info in argsinfo):
+            yield from append_utils_gen(ctx)
+            yield ''
+        for info in enum_infos:
+            yield from choices_func_gen(ctx, struct_name, info, options)
+            yield ''
+        table = suggestion_table(argsinfo)
+        if table:
+            with ctx.BLOCK('const char *suggest_option(const char *piece)'):
+                yield from suggest_option_gen(ctx, table, 'nullptr')
+            yield ''
+        if reserved_fields(argsinfo):
+            yield from reserve_vectors_func_gen(ctx, struct_name, argsinfo)
+            yield ''
+        yield HelperSlot()
+        yield from parse_cursor_func_gen(ctx, struct_name, argsinfo, options)
+        yield ''
+    yield from ('', '')
     yield from parse_args_method_gen(ctx, struct_name, argsinfo)
     yield from ('', '')
-    yield from parse_argv_method_gen(ctx, struct_name)
+    yield from parse_line_method_gen(ctx, struct_name)
+    yield from ('', '')
+    yield from parse_argv_method_gen(ctx, struct_name, argsinfo)
+    yield from ('', '')
+    yield from serialize_method_gen(ctx, struct_name, argsinfo)
     yield ''
 
 
+def reject_stream_rest(argsinfo: Sequence[ArgInfo], target: str):
+    for info in argsinfo:
+        if info.stream:
+            raise BadConfiguration(f'streaming rest option {info.name} is not supported by the {target} target')
+
+
+def reject_python_keywords(argsinfo: Sequence[ArgInfo], target: str):
+    # the fields are attributes, self.from would be a SyntaxError
+    from keyword import iskeyword
+
+    for info in argsinfo:
+        if iskeyword(info.name):
+            raise BadConfiguration(
+                f'option name {info.name} is a python keyword, not supported by the {target} target, '
+                'rename it with name='
+            )
+
+
+def reject_append(argsinfo: Sequence[ArgInfo], target: str):
+    for info in argsinfo:
+        if info.arg_type == ArgType.APPEND:
+            raise BadConfiguration(f'append option {info.name} is not supported by the {target} target')
+
+
 # end xxx_gen
 
+# begin python target
+
+
+value_type_to_py_converter = {
+    ValueType.STRING: 'str',
+    ValueType.INT: '_atol',
+}
+
+
+def py_converter(info: ArgInfo):
+    if info.value_type == ValueType.ENUM:
+        return f'_choice({info.name!r}, {info.choices!r})'
+    return value_type_to_py_converter[info.value_type]
+
+
+def py_default_value(info: ArgInfo):
+    if is_list_option(info):
+        return '[]'
+    elif info.default is not None:
+        return repr(info.default)
+    elif info.value_type == ValueType.STRING:
+        return "''"
+    elif info.value_type == ValueType.INT:
+        return '0'
+    elif info.value_type == ValueType.ENUM:
+        return repr(info.choices[0])
+    else:
+        assert False, 'unreachable'
+
+
+def py_dict_gen(name: str, items: Dict[str, str]):
+    yield name + ' = {'
+    for key in sorted(items):
+        yield f'    {key!r}: {items[key]},'
+    yield '}'
+
+
+def py_atol_func_gen(ctx: Context):
+    with ctx.SUITE('def _atol(string)'):
+        yield '# same as atol() of c: leading blanks, an optional sign, then digits'
+        yield "string = string.lstrip(' \\t\\n\\v\\f\\r')"
+        yield "end = 1 if string[:1] in ('+', '-') else 0"
+        with ctx.SUITE("while end < len(string) and string[end] in '0123456789'"):
+            yield 'end += 1'
+        with ctx.SUITE('try'):
+            yield 'return int(string[:end])'
+        with ctx.SUITE('except ValueError'):
+            yield 'return 0'
+
+
+def py_choice_func_gen(ctx: Context):
+    with ctx.SUITE('def _choice(name, choices)'):
+        yield 'valid = frozenset(choices)'
+        yield ''
+        with ctx.SUITE('def converter(string)'):
+            with ctx.SUITE('if string not in valid'):
+                yield "raise ArgError('bad value for %s: %s, expect one of %s' % (name, string, ', '.join(choices)))"
+            yield 'return string'
+        yield 'return converter'
+
+
+def py_items_func_gen(ctx: Context):
+    with ctx.SUITE('def _items(converter, sep)'):
+        yield '# the values of an append option, split by sep if any'
+        with ctx.SUITE('if sep is None'):
+            yield 'return lambda string: [converter(string)]'
+        yield 'return lambda string: [converter(item) for item in string.split(sep)]'
+
+
+def py_did_you_mean_func_gen(ctx: Context):
+    with ctx.SUITE('def _did_you_mean(piece)'):
+        yield '# the same choice as suggest_option() of c++'
+        yield "key = piece.partition('=')[0]"
+        yield 'best, best_distance = None, None'
+        with ctx.SUITE('for option, max_distance in _SUGGESTIONS'):
+            with ctx.SUITE('if abs(len(key) - len(option)) > max_distance'):
+                yield 'continue'
+            yield 'row = list(range(len(option) + 1))'
+            with ctx.SUITE('for i, ch in enumerate(key, 1)'):
+                yield 'diagonal, row[0] = row[0], i'
+                with ctx.SUITE('for j, option_ch in enumerate(option, 1)'):
+                    yield 'above = row[j]'
+                    yield 'row[j] = min(above + 1, row[j - 1] + 1, diagonal + (ch != option_ch))'
+                    yield 'diagonal = above'
+            with ctx.SUITE('if 0 < row[-1] <= max_distance and (best is None or row[-1] < best_distance)'):
+                yield 'best, best_distance = option, row[-1]'
+        yield "return '' if best is None else ', did you mean %s?' % (best,)"
+
+
+def py_usage_gen(prog: str, argsinfo: Sequence[ArgInfo]):
+    yield '# laid out by arggen'
+    yield 'USAGE = ('
+    for line in usage_text(prog, argsinfo).splitlines(keepends=True):
+        yield f'    {line!r}'
+    yield ')'
+
+
+def py_class_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    sorted_info = sorted(argsinfo, key=lambda ai: ai.name)     # sort by name
+
+    with ctx.SUITE(f'class {struct_name}'):
+        yield '__slots__ = (%s)' % (' '.join(f'{info.name!r},' for info in sorted_info),)
+        yield ''
+        with ctx.SUITE('def __init__(self)'):
+            for info in sorted_info:
+                yield f'self.{info.name} = {py_default_value(info)}'
+        yield ''
+        with ctx.SUITE('def __eq__(self, other)'):
+            with ctx.SUITE('if other.__class__ is not self.__class__'):
+                yield 'return NotImplemented'
+            yield 'return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)'
+        yield ''
+        yield '__hash__ = None'
+        yield ''
+        yield '# same output as to_string() of c++'
+        with ctx.SUITE('def to_string(self)'):
+            yield 'ans = %r' % ('<' + struct_name,)
+            for info in argsinfo:
+                name_eq = repr(' ' + info.name + '=')
+                if is_list_option(info):
+                    if info.value_type == ValueType.STRING:
+                        yield f"ans += {name_eq} + ''.join(item + ',' for item in self.{info.name})"
+                    elif info.value_type == ValueType.INT:
+                        yield f"ans += {name_eq} + ''.join(str(item) + ',' for item in self.{info.name})"
+                    else:
+                        assert False, 'unreachable'
+                elif info.value_type == ValueType.BOOL:
+                    yield f"ans += {name_eq} + ('true' if self.{info.name} else 'false')"
+                elif info.value_type == ValueType.INT:
+                    yield f'ans += {name_eq} + str(self.{info.name})'
+                elif info.value_type == ValueType.STRING:
+                    yield f'ans += {name_eq} + \'"\' + self.{info.name} + \'"\''
+                elif info.value_type == ValueType.ENUM:
+                    yield f'ans += {name_eq} + self.{info.name}'
+                else:
+                    assert False, 'unreachable'
+            yield "return ans + '>'"
+        yield ''
+        yield '__repr__ = to_string'
+
+
+def py_tables_gen(ctx: Context, argsinfo: Sequence[ArgInfo]):
+    long_options = dict()   # type: Dict[str, str]
+    short_options = dict()  # type: Dict[str, str]
+    env_options = dict()    # type: Dict[str, str]
+    position_args = []
+    rest_arg = None
+    required_options = []
+
+    for info in argsinfo:
+        if info.arg_type == ArgType.BOOL:
+            entry = f'(_FLAG, {info.name!r}, None)'
+        elif info.arg_type == ArgType.COUNT:
+            entry = f'(_COUNT, {info.name!r}, None)'
+        elif info.arg_type == ArgType.ONE:
+            converter = py_converter(info)
+            if is_position_option(info.options):
+                position_args.append(f'({info.name!r}, {converter})')
+                continue
+            entry = f'(_VALUE, {info.name!r}, {converter})'
+            if info.default is None:
+                required_options.append(info.name)
+        elif info.arg_type == ArgType.REST:
+            rest_arg = f'({info.name!r}, {value_type_to_py_converter[info.value_type]})'
+            continue
+        elif info.arg_type == ArgType.APPEND:
+            converter = f'_items({py_converter(info)}, {info.split!r})'
+            entry = f'(_APPEND, {info.name!r}, {converter})'
+        else:
+            assert False, 'unreachable'
+
+        short, long = classify_options(info.options)
+        for opt in short:
+            short_options[opt[1]] = entry
+        for opt in long:
+            long_options[opt] = entry
+        if info.env is not None:
+            env_options[info.env] = entry
+
+    position_infos = [
+        info for info in argsinfo
+        if info.arg_type == ArgType.ONE and is_position_option(info.options)
+    ]
+
+    yield '# the kinds from _VALUE on take a value'
+    yield '_FLAG, _COUNT, _VALUE, _APPEND = range(4)'
+    yield ''
+    yield '# option -> (kind, name, converter)'
+    yield from py_dict_gen('_LONG_OPTIONS', long_options)
+    yield from py_dict_gen('_SHORT_OPTIONS', short_options)
+    yield '# environment variable -> (kind, name, converter)'
+    yield from py_dict_gen('_ENV_OPTIONS', env_options)
+    yield '# (name, converter)'
+    yield '_POSITION_ARGS = (%s)' % (' '.join(pos + ',' for pos in position_args),)
+    yield f'_REST_ARG = {rest_arg}'
+    yield '_REQUIRED_OPTIONS = (%s)' % (' '.join(f'{name!r},' for name in sorted(required_options)),)
+    yield f'_REQUIRED_POSITION_COUNT = {count_required_positions(position_infos)}'
+    yield '# "did you mean" candidates: (option, max edit distance)'
+    yield '_SUGGESTIONS = (%s)' % (' '.join(f'{entry!r},' for entry in suggestion_table(argsinfo)),)
+
+
+def py_parse_func_gen(ctx: Context, struct_name: str):
+    with ctx.SUITE('def parse_into(ans, args)'):
+        yield 'ans.__init__()   # reset to defaults'
+        yield 'position_count = 0'
+        yield 'options_done = False'
+        yield 'missing = set(_REQUIRED_OPTIONS)'
+        yield '# environment variables, over the defaults and under the args'
+        with ctx.SUITE('for var, (kind, name, converter) in _ENV_OPTIONS.items()'):
+            yield 'value = os.environ.get(var)'
+            with ctx.SUITE('if value is None'):
+                yield 'continue'
+            with ctx.SUITE('if kind == _VALUE'):
+                yield 'setattr(ans, name, converter(value))'
+                yield 'missing.discard(name)'
+            with ctx.SUITE('elif kind == _FLAG'):
+                yield "setattr(ans, name, value not in ('', '0'))"
+            with ctx.SUITE('else'):
+                yield 'setattr(ans, name, _atol(value))'
+        yield ''
+        yield 'it = iter(args)'
+        with ctx.SUITE('for piece in it'):
+            with ctx.SUITE("if options_done or len(piece) < 2 or piece[0] != '-'"):
+                yield '# positional args, everything after "--" included'
+                with ctx.SUITE('if position_count < len(_POSITION_ARGS)'):
+                    yield 'name, converter = _POSITION_ARGS[position_count]'
+                    yield 'setattr(ans, name, converter(piece))'
+                with ctx.SUITE('elif _REST_ARG is not None'):
+                    yield 'name, converter = _REST_ARG'
+                    yield 'getattr(ans, name).append(converter(piece))'
+                with ctx.SUITE('else'):
+                    yield "raise ArgError('too many args: ' + piece)"
+                yield 'position_count += 1'
+                yield 'continue'
+            with ctx.SUITE("elif piece == '--'"):
+                yield '# the rest are positional args'
+                yield 'options_done = True'
+                yield 'continue'
+            with ctx.SUITE("elif piece[1] == '-'"):
+                yield '# long options'
+                yield 'entry = _LONG_OPTIONS.get(piece)'
+                with ctx.SUITE('if entry is None'):
+                    yield "key, sep, value = piece.partition('=')"
+                    yield 'entry = _LONG_OPTIONS.get(key) if sep else None'
+                    with ctx.SUITE('if entry is None or entry[0] < _VALUE'):
+                        yield "raise ArgError('Unknown option: ' + piece + _did_you_mean(piece))"
+                with ctx.SUITE('elif entry[0] >= _VALUE'):
+                    yield 'value = next(it, None)'
+                    with ctx.SUITE("if value is None or value[:1] == '-'"):
+                        yield "raise ArgError('no value for ' + piece)"
+            with ctx.SUITE('else'):
+                yield '# short options'
+                yield 'entry = _SHORT_OPTIONS.get(piece[1])'
+                with ctx.SUITE('if entry is not None and entry[0] >= _VALUE'):
+                    with ctx.SUITE('if len(piece) > 2'):
+                        yield 'value = piece[2:]'
+                    with ctx.SUITE('else'):
+                        yield 'value = next(it, None)'
+                        with ctx.SUITE("if value is None or value[:1] == '-'"):
+                            yield "raise ArgError('no value for ' + piece)"
+                with ctx.SUITE('else'):
+                    with ctx.SUITE('for ch in piece[1:]'):
+                        yield 'entry = _SHORT_OPTIONS.get(ch)'
+                        with ctx.SUITE('if entry is None or entry[0] >= _VALUE'):
+                            yield "raise ArgError('Unknown flag: ' + ch)"
+                        with ctx.SUITE('elif entry[0] == _FLAG'):
+                            yield 'setattr(ans, entry[1], True)'
+                        with ctx.SUITE('else'):
+                            yield 'setattr(ans, entry[1], getattr(ans, entry[1]) + 1)'
+                    yield 'continue'
+
+            yield ''
+            yield 'kind, name, converter = entry'
+            with ctx.SUITE('if kind == _VALUE'):
+                yield 'setattr(ans, name, converter(value))'
+                yield 'missing.discard(name)'
+            with ctx.SUITE('elif kind == _APPEND'):
+                yield 'getattr(ans, name).extend(converter(value))'
+            with ctx.SUITE('elif kind == _FLAG'):
+                yield 'setattr(ans, name, True)'
+            with ctx.SUITE('else'):
+                yield 'setattr(ans, name, getattr(ans, name) + 1)'
+
+        yield ''
+        yield '# check required options'
+        with ctx.SUITE('for name in _REQUIRED_OPTIONS'):
+            with ctx.SUITE('if name in missing'):
+                yield "raise ArgError(name + ' required')"
+        yield '# check positional args'
+        with ctx.SUITE('if position_count < _REQUIRED_POSITION_COUNT'):
+            yield "raise ArgError('expect more argument')"
+
+    yield from ('', '')
+    with ctx.SUITE('def parse_args(args)'):
+        yield f'ans = {struct_name}()'
+        yield 'parse_into(ans, args)'
+        yield 'return ans'
+
+    yield from ('', '')
+    with ctx.SUITE('def parse_argv(argv)'):
+        yield 'return parse_args(argv[1:])'
+
+
+def python_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str,
+        options: GenOptions
+):
+    # args is a list in memory already
+    reject_stream_rest(argsinfo, 'python')
+    reject_python_keywords(argsinfo, 'python')
+
+    yield '# WARNING: Automatically generated code by arggen.py. Do not edit.'
+    yield from ('', '')
+    yield 'import os'
+    yield from ('', '')
+    yield f"__all__ = ['ArgError', {struct_name!r}, 'USAGE', 'parse_args', 'parse_argv', 'parse_into']"
+    yield from ('', '')
+
+    with ctx.SUITE('class ArgError(Exception)'):
+        pass
+    yield from ('', '')
+    yield from py_atol_func_gen(ctx)
+    yield from ('', '')
+    yield from py_did_you_mean_func_gen(ctx)
+    yield from ('', '')
+    if any(info.value_type == ValueType.ENUM for info in argsinfo):
+        yield from py_choice_func_gen(ctx)
+        yield from ('', '')
+    if any(info.arg_type == ArgType.APPEND for info in argsinfo):
+        yield from py_items_func_gen(ctx)
+        yield from ('', '')
+    yield from py_class_gen(ctx, struct_name, argsinfo)
+    yield from ('', '')
+    yield from py_tables_gen(ctx, argsinfo)
+    yield from ('', '')
+    yield from py_usage_gen(options.prog or source_name, argsinfo)
+    yield from ('', '')
+    yield from py_parse_func_gen(ctx, struct_name)
+    yield ''
+
+
+# end python target
+
+# begin c target
+
+
+# (suffix, message)
+c_errors = [
+    ('OK', 'ok'),
+    ('ERR_UNKNOWN_OPTION', 'unknown option'),
+    ('ERR_UNKNOWN_FLAG', 'unknown flag'),
+    ('ERR_NO_VALUE', 'no value for option'),
+    ('ERR_TOO_MANY_ARGS', 'too many args'),
+    ('ERR_REQUIRED', 'required option missing'),
+    ('ERR_EXPECT_MORE', 'expect more argument'),
+    ('ERR_BAD_CHOICE', 'bad choice for option'),
+]
+
+value_type_to_c_type = {
+    ValueType.STRING: 'const char *',
+    ValueType.INT: 'int',
+    ValueType.BOOL: 'bool',
+}
+
+
+def c_enum_type(struct_name: str, info: ArgInfo):
+    return f'enum {struct_name}_{info.name}'
+
+
+def c_struct_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    for info in argsinfo:
+        if info.value_type == ValueType.ENUM:
+            with ctx.BLOCK(c_enum_type(struct_name, info), trailing_semiconlon=True):
+                for choice in info.choices:
+                    yield f'{struct_name}_{info.name}_{choice_to_c_enumerator(choice)},'
+            yield ''
+
+    yield f'typedef struct {struct_name} {struct_name};'
+    yield ''
+    with ctx.BLOCK(f'struct {struct_name}', trailing_semiconlon=True):
+        for info in sorted(argsinfo, key=lambda ai: ai.name):   # sort by name
+            yield f'// options: {info.options}, arg_type: {info.arg_type}'
+            if info.arg_type == ArgType.REST:
+                if info.value_type == ValueType.INT:
+                    yield '// int values are left as strings, convert them with atol()'
+                yield '// points into argv'
+                yield f'char *const *{info.name};'
+                yield f'size_t {info.name}_count;'
+            elif info.value_type == ValueType.ENUM:
+                yield f'{c_enum_type(struct_name, info)} {info.name};'
+            else:
+                c_type = value_type_to_c_type[info.value_type]
+                yield f'{c_type}{"" if c_type.endswith("*") else " "}{info.name};'
+
+
+def c_init_func_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    with ctx.BLOCK(f'void {struct_name}_init({struct_name} *ans)'):
+        for info in sorted(argsinfo, key=lambda ai: ai.name):
+            if info.arg_type == ArgType.REST:
+                yield f'ans->{info.name} = NULL;'
+                yield f'ans->{info.name}_count = 0;'
+            elif info.value_type == ValueType.STRING:
+                yield f'ans->{info.name} = {repr_c_string(info.default or "")};'
+            elif info.value_type == ValueType.INT:
+                yield f'ans->{info.name} = {info.default or 0};'
+            elif info.value_type == ValueType.BOOL:
+                yield f'ans->{info.name} = {"true" if info.default else "false"};'
+            elif info.value_type == ValueType.ENUM:
+                enumerator = choice_to_c_enumerator(info.default or info.choices[0])
+                yield f'ans->{info.name} = {struct_name}_{info.name}_{enumerator};'
+            else:
+                assert False, 'unreachable'
+
+
+def c_choices_func_gen(ctx: Context, struct_name: str, info: ArgInfo):
+    enum_type = c_enum_type(struct_name, info)
+    with ctx.BLOCK(f'static bool {struct_name}_{info.name}_from_string(const char *value, {enum_type} *out)'):
+        yield from choices_lookup_gen(ctx, info, 'NULL')
+        with ctx.IF('index < 0'):
+            yield 'return false;'
+        yield f'*out = ({enum_type})index;'
+        yield 'return true;'
+
+
+def c_fail_gen(struct_name: str, err: str, bad_arg: str):
+    yield f'return {struct_name}_fail(bad_arg, {bad_arg}, {struct_name}_{err});'
+
+
+def c_accept_arg_gen(ctx: Context, struct_name: str, info: ArgInfo, source: str):
+    if info.value_type == ValueType.STRING:
+        yield f'ans->{info.name} = {source};'
+    elif info.value_type == ValueType.INT:
+        yield f'ans->{info.name} = atol({source});'
+    elif info.value_type == ValueType.ENUM:
+        with ctx.IF(f'!{struct_name}_{info.name}_from_string({source}, &ans->{info.name})'):
+            yield from c_fail_gen(struct_name, 'ERR_BAD_CHOICE', source)
+    else:
+        assert False, 'unreachable'
+    if info.default is None and not is_position_option(info.options):
+        yield f'has_{info.name} = true;'
+
+
+def c_env_layer_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    env_infos = sorted((info for info in argsinfo if info.env is not None), key=lambda ai: ai.name)
+    if not env_infos:
+        return
+
+    yield '// environment variables, over the defaults and under the args'
+    for info in env_infos:
+        env = f'env_{info.name}'
+        yield f'const char *{env} = getenv({repr_c_string(info.env)});'
+        with ctx.IF(f'{env} != NULL'):
+            if info.arg_type == ArgType.BOOL:
+                yield f"ans->{info.name} = {env}[0] != '\\0' && strcmp({env}, \"0\") != 0;"
+            elif info.arg_type == ArgType.COUNT:
+                yield f'ans->{info.name} = atol({env});'
+            else:
+                yield from c_accept_arg_gen(ctx, struct_name, info, env)
+
+
+def c_use_next_arg_gen(ctx: Context, struct_name: str, info: ArgInfo):
+    yield 'i++;'
+    with ctx.IF("i == argc || argv[i][0] == '-'"):
+        yield from c_fail_gen(struct_name, 'ERR_NO_VALUE', 'piece')
+    yield from c_accept_arg_gen(ctx, struct_name, info, 'argv[i]')
+
+
+def c_parse_func_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    short_args, long_args, short_switches, long_switches = [], [], [], []
+    position_args = []
+    rest_arg = None
+    required_options = []
+
+    for info in argsinfo:
+        if info.arg_type in (ArgType.BOOL, ArgType.COUNT):
+            short, long = classify_options(info.options)
+            short_switches.extend((opt, info) for opt in short)
+            long_switches.extend((opt, info) for opt in long)
+        elif info.arg_type == ArgType.ONE:
+            if is_position_option(info.options):
+                position_args.append(info)
+            else:
+                short, long = classify_options(info.options)
+                short_args.extend((opt, info) for opt in short)
+                long_args.extend((opt, info) for opt in long)
+                if info.default is None:
+                    required_options.append(info.name)
+        elif info.arg_type == ArgType.REST:
+            rest_arg = info
+        else:
+            assert False, 'unreachable'
+
+    for lst in (short_args, long_args, short_switches, long_switches):
+        lst.sort(key=lambda item: item[0])
+    required_options.sort()
+
+    def switch_gen(info: ArgInfo):
+        if info.arg_type == ArgType.BOOL:
+            yield f'ans->{info.name} = true;'
+        else:
+            yield f'ans->{info.name}++;'
+
+    with ctx.BLOCK(f'static int {struct_name}_fail(const char **bad_arg, const char *arg, int err)'):
+        with ctx.IF('bad_arg != NULL'):
+            yield '*bad_arg = arg;'
+        yield 'return err;'
+
+    yield ''
+    with ctx.BLOCK(f'int {struct_name}_parse_argv({struct_name} *ans, int argc, char *argv[], const char **bad_arg)'):
+        yield f'{struct_name}_init(ans);'
+        yield 'int position_count = 0;'
+        yield 'bool options_done = false;'
+        if rest_arg is not None:
+            yield '// rest args are moved to argv[1 .. rest_count]'
+            yield 'int rest_count = 0;'
+        yield '// required options'
+        for opt in required_options:
+            yield f'bool has_{opt} = false;'
+        yield from c_env_layer_gen(ctx, struct_name, argsinfo)
+
+        with ctx.BLOCK('for (int i = 1; i < argc; i++)'):
+            yield 'const char *piece = argv[i];'
+
+            with ctx.CONDITION():
+                with ctx.IF("options_done || piece[0] != '-' || piece[1] == '\\0'"):
+                    yield '// positional args, everything after "--" included'
+                    with ctx.CONDITION():
+                        for idx, info in enumerate(position_args):
+                            with ctx.MATCH(f'position_count == {idx}'):
+                                yield from c_accept_arg_gen(ctx, struct_name, info, 'piece')
+                        with ctx.ELSE():
+                            if rest_arg is not None:
+                                yield '// never overwrites an unvisited item, since rest_count < i'
+                                yield 'argv[1 + rest_count] = argv[i];'
+                                yield 'rest_count++;'
+                            else:
+                                yield from c_fail_gen(struct_name, 'ERR_TOO_MANY_ARGS', 'piece')
+                    yield 'position_count++;'
+
+                with ctx.ELSEIF("piece[1] == '-' && piece[2] == '\\0'"):
+                    yield '// "--", the rest are positional args'
+                    yield 'options_done = true;'
+
+                with ctx.ELSEIF("piece[1] == '-'"):
+                    yield '// long options'
+                    with ctx.CONDITION():
+                        for opt, info in long_args:
+                            with ctx.MATCH(f'strcmp(piece, {repr_c_string(opt)}) == 0'):
+                                yield from c_use_next_arg_gen(ctx, struct_name, info)
+                            opt_eq = opt + '='
+                            with ctx.MATCH(f'strncmp(piece, {repr_c_string(opt_eq)}, {len(opt_eq)}) == 0'):
+                                yield from c_accept_arg_gen(ctx, struct_name, info, f'piece + {len(opt_eq)}')
+                        for opt, info in long_switches:
+                            with ctx.MATCH(f'strcmp(piece, {repr_c_string(opt)}) == 0'):
+                                yield from switch_gen(info)
+                        with ctx.ELSE():
+                            yield from c_fail_gen(struct_name, 'ERR_UNKNOWN_OPTION', 'piece')
+
+                with ctx.ELSE():
+                    yield '// short options'
+                    with ctx.CONDITION():
+                        for opt, info in short_args:
+                            with ctx.MATCH(f"piece[1] == '{opt[1]}'"):
+                                with ctx.CONDITION():
+                                    with ctx.IF("piece[2] != '\\0'"):
+                                        yield from c_accept_arg_gen(ctx, struct_name, info, 'piece + 2')
+                                    with ctx.ELSE():
+                                        yield from c_use_next_arg_gen(ctx, struct_name, info)
+                        with ctx.ELSE():
+                            with ctx.BLOCK('for (const char *it = piece + 1; *it != \'\\0\'; ++it)'):
+                                with ctx.CONDITION():
+                                    for opt, info in short_switches:
+                                        with ctx.MATCH(f"*it == '{opt[1]}'"):
+                                            yield from switch_gen(info)
+                                    with ctx.ELSE():
+                                        yield from c_fail_gen(struct_name, 'ERR_UNKNOWN_FLAG', 'piece')
+
+        yield ''
+        yield '// check required options'
+        for opt in required_options:
+            with ctx.IF(f'!has_{opt}'):
+                yield from c_fail_gen(struct_name, 'ERR_REQUIRED', repr_c_string(opt))
+
+        yield '// check positional args'
+        with ctx.IF(f'position_count < {count_required_positions(position_args)}'):
+            yield from c_fail_gen(struct_name, 'ERR_EXPECT_MORE', 'NULL')
+
+        if rest_arg is not None:
+            yield ''
+            yield f'ans->{rest_arg.name} = argv + 1;'
+            yield f'ans->{rest_arg.name}_count = (size_t)rest_count;'
+        yield f'return {struct_name}_OK;'
+
+
+def c_strerror_func_gen(ctx: Context, struct_name: str):
+    with ctx.BLOCK(f'const char *{struct_name}_strerror(int err)'):
+        with ctx.BLOCK('switch (err)'):
+            for suffix, message in c_errors:
+                yield Label(f'case {struct_name}_{suffix}:')
+                yield f'return {repr_c_string(message)};'
+            yield Label('default:')
+            yield 'return "unknown error";'
+
+
+def c_header_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str,
+        options: GenOptions
+):
+    # the rest items point into argv already, without extra memory
+    reject_stream_rest(argsinfo, 'c')
+    # the c parser never allocates, the values of an append option would need storage
+    reject_append(argsinfo, 'c')
+
+    yield f'#ifndef ARGGEN_{source_name.upper()}_H'
+    yield f'#define ARGGEN_{source_name.upper()}_H'
+    yield ''
+    yield from warning_gen()
+    yield ''
+    yield '#include <stdbool.h>'
+    yield '#include <stddef.h>'
+    yield ''
+    yield '#ifdef __cplusplus'
+    yield 'extern "C" {'
+    yield '#endif'
+    yield from ('', '')
+
+    with ctx.BLOCK(f'enum {struct_name}_error', trailing_semiconlon=True):
+        for idx, (suffix, _) in enumerate(c_errors):
+            yield f'{struct_name}_{suffix} = {idx},'
+    yield from ('', '')
+
+    yield from c_struct_gen(ctx, struct_name, argsinfo)
+    yield from ('', '')
+
+    yield '// set all fields to their defaults'
+    yield f'void {struct_name}_init({struct_name} *ans);'
+    yield '// returns 0 on success, or an error code with *bad_arg (if not NULL) set to the offending arg.'
+    yield '// never allocates, string fields point into argv, and the pointers of argv are reordered.'
+    yield f'int {struct_name}_parse_argv({struct_name} *ans, int argc, char *argv[], const char **bad_arg);'
+    yield f'const char *{struct_name}_strerror(int err);'
+    yield '// the closest long option to an unknown one, for "did you mean", or NULL'
+    yield f'const char *{struct_name}_suggest(const char *piece);'
+    yield ''
+    yield '// laid out by arggen, printed with a single write, e.g.'
+    yield f'// fwrite({struct_name}_usage, 1, sizeof({struct_name}_usage) - 1, stdout)'
+    usage = usage_text(options.prog or source_name, argsinfo)
+    yield f'extern const char {struct_name}_usage[{len(usage.encode()) + 1}];'
+    yield ''
+
+    yield '#ifdef __cplusplus'
+    yield '}'
+    yield '#endif'
+    yield ''
+    yield f'#endif // ARGGEN_{source_name.upper()}_H'
+    yield ''
+
+
+def c_source_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str,
+        options: GenOptions
+):
+    enum_infos = [info for info in argsinfo if info.value_type == ValueType.ENUM]
+
+    if enum_infos:
+        yield '#include <stdint.h>  // uint32_t'
+    yield '#include <stdlib.h>  // atol, getenv'
+    yield '#include <string.h>  // strcmp, strncmp, strcspn'
+    yield f'#include "{source_name}.h"'
+    yield ''
+    yield from warning_gen()
+    yield from ('', '')
+
+    yield from c_init_func_gen(ctx, struct_name, argsinfo)
+    yield from ('', '')
+    for info in enum_infos:
+        yield from c_choices_func_gen(ctx, struct_name, info)
+        yield from ('', '')
+    yield from c_parse_func_gen(ctx, struct_name, argsinfo)
+    yield from ('', '')
+    yield from c_strerror_func_gen(ctx, struct_name)
+    yield from ('', '')
+    with ctx.BLOCK(f'const char *{struct_name}_suggest(const char *piece)'):
+        table = suggestion_table(argsinfo)
+        if table:
+            yield from suggest_option_gen(ctx, table, 'NULL')
+        else:
+            yield '(void)piece;'
+            yield 'return NULL;'
+    yield from ('', '')
+    usage = usage_text(options.prog or source_name, argsinfo)
+    yield from usage_decl_gen(f'const char {struct_name}_usage[]', usage)
+    yield ''
+
+
+# end c target
+
+# begin cpython target
+
+
+def cpython_convert_gen(ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo]):
+    yield '// c++ values to new references of python objects, nullptr with an exception set on failure'
+    with ctx.BLOCK('PyObject *to_py(bool value)'):
+        yield 'return PyBool_FromLong(value);'
+    yield ''
+    with ctx.BLOCK('PyObject *to_py(int value)'):
+        yield 'return PyLong_FromLong(value);'
+    yield ''
+    with ctx.BLOCK('PyObject *to_py(const std::string &value)'):
+        yield '// the values from environment variables may not be utf-8'
+        yield 'return PyUnicode_DecodeUTF8(value.data(), (Py_ssize_t)value.size(), "surrogateescape");'
+    for info in argsinfo:
+        if info.value_type == ValueType.ENUM:
+            yield ''
+            with ctx.BLOCK(f'PyObject *to_py({cxx_value_type(info, struct_name)} value)'):
+                yield f'return PyUnicode_FromString({struct_name}::to_string(value));'
+    yield ''
+    yield 'template <class T>'
+    with ctx.BLOCK('PyObject *to_py(const std::vector<T> &values)'):
+        yield 'PyObject *ans = PyList_New((Py_ssize_t)values.size());'
+        with ctx.BLOCK('for (size_t i = 0; ans != nullptr && i < values.size(); i++)'):
+            yield 'PyObject *item = to_py(values[i]);'
+            with ctx.IF('item == nullptr'):
+                yield 'Py_CLEAR(ans);'
+                yield 'break;'
+            yield 'PyList_SET_ITEM(ans, (Py_ssize_t)i, item);'
+        yield 'return ans;'
+
+
+def cpython_module_gen(
+        ctx: Context, struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str,
+        options: GenOptions
+):
+    reject_stream_rest(argsinfo, 'cpython')
+    reject_python_keywords(argsinfo, 'cpython')
+    if not is_name(source_name, identifier_start_chars, word_chars):
+        raise BadConfiguration('%s is not a valid name of python module' % (source_name,))
+
+    fields = sorted(argsinfo, key=lambda ai: ai.name)
+    module = repr_c_string(source_name)
+
+    yield '// the python extension module of the parser, build this file alone: the parser source'
+    yield '// is included, so that the args are parsed in place without copying them first.'
+    yield '#define PY_SSIZE_T_CLEAN'
+    yield '#include <Python.h>'
+    yield ''
+    yield '#include <new>       // bad_alloc'
+    yield '#include <string>'
+    yield '#include <vector>'
+    yield ''
+    yield f'#include "{source_name}.cpp"'
+    yield ''
+    yield from warning_gen()
+    yield from ('', '')
+
+    with ctx.BLOCK('namespace'):
+        yield ''
+        yield 'PyObject *ArgErrorType = nullptr;'
+        yield 'PyTypeObject *ResultType = nullptr;'
+        yield ''
+        yield '// PyModule_AddObject() steals the reference only on success'
+        with ctx.BLOCK('int add_object(PyObject *module, const char *name, PyObject *value)'):
+            yield 'Py_INCREF(value);'
+            with ctx.IF('PyModule_AddObject(module, name, value) < 0'):
+                yield 'Py_DECREF(value);'
+                yield 'return -1;'
+            yield 'return 0;'
+        yield ''
+        with ctx.BLOCK('PyStructSequence_Field result_fields[] =', trailing_semiconlon=True):
+            for info in fields:
+                yield '{%s, %s},' % (repr_c_string(info.name), repr_c_string(f'options: {" ".join(info.options)}'))
+            yield '{nullptr, nullptr},'
+        with ctx.BLOCK('PyStructSequence_Desc result_desc =', trailing_semiconlon=True):
+            yield repr_c_string(f'{source_name}.{struct_name}') + ','
+            yield repr_c_string(f'the options parsed by {source_name}.parse_args()') + ','
+            yield 'result_fields,'
+            yield f'{len(fields)},'
+        yield ''
+        yield from cpython_convert_gen(ctx, struct_name, argsinfo)
+        yield ''
+        with ctx.BLOCK(f'PyObject *to_python(const {struct_name} &opt)'):
+            yield 'PyObject *ans = PyStructSequence_New(ResultType);'
+            with ctx.IF('ans == nullptr'):
+                yield 'return nullptr;'
+            yield 'PyObject *value;'
+            for idx, info in enumerate(fields):
+                with ctx.IF(f'!(value = to_py(opt.{info.name}))'):
+                    yield 'Py_DECREF(ans);'
+                    yield 'return nullptr;'
+                yield f'PyStructSequence_SET_ITEM(ans, {idx}, value);'
+            yield 'return ans;'
+        yield ''
+        yield '// the utf-8 of a str, owned by the str'
+        with ctx.BLOCK('struct View', trailing_semiconlon=True):
+            yield 'const char *data;'
+            yield 'Py_ssize_t size;'
+        yield ''
+        yield '// copies each view into a reused buffer, parse_cursor works on std::string'
+        with ctx.BLOCK('struct ViewCursor', trailing_semiconlon=True):
+            yield 'const View *it;'
+            yield 'const View *end;'
+            yield 'std::string piece;'
+            yield ''
+            with ctx.BLOCK('const std::string *next()'):
+                with ctx.IF('it == end'):
+                    yield 'return nullptr;'
+                yield 'piece.assign(it->data, (size_t)it->size);'
+                yield '++it;'
+                yield 'return &piece;'
+        yield ''
+        yield '// returns a tuple of the args that keeps the views valid, even if the list of args is'
+        yield '// changed while the GIL is released. the strings are not copied here, but each one is'
+        yield '// copied once by ViewCursor when it is parsed, and once more into its field if it is kept.'
+        with ctx.BLOCK('PyObject *collect_views(PyObject *args, std::vector<View> &views)'):
+            with ctx.IF('PyUnicode_Check(args)'):
+                yield 'PyErr_SetString(PyExc_TypeError, "expect a sequence of str, not a str");'
+                yield 'return nullptr;'
+            yield 'PyObject *tuple = PySequence_Tuple(args);'
+            with ctx.IF('tuple == nullptr'):
+                yield 'return nullptr;'
+            yield 'views.reserve((size_t)PyTuple_GET_SIZE(tuple));'
+            with ctx.BLOCK('for (Py_ssize_t i = 0; i < PyTuple_GET_SIZE(tuple); i++)'):
+                yield 'View view;'
+                yield 'view.data = PyUnicode_AsUTF8AndSize(PyTuple_GET_ITEM(tuple, i), &view.size);'
+                with ctx.IF('view.data == nullptr'):
+                    yield 'Py_DECREF(tuple);'
+                    yield 'return nullptr;'
+                yield 'views.push_back(view);'
+            yield 'return tuple;'
+        yield ''
+        yield '// touches no python object, so that it runs without the GIL.'
+        yield '// returns the type of exception to raise with message, or nullptr on success.'
+        with ctx.BLOCK(
+            f'PyObject *parse_views({struct_name} &out, const std::vector<View> &views, std::string &message)'
+        ):
+            with ctx.BLOCK('try'):
+                if reserved_fields(argsinfo):
+                    yield '// the utf-8 buffers of str end with a nul'
+                    yield 'reserve_vectors(out, views.size(), [&views](size_t i) { return views[i].data; });'
+                yield 'ViewCursor cursor {views.data(), views.data() + views.size(), {}};'
+                yield 'parse_cursor(out, cursor);'
+                yield 'return nullptr;'
+            with ctx.BLOCK('catch (const ArgError &err)'):
+                yield 'message = err.what();'
+                yield 'return ArgErrorType;'
+            with ctx.BLOCK('catch (const std::bad_alloc &)'):
+                yield 'message = "out of memory";'
+                yield 'return PyExc_MemoryError;'
+        yield ''
+        with ctx.BLOCK('PyObject *py_parse_args(PyObject *, PyObject *args)'):
+            yield 'std::vector<View> views;'
+            yield 'PyObject *tuple = collect_views(args, views);'
+            with ctx.IF('tuple == nullptr'):
+                yield 'return nullptr;'
+            yield f'{struct_name}' ' opt {};'
+            yield 'std::string message;'
+            yield 'PyObject *error = parse_views(opt, views, message);'
+            yield 'Py_DECREF(tuple);'
+            with ctx.IF('error != nullptr'):
+                yield 'PyErr_SetString(error, message.c_str());'
+                yield 'return nullptr;'
+            yield 'return to_python(opt);'
+        yield ''
+        with ctx.BLOCK('PyObject *py_parse_many(PyObject *, PyObject *lines)'):
+            yield 'PyObject *seq = PySequence_Tuple(lines);'
+            with ctx.IF('seq == nullptr'):
+                yield 'return nullptr;'
+            yield 'const size_t count = (size_t)PyTuple_GET_SIZE(seq);'
+            yield 'std::vector<std::vector<View>> views(count);'
+            yield 'std::vector<PyObject *> tuples;'
+            with ctx.BLOCK('for (size_t i = 0; i < count; i++)'):
+                yield 'PyObject *tuple = collect_views(PyTuple_GET_ITEM(seq, (Py_ssize_t)i), views[i]);'
+                with ctx.IF('tuple == nullptr'):
+                    with ctx.BLOCK('for (PyObject *obj : tuples)'):
+                        yield 'Py_DECREF(obj);'
+                    yield 'Py_DECREF(seq);'
+                    yield 'return nullptr;'
+                yield 'tuples.push_back(tuple);'
+            yield ''
+            yield f'std::vector<{struct_name}> results(count);'
+            yield 'std::vector<std::string> messages(count);'
+            yield 'std::vector<PyObject *> errors(count);'
+            yield 'Py_BEGIN_ALLOW_THREADS'
+            with ctx.BLOCK('for (size_t i = 0; i < count; i++)'):
+                yield 'errors[i] = parse_views(results[i], views[i], messages[i]);'
+            yield 'Py_END_ALLOW_THREADS'
+            with ctx.BLOCK('for (PyObject *obj : tuples)'):
+                yield 'Py_DECREF(obj);'
+            yield 'Py_DECREF(seq);'
+            yield ''
+            yield '// the failed lines get the exception objects in place'
+            yield 'PyObject *ans = PyList_New((Py_ssize_t)count);'
+            with ctx.BLOCK('for (size_t i = 0; ans != nullptr && i < count; i++)'):
+                yield 'PyObject *item = errors[i] == nullptr ? to_python(results[i])'
+                yield '    : PyObject_CallFunction(errors[i], "s", messages[i].c_str());'
+                with ctx.IF('item == nullptr'):
+                    yield 'Py_CLEAR(ans);'
+                    yield 'break;'
+                yield 'PyList_SET_ITEM(ans, (Py_ssize_t)i, item);'
+            yield 'return ans;'
+        yield ''
+        with ctx.BLOCK('PyMethodDef methods[] =', trailing_semiconlon=True):
+            yield '{"parse_args", py_parse_args, METH_O,'
+            yield f' "parse_args(args) -> {struct_name}, raises ArgError"}},'
+            yield '{"parse_many", py_parse_many, METH_O,'
+            yield f' "parse_many(list of args) -> list of {struct_name} or ArgError, parsed without the GIL"}},'
+            yield '{nullptr, nullptr, 0, nullptr},'
+        yield ''
+        with ctx.BLOCK('PyModuleDef module_def =', trailing_semiconlon=True):
+            yield 'PyModuleDef_HEAD_INIT,'
+            yield f'{module},'
+            yield repr_c_string(f'parser of {struct_name} generated by arggen') + ','
+            yield '-1,'
+            yield 'methods,'
+            yield 'nullptr, nullptr, nullptr, nullptr,'
+        yield ''
+    yield from ('', '')
+    with ctx.BLOCK(f'PyMODINIT_FUNC PyInit_{source_name}(void)'):
+        yield 'PyObject *module = PyModule_Create(&module_def);'
+        with ctx.IF('module == nullptr'):
+            yield 'return nullptr;'
+        yield 'ResultType = PyStructSequence_NewType(&result_desc);'
+        error_name = repr_c_string(f'{source_name}.ArgError')
+        yield f'ArgErrorType = PyErr_NewException({error_name}, nullptr, nullptr);'
+        with ctx.IF(
+            'ResultType == nullptr || ArgErrorType == nullptr\n'
+            f'        || add_object(module, {repr_c_string(struct_name)}, (PyObject *)ResultType) < 0\n'
+            '        || add_object(module, "ArgError", ArgErrorType) < 0\n'
+            f'        || PyModule_AddStringConstant(module, "USAGE", {struct_name}::usage) < 0'
+        ):
+            yield 'Py_CLEAR(ResultType);'
+            yield 'Py_CLEAR(ArgErrorType);'
+            yield 'Py_DECREF(module);'
+            yield 'return nullptr;'
+        yield 'return module;'
+    yield ''
+
+
+# end cpython target
+
 
 def is_config_list(lst: Sequence):
     if not isinstance(lst, (list, tuple)):
@@ -729,14 +3109,26 @@ def is_config_list(lst: Sequence):
     return True
 
 
+class Configs(dict):
+    """The config lists by struct name, with the settings of the config file."""
+    prog = None
+
+
 def parse_config_string(string: str):
+    """The lists of options are the configs. prog = 'name' names the program in the usage text,
+    instead of the name of the generated file."""
     local = dict()
     exec(string, globals(), local)
 
-    result = dict()
+    result = Configs()
     for key, value in local.items():
         if is_config_list(value):
             result[key] = value
+    prog = local.get('prog')
+    if prog is not None:
+        if not isinstance(prog, str) or not prog or prog.split() != [prog]:
+            raise BadConfiguration('bad prog %r, expect a name without spaces' % (prog,))
+        result.prog = prog
     return result
 
 
@@ -754,42 +3146,527 @@ class BadConfiguration(Exception):
     pass
 
 
-def generate_files(configs: Dict, output: str):
-    def get_source(gen):
-        g = partial(gen, struct_name=struct_name, argsinfo=argsinfo, source_name=source_name)
-        node = collect_node(g)
-        return '\n'.join(node.to_source(0))
+# target -> [(file extension, generator)]
+TARGETS = {
+    'cpp': [('h', header_gen), ('cpp', source_gen)],
+    'python': [('py', python_gen)],
+    'c': [('h', c_header_gen), ('c', c_source_gen)],
+    # compile the module.cpp only, it includes the cpp
+    'cpython': [('h', header_gen), ('cpp', source_gen), ('module.cpp', cpython_module_gen)],
+}
+# targets of the c++ parser
+CXX_TARGETS = ('cpp', 'cpython')
+
+
+class Profile:
+    """Time spent in each phase of generation, and statistics of the generated files."""
+
+    def __init__(self):
+        self.phases = dict()    # type: Dict[str, float]
+        self.outputs = dict()   # type: Dict[str, Dict[str, int]]
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add_output(self, filename: str, root: Root, source: str):
+        node_count, max_depth = node_stats(root)
+        self.outputs[filename] = dict(
+            nodes=node_count, lines=source.count('\n') + 1,
+            bytes=len(source.encode('utf8')), max_depth=max_depth,
+        )
+
+    def to_dict(self):
+        return dict(
+            phases=self.phases, total=sum(self.phases.values()), outputs=self.outputs,
+        )
+
+    def to_json(self):
+        import json
+        return json.dumps(self.to_dict(), indent=2)
+
+    def summary(self):
+        lines = ['%-20s %10s' % ('phase', 'time (ms)')]
+        for name, seconds in self.phases.items():
+            lines.append('%-20s %10.3f' % (name, seconds * 1000))
+        lines.append('%-20s %10.3f' % ('total', sum(self.phases.values()) * 1000))
+        lines.append('')
+
+        width = max([len('output')] + [len(filename) for filename in self.outputs])
+        lines.append('%-*s %8s %8s %8s %9s' % (width, 'output', 'nodes', 'lines', 'bytes', 'max_depth'))
+        for filename, stats in self.outputs.items():
+            lines.append('%-*s %8d %8d %8d %9d' % (
+                width, filename, stats['nodes'], stats['lines'], stats['bytes'], stats['max_depth'],
+            ))
+        return '\n'.join(lines)
+
+
+def render_parser(
+        struct_name: str, argsinfo: Sequence[ArgInfo], source_name: str, target: str = 'cpp',
+        options: GenOptions = None, profile: Profile = None, output: str = None
+) -> Dict[str, str]:
+    """Returns the sources by file extension. output names the files in the profile."""
+    def get_source(gen, filename):
+        g = partial(
+            gen, struct_name=struct_name, argsinfo=argsinfo, source_name=source_name,
+            options=options,
+        )
+        with profile.phase('collect_node'):
+            node = collect_node(g)
+            outline_fragments(node)
+        with profile.phase('render'):
+            source = '\n'.join(node.to_source(0))
+        profile.add_output(filename, node, source)
+        return source
+
+    if profile is None:
+        profile = Profile()
+    if options is None:
+        options = GenOptions()
+    if output is None:
+        output = source_name
+    if options.instrument and target not in CXX_TARGETS:
+        raise BadConfiguration('instrumentation is only supported by the c++ targets')
+    if options.compact and target not in CXX_TARGETS:
+        raise BadConfiguration('compact layout is only supported by the c++ targets')
+
+    return {ext: get_source(gen, f'{output}.{ext}') for ext, gen in TARGETS[target]}
+
+
+def get_single_config(configs: Dict, struct_name: str = None):
+    """Returns (struct_name, config) of the entry named struct_name, or of the only entry."""
+    if struct_name is not None:
+        if struct_name not in configs:
+            raise BadConfiguration('no entry %s found' % (struct_name,))
+        return struct_name, configs[struct_name]
 
     if len(configs) == 0:
         raise BadConfiguration('no entry found')
     if len(configs) > 1:
         raise BadConfiguration('multiple entry')
+    return next(iter(configs.items()))
+
+
+def render_sources(
+        configs: Dict, output: str, target: str = 'cpp', profile: Profile = None,
+        options: GenOptions = None
+) -> Dict[str, str]:
+    if profile is None:
+        profile = Profile()
+
+    struct_name, conf = get_single_config(configs)
+    with profile.phase('process_config'):
+        argsinfo = process_config(conf)
+
+    if options is None:
+        options = GenOptions()
+    sources = render_parser(
+        struct_name, argsinfo, os.path.basename(output), target=target,
+        options=options.with_config(configs), profile=profile, output=output,
+    )
+    return {f'{output}.{ext}': source for ext, source in sources.items()}
+
+
+@lru_cache(maxsize=256)
+def render_parser_memoized(
+        struct_name: str, argsinfo: Tuple[ArgInfo, ...], source_name: str, target: str,
+        options: GenOptions
+) -> Dict[str, str]:
+    return render_parser(struct_name, argsinfo, source_name, target=target, options=options)
+
+
+def generate(
+        config, struct_name: str = None, source_name: str = 'arggen', target: str = 'cpp',
+        options: GenOptions = None
+) -> Dict[str, str]:
+    """Returns the sources by file extension, e.g. {'h': ..., 'cpp': ...}, without touching the disk.
+
+    config is the text of a config file, a dict like the one of parse_config_string(), or a list
+    of options like [flag(...), arg(...)] with struct_name. The results are memoized by the
+    processed config, so configs that differ only in writing share the work.
+    """
+    if isinstance(config, str):
+        configs = parse_config_string(config)
+    elif isinstance(config, dict):
+        configs = config
+    elif is_config_list(config):
+        if struct_name is None:
+            raise BadConfiguration('struct_name required by a list of options')
+        configs = {struct_name: config}
+    else:
+        raise BadConfiguration('bad config %r' % (config,))
+
+    struct_name, conf = get_single_config(configs, struct_name)
+    if options is None:
+        options = GenOptions()
+    sources = render_parser_memoized(
+        struct_name, tuple(process_config(conf)), source_name, target, options.with_config(configs),
+    )
+    # a copy, the memoized one is shared
+    return dict(sources)
+
+
+def write_file(filename: str, content: str, only_if_changed: bool = False) -> bool:
+    """With only_if_changed, leaves the file untouched if its content is the same, so that the build
+    tools see no change. Otherwise the file is always written and its mtime moves forward."""
+    if only_if_changed:
+        try:
+            with text_open(filename, 'rt') as fp:
+                if fp.read() == content:
+                    return False
+        except FileNotFoundError:
+            pass
+
+    with text_open(filename, 'wt+') as fp:
+        fp.write(content)
+    return True
 
-    source_name = os.path.basename(output)
-    struct_name, conf = next(iter(configs.items()))
-    argsinfo = process_config(conf)
 
-    with text_open(f'{output}.h', 'wt+') as fp:
-        fp.write(get_source(header_gen))
-    with text_open(f'{output}.cpp', 'wt+') as fp:
-        fp.write(get_source(source_gen))
+def generate_files(
+        configs: Dict, output: str, target: str = 'cpp', profile: Profile = None,
+        options: GenOptions = None, only_if_changed: bool = False
+) -> List[str]:
+    """Returns the files written. With only_if_changed, the files of the same content are skipped."""
+    if profile is None:
+        profile = Profile()
+    sources = render_sources(configs, output, target=target, profile=profile, options=options)
 
+    written = []
+    with profile.phase('write'):
+        for filename, source in sources.items():
+            if write_file(filename, source, only_if_changed):
+                written.append(filename)
+    return written
 
-def main(args=None):
-    ap = argparse.ArgumentParser(prog='arggen')
-    ap.add_argument('config_file')
-    ap.add_argument('--version', '-V', action='version', version='%(prog)s ' + __version__)
 
+def get_output_name(config_file: str, target: str):
+    output, ext = os.path.splitext(config_file)
+    if ext[1:] in (out_ext for out_ext, _ in TARGETS[target]):
+        raise BadConfiguration('input file is the same as output')
+    return output
+
+
+class Inotify:
+    """A minimal binding of inotify(7) by ctypes, linux only."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on linux')
+
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.get_errno = ctypes.get_errno
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self.get_errno(), 'inotify_init1() failed')
+        self.wd_to_dir = dict()     # type: Dict[int, str]
+
+    def add_tree(self, top: str):
+        for dirpath, _, _ in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.MASK)
+            if wd < 0:
+                raise OSError(self.get_errno(), 'inotify_add_watch() failed', dirpath)
+            self.wd_to_dir[wd] = dirpath
+
+    def read(self, timeout: float = None) -> List[Tuple[str, int]]:
+        """Blocks until some events arrive, or for at most timeout seconds, returns them as [(path, mask)]."""
+        import select
+        import struct
+
+        if timeout is not None and not select.select([self.fd], [], [], max(timeout, 0))[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            offset += 16
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            dirpath = self.wd_to_dir.get(wd)
+            if dirpath is not None and name:
+                events.append((os.path.join(dirpath, os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Watcher:
+    """Regenerates the config files under some directories when they change."""
+
+    config_ext = '.arggen'
+
+    def __init__(
+            self, dirs: Sequence[str], target: str = 'cpp', options: GenOptions = None,
+            interval: float = 0.1, retry_interval: float = 1.0, log=None
+    ):
+        self.dirs = dirs
+        self.target = target
+        self.options = options
+        self.interval = interval    # of polling, when inotify is not available
+        self.retry_interval = retry_interval    # of writing the outputs again after a failure
+        self.log = log or (lambda msg: print(msg, file=sys.stderr))
+        self.stamps = dict()        # type: Dict[str, Tuple[int, int]]
+        self.contents = dict()      # type: Dict[str, str], the contents generated
+        self.parsed = dict()        # type: Dict[str, Tuple[str, Dict]], (content, configs)
+        self.errors = dict()        # type: Dict[str, str], the last error of each file
+        self.retries = dict()       # type: Dict[str, float], when to write the outputs of a file again
+
+    def config_files(self):
+        for top in self.dirs:
+            for dirpath, _, filenames in os.walk(top):
+                for filename in sorted(filenames):
+                    if filename.endswith(self.config_ext):
+                        yield os.path.join(dirpath, filename)
+
+    def check(self, filename: str) -> bool:
+        """Regenerates the outputs of filename if it changed since the last check."""
+        start = time.perf_counter()
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            for cache in (self.stamps, self.contents, self.parsed, self.errors, self.retries):
+                cache.pop(filename, None)
+            return False
+
+        # unchanged files are neither read nor parsed again
+        stamp = st.st_mtime_ns, st.st_size
+        if self.stamps.get(filename) == stamp:
+            return False
+        self.stamps[filename] = stamp
+
+        with text_open(filename, 'rt') as fp:
+            content = fp.read()
+        if self.contents.get(filename) == content:
+            return False
+
+        self.retries.pop(filename, None)
+        configs = None
+        try:
+            configs = self.parse(filename, content)
+            output = get_output_name(filename, self.target)
+            written = generate_files(
+                configs, output, target=self.target, options=self.options, only_if_changed=True,
+            )
+        except Exception as exc:    # the config is arbitrary python code
+            # a bad config stays failed until the file changes, the outputs are retried by the timer
+            if configs is not None and isinstance(exc, OSError):
+                self.retries[filename] = time.monotonic() + self.retry_interval
+            message = f'{filename}: {exc.__class__.__name__}: {exc}'
+            if self.errors.get(filename) != message:
+                self.log(message)
+            self.errors[filename] = message
+            return False
+
+        # recorded only once generated
+        self.contents[filename] = content
+        self.errors.pop(filename, None)
+        self.log('%s: regenerated in %.1f ms, %d file(s) written' % (
+            filename, (time.perf_counter() - start) * 1000, len(written),
+        ))
+        return True
+
+    def parse(self, filename: str, content: str) -> Dict:
+        """The configs of filename, kept until its content changes. A changed config is parsed
+        again, since it is arbitrary python code."""
+        cached = self.parsed.get(filename)
+        if cached is not None and cached[0] == content:
+            return cached[1]
+        configs = parse_config_string(content)
+        self.parsed[filename] = content, configs
+        return configs
+
+    def poll(self) -> List[str]:
+        """Returns the config files regenerated."""
+        return [filename for filename in self.config_files() if self.check(filename)]
+
+    def retry(self) -> List[str]:
+        """Writes the outputs that failed again once their retry_interval passed, returns the config
+        files regenerated."""
+        now = time.monotonic()
+        regenerated = []
+        for filename in [filename for filename, at in self.retries.items() if at <= now]:
+            # checked again although unchanged, the parsed configs are kept
+            self.stamps.pop(filename, None)
+            if self.check(filename):
+                regenerated.append(filename)
+        return regenerated
+
+    def wait(self, inotify: Inotify = None) -> List[str]:
+        """Waits for the next changes by inotify, or by polling without it, regenerates them and
+        the retries that are due. Returns the config files regenerated."""
+        if inotify is None:
+            time.sleep(self.interval)
+            return self.poll() + self.retry()
+
+        timeout = None
+        if self.retries:
+            timeout = min(self.retries.values()) - time.monotonic()
+        regenerated = []
+        for path, mask in inotify.read(timeout):
+            if mask & Inotify.IN_ISDIR:
+                if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    inotify.add_tree(path)
+                    regenerated.extend(self.poll())
+            elif path.endswith(self.config_ext) and self.check(path):
+                regenerated.append(path)
+        return regenerated + self.retry()
+
+    def run(self):
+        try:
+            inotify = Inotify()
+        except OSError as exc:
+            self.log(f'inotify not available ({exc}), polling every {self.interval}s')
+            self.poll()
+            while True:
+                self.wait()
+
+        with inotify:
+            # watched before the first poll, so that no change in between is missed
+            for top in self.dirs:
+                inotify.add_tree(top)
+            self.poll()
+            while True:
+                self.wait(inotify)
+
+
+# the command line, (flags, argparse params), the only place the options are defined
+cli_options = [
+    (('config_file',), dict(nargs='?')),
+    (('--watch',), dict(
+        nargs='+', metavar='DIR',
+        help='regenerate the *.arggen files under DIRs whenever they change',
+    )),
+    (('--target',), dict(
+        choices=sorted(TARGETS), default='cpp',
+        help='language of the generated parser (default: cpp)',
+    )),
+    (('--instrument',), dict(
+        action='store_true',
+        help='emit hooks counting option hits, errors and parse time in the generated parser, '
+             'compiled in only if ARGGEN_INSTRUMENT is defined',
+    )),
+    (('--compact',), dict(
+        action='store_true',
+        help='order the fields of the struct by size and pack the flags into bitfields',
+    )),
+    (('--profile',), dict(
+        action='store_true',
+        help='print the time spent in each phase and statistics of the output to stderr',
+    )),
+    (('--stats',), dict(
+        metavar='FILE',
+        help='write the profile as json to FILE, or to stdout if FILE is -',
+    )),
+    (('--version', '-V'), dict(action='version', version='%(prog)s ' + __version__)),
+]
+
+
+def parse_common_args(args: Sequence[str]):
+    """The plain invocations, a config file and options of a single value or store_true, parsed
+    from cli_options without argparse, which is most of the startup of the command line. None for
+    anything else, e.g. --watch, --help, abbreviations or errors, which are left to argparse."""
+    from types import SimpleNamespace
+
+    ans = SimpleNamespace()
+    flags, values = dict(), dict()      # type: Dict[str, Tuple[str, Dict]]
+    for names, params in cli_options:
+        dest = names[0].lstrip('-')
+        if params.get('action') == 'version':
+            continue
+        setattr(ans, dest, params.get('default', False if params.get('action') == 'store_true' else None))
+        if params.get('action') == 'store_true':
+            flags.update((name, (dest, params)) for name in names)
+        elif 'nargs' not in params:
+            values.update((name, (dest, params)) for name in names)
+
+    it = iter(args)
+    for piece in it:
+        key, sep, value = piece.partition('=')
+        if piece in flags:
+            setattr(ans, flags[piece][0], True)
+            continue
+        if piece in values:
+            key, value = piece, next(it, None)
+            # argparse takes -x as the next option, - as a value
+            if value is None or (value[:1] == '-' and value != '-'):
+                return None
+        elif not sep or key not in values:
+            if piece[:1] == '-' or ans.config_file is not None:
+                return None
+            ans.config_file = piece
+            continue
+
+        dest, params = values[key]
+        if 'choices' in params and value not in params['choices']:
+            return None
+        setattr(ans, dest, value)
+
+    return None if ans.config_file is None else ans
+
+
+def main(args=None):
     if args is None:
         args = sys.argv[1:]
-    prog_args = ap.parse_args(args=args)
+    prog_args = parse_common_args(args)
+    if prog_args is None:
+        prog_args = parse_all_args(args)
+
+    options = GenOptions(instrument=prog_args.instrument, compact=prog_args.compact)
+    if prog_args.watch is not None:
+        try:
+            Watcher(prog_args.watch, target=prog_args.target, options=options).run()
+        except KeyboardInterrupt:
+            pass
+        return
 
-    configs = parse_config_file(prog_args.config_file)
+    profile = Profile()
+    with profile.phase('parse_config_file'):
+        configs = parse_config_file(prog_args.config_file)
 
-    output, ext = os.path.splitext(prog_args.config_file)
-    if ext in ('.cpp', '.h'):
-        raise BadConfiguration('input file is the same as output')
-    generate_files(configs, output)
+    output = get_output_name(prog_args.config_file, prog_args.target)
+    generate_files(configs, output, target=prog_args.target, profile=profile, options=options)
+
+    if prog_args.profile:
+        print(profile.summary(), file=sys.stderr)
+    if prog_args.stats == '-':
+        print(profile.to_json())
+    elif prog_args.stats is not None:
+        with text_open(prog_args.stats, 'wt+') as fp:
+            fp.write(profile.to_json())
+
+
+def parse_all_args(args: Sequence[str]):
+    import argparse
+
+    ap = argparse.ArgumentParser(prog='arggen')
+    for names, params in cli_options:
+        ap.add_argument(*names, **params)
+
+    prog_args = ap.parse_args(args=args)
+    if (prog_args.config_file is None) == (prog_args.watch is None):
+        ap.error('expect either a config_file or --watch')
+    return prog_args
 
 
 if __name__ == '__main__':
@@ -10,7 +10,7 @@ setup(
     entry_points={
         'console_scripts': ['arggen=arggen:main'],
     },
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     extras_require={
         'ci': ['pytest', 'pytest-sugar', 'pytest-cov', 'codecov'],
     },
@@ -38,7 +38,7 @@ setup(
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
         'Programming Language :: Python :: 3 :: Only',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
     keywords='argument-parser option-parser c++ cpp',
 )
@@ -0,0 +1,567 @@
+#include <algorithm> // find
+#include <climits>   // INT_MIN, INT_MAX
+#include <cstdint>   // uint32_t, uint64_t
+#include <cstdlib>   // atol, getenv
+#include <cstring>   // strlen, strcspn
+#include <string>    // to_string
+#include "test.h"
+
+// WARNING: Automatically generated code by arggen.py. Do not edit.
+
+
+// the definition of the static member, required before c++17
+constexpr char MyOption::usage[];
+
+
+bool MyOption::operator==(const MyOption &rhs) const {
+    return std::tie(this->asdf, this->bar, this->color, this->foo, this->hahaha, this->qwer, this->verbose) \
+        == std::tie(rhs.asdf, rhs.bar, rhs.color, rhs.foo, rhs.hahaha, rhs.qwer, rhs.verbose);
+}
+bool MyOption::operator!=(const MyOption &rhs) const {
+    return !(*this == rhs);
+}
+
+
+const char *MyOption::to_string(Color value) {
+    switch (value) {
+    case Color::kAuto:
+        return "auto";
+    case Color::kAlways:
+        return "always";
+    case Color::kNever:
+        return "never";
+    }
+    return "";
+}
+
+
+std::string MyOption::to_string() const {
+    std::string ans = "<MyOption";
+    ans += " foo=";
+    ans += this->foo ? "true" : "false";
+    ans += " verbose=";
+    ans += std::to_string(this->verbose);
+    ans += " bar=";
+    ans += std::to_string(this->bar);
+    ans += " qwer=";
+    ans += '"' + this->qwer + '"';
+    ans += " hahaha=";
+    ans += '"' + this->hahaha + '"';
+    ans += " color=";
+    ans += to_string(this->color);
+    ans += " asdf=";
+    for (const auto &item : this->asdf) {
+        ans += item + ",";
+    }
+    return ans + ">";
+}
+
+
+namespace {
+
+    // yields the items of a vector
+    struct ArgsCursor {
+        const std::vector<std::string> &args;
+        size_t i;
+
+        const std::string *next() {
+            return i < args.size() ? &args[i++] : nullptr;
+        }
+    };
+
+    // yields the items of argv one at a time into a reused buffer, without copying argv
+    struct ArgvCursor {
+        const char *const *argv;
+        int argc;
+        int i;
+        std::string piece;
+
+        const std::string *next() {
+            if (i >= argc) {
+                return nullptr;
+            }
+            piece.assign(argv[i++]);
+            return &piece;
+        }
+    };
+
+    // splits a command line like a POSIX shell (quotes and backslashes, no expansions),
+    // one argument at a time into a reused buffer
+    struct LineCursor {
+        const char *it;
+        const char *end;
+        std::string piece;
+
+        static bool is_space(char ch) {
+            return ch == ' ' || ch == '\t' || ch == '\n';
+        }
+
+        // characters that keep the special meaning of backslash inside double quotes
+        static bool is_dquote_escape(char ch) {
+            return ch == '"' || ch == '\\' || ch == '$' || ch == '`' || ch == '\n';
+        }
+
+        const std::string *next() {
+            while (it != end && is_space(*it)) {
+                ++it;
+            }
+            if (it == end) {
+                return nullptr;
+            }
+
+            piece.clear();
+            while (it != end && !is_space(*it)) {
+                char ch = *it++;
+                if (ch == '\\') {
+                    if (it == end) {
+                        throw ArgError("trailing backslash");
+                    }
+                    // backslash-newline is a line continuation
+                    if (*it != '\n') {
+                        piece += *it;
+                    }
+                    ++it;
+                } else if (ch == '\'') {
+                    const char *close = std::find(it, end, '\'');
+                    if (close == end) {
+                        throw ArgError("unterminated single quote");
+                    }
+                    piece.append(it, close);
+                    it = close + 1;
+                } else if (ch == '"') {
+                    for (;;) {
+                        if (it == end) {
+                            throw ArgError("unterminated double quote");
+                        }
+                        ch = *it++;
+                        if (ch == '"') {
+                            break;
+                        }
+                        if (ch == '\\' && it != end && is_dquote_escape(*it)) {
+                            if (*it != '\n') {
+                                piece += *it;
+                            }
+                            ++it;
+                        } else {
+                            piece += ch;
+                        }
+                    }
+                } else {
+                    piece += ch;
+                }
+            }
+            return &piece;
+        }
+    };
+
+    const uint64_t schema_fingerprint = 0x48f7a0f84d79b752ull;
+
+    // inline, since some may not be used by the fields
+    inline void put_varint(std::string &buffer, uint64_t value) {
+        while (value >= 0x80) {
+            buffer += static_cast<char>(value | 0x80);
+            value >>= 7;
+        }
+        buffer += static_cast<char>(value);
+    }
+
+    inline void put_int(std::string &buffer, int value) {
+        // zigzag, small negative numbers stay short
+        int64_t wide = value;
+        put_varint(buffer, wide < 0
+            ? (static_cast<uint64_t>(-(wide + 1)) << 1) | 1 : static_cast<uint64_t>(wide) << 1);
+    }
+
+    inline void put_string(std::string &buffer, const std::string &value) {
+        put_varint(buffer, value.size());
+        buffer += value;
+    }
+
+    inline void put_fixed64(std::string &buffer, uint64_t value) {
+        for (int i = 0; i < 8; i++) {
+            buffer += static_cast<char>(value >> (8 * i));
+        }
+    }
+
+    struct Reader {
+        const char *it;
+        const char *end;
+
+        unsigned char byte() {
+            if (it == end) {
+                throw ArgError("truncated data");
+            }
+            return static_cast<unsigned char>(*it++);
+        }
+
+        uint64_t varint() {
+            uint64_t value = 0;
+            for (int shift = 0; shift < 64; shift += 7) {
+                unsigned char ch = byte();
+                value |= static_cast<uint64_t>(ch & 0x7f) << shift;
+                if (!(ch & 0x80)) {
+                    return value;
+                }
+            }
+            throw ArgError("bad varint");
+        }
+
+        int integer() {
+            uint64_t value = varint();
+            int64_t wide = value & 1 ? -static_cast<int64_t>(value >> 1) - 1 : static_cast<int64_t>(value >> 1);
+            if (wide < INT_MIN || wide > INT_MAX) {
+                throw ArgError("int out of range");
+            }
+            return static_cast<int>(wide);
+        }
+
+        int index(uint64_t count) {
+            uint64_t value = varint();
+            if (value >= count) {
+                throw ArgError("bad enum value");
+            }
+            return static_cast<int>(value);
+        }
+
+        // every item takes a byte at least, so a bad count is not allocated
+        size_t count() {
+            uint64_t value = varint();
+            if (value > static_cast<uint64_t>(end - it)) {
+                throw ArgError("truncated data");
+            }
+            return static_cast<size_t>(value);
+        }
+
+        void string(std::string &out) {
+            size_t size = count();
+            out.assign(it, size);
+            it += size;
+        }
+
+        uint64_t fixed64() {
+            uint64_t value = 0;
+            for (int i = 0; i < 8; i++) {
+                value |= static_cast<uint64_t>(byte()) << (8 * i);
+            }
+            return value;
+        }
+    };
+
+    MyOption::Color color_from_string(const char *value) {
+        // perfect hash of the choices of color, computed by arggen
+        static const struct { const char *name; int index; } table[4] = {
+            {"always", 1},
+            {"never", 2},
+            {"auto", 0},
+            {nullptr, -1},
+        };
+        uint32_t hash = 2166136261u;
+        for (const char *it = value; *it != '\0'; ++it) {
+            hash = (hash ^ (unsigned char)*it) * 16777619u;
+        }
+        const int slot = (int)(hash & 3u);
+        const int index = table[slot].name != nullptr && strcmp(table[slot].name, value) == 0
+            ? table[slot].index : -1;
+        if (index < 0) {
+            throw ArgError(std::string("bad value for color: ") + value + ", expect one of auto, always, never");
+        }
+        return static_cast<MyOption::Color>(index);
+    }
+
+    const char *suggest_option(const char *piece) {
+        // candidates: (option, length, max edit distance), computed by arggen
+        static const struct { const char *option; size_t length; size_t max_distance; } table[5] = {
+            {"--bar", 5, 1},
+            {"--color", 7, 1},
+            {"--foo", 5, 1},
+            {"--qwer", 6, 1},
+            {"--verbose", 9, 2},
+        };
+        const size_t length = strcspn(piece, "=");
+        const char *best = nullptr;
+        size_t best_distance = (size_t)-1;
+        // a row of the levenshtein matrix, over the longest option
+        size_t row[10];
+        for (size_t k = 0; k < 5; k++) {
+            const char *option = table[k].option;
+            const size_t n = table[k].length;
+            if ((length > n ? length - n : n - length) > table[k].max_distance) {
+                continue;
+            }
+            for (size_t j = 0; j <= n; j++) {
+                row[j] = j;
+            }
+            for (size_t i = 1; i <= length; i++) {
+                size_t diagonal = row[0];
+                row[0] = i;
+                for (size_t j = 1; j <= n; j++) {
+                    const size_t above = row[j];
+                    size_t value = diagonal + (piece[i - 1] == option[j - 1] ? 0 : 1);
+                    if (above + 1 < value) {
+                        value = above + 1;
+                    }
+                    if (row[j - 1] + 1 < value) {
+                        value = row[j - 1] + 1;
+                    }
+                    row[j] = value;
+                    diagonal = above;
+                }
+            }
+            // an exact match is a known option misused, nothing to suggest
+            if (row[n] > 0 && row[n] <= table[k].max_distance && row[n] < best_distance) {
+                best = option;
+                best_distance = row[n];
+            }
+        }
+        return best;
+    }
+
+    // the first pass over the args: counts the positional args, those after "--" included,
+    // and the values of append options, skipping the values of the other options, so that
+    // the vectors are reserved exactly. linear and allocates nothing, the parse that follows
+    // checks everything.
+    template <class Get>
+    void reserve_vectors(MyOption &ans, size_t size, Get get) {
+        size_t count = 0;
+        for (size_t i = 0; i < size; i++) {
+            const char *piece = get(i);
+            if (piece[0] != '-' || piece[1] == '\0') {
+                count++;
+            } else if (piece[1] == '-' && piece[2] == '\0') {
+                count += size - i - 1;
+                break;
+            } else if (strcmp(piece, "--bar") == 0) {
+                i++;    // the value
+            } else if (strcmp(piece, "--color") == 0) {
+                i++;    // the value
+            } else if (strcmp(piece, "--qwer") == 0) {
+                i++;    // the value
+            } else if (piece[2] == '\0' && (piece[1] == 'b' || piece[1] == 'c')) {
+                i++;    // the value
+            }
+        }
+        if (count > 1) {
+            ans.asdf.reserve(count - 1);
+        }
+    }
+
+    template <class Cursor>
+    static inline void take_next_value(Cursor &cursor, const char *opt, int &field) {
+        const std::string *value = cursor.next();
+        if (value == nullptr || (*value)[0] == '-') {
+            throw ArgError(std::string("no value for ") + opt);
+        }
+        field = atol(value->data());
+    }
+
+    template <class Cursor>
+    static inline void take_next_value_2(Cursor &cursor, const char *opt, MyOption::Color &field) {
+        const std::string *value = cursor.next();
+        if (value == nullptr || (*value)[0] == '-') {
+            throw ArgError(std::string("no value for ") + opt);
+        }
+        field = color_from_string(value->data());
+    }
+
+    template <class Cursor>
+    void parse_cursor(MyOption &ans, Cursor &cursor) {
+        // reset to defaults, keeping the capacity of strings and vectors
+        size_t n_asdf = 0;
+        ans.bar = 123;
+        ans.color = MyOption::Color::kAuto;
+        ans.foo = false;
+        ans.hahaha.clear();
+        ans.qwer.clear();
+        ans.verbose = 0;
+
+        int position_count = 0;
+        bool options_done = false;
+        // required options
+        bool has_qwer = false;
+        // environment variables, over the defaults and under the args
+        if (const char *env = getenv("ARGGEN_TEST_FOO")) {
+            ans.foo = env[0] != '\0' && strcmp(env, "0") != 0;
+        }
+        if (const char *env = getenv("ARGGEN_TEST_QWER")) {
+            ans.qwer = env;
+            has_qwer = true;
+        }
+        if (const char *env = getenv("ARGGEN_TEST_VERBOSE")) {
+            ans.verbose = atol(env);
+        }
+        while (const std::string *cur = cursor.next()) {
+            const std::string &piece = *cur;
+            if (options_done || piece.size() < 2 || piece[0] != '-') {
+                // positional args
+                if (position_count == 0) {
+                    ans.hahaha = piece.data();
+                } else {
+                    if (n_asdf < ans.asdf.size()) {
+                        ans.asdf[n_asdf] = piece;
+                    } else {
+                        ans.asdf.emplace_back(piece);
+                    }
+                    n_asdf++;
+                }
+                position_count++;
+            } else if (piece.size() == 2 && piece[1] == '-') {
+                // "--", the rest are positional args
+                options_done = true;
+            } else if (piece[1] == '-') {
+                // long options
+                if (piece == "--bar") {
+                    take_next_value(cursor, "--bar", ans.bar);
+                } else if (piece.compare(0, strlen("--bar="), "--bar=") == 0) {
+                    ans.bar = atol(piece.data() + strlen("--bar="));
+                } else if (piece == "--color") {
+                    take_next_value_2(cursor, "--color", ans.color);
+                } else if (piece.compare(0, strlen("--color="), "--color=") == 0) {
+                    ans.color = color_from_string(piece.data() + strlen("--color="));
+                } else if (piece == "--qwer") {
+                    const std::string *value = cursor.next();
+                    if (value == nullptr || (*value)[0] == '-') {
+                        throw ArgError("no value for --qwer");
+                    }
+                    ans.qwer = value->data();
+                    has_qwer = true;
+                } else if (piece.compare(0, strlen("--qwer="), "--qwer=") == 0) {
+                    ans.qwer = piece.data() + strlen("--qwer=");
+                    has_qwer = true;
+                } else if (piece == "--foo") {
+                    ans.foo = true;
+                } else if (piece == "--verbose") {
+                    ans.verbose++;
+                } else {
+                    const char *suggestion = suggest_option(piece.c_str());
+                    throw ArgError("Unknown option: " + piece + (suggestion ? std::string(", did you mean ") + suggestion + "?" : ""));
+                }
+            } else {
+                // short options
+                if (piece[1] == 'b') {
+                    if (piece.size() > 2) {
+                        ans.bar = atol(piece.data() + 2);
+                    } else {
+                        take_next_value(cursor, "-b", ans.bar);
+                    }
+                } else if (piece[1] == 'c') {
+                    if (piece.size() > 2) {
+                        ans.color = color_from_string(piece.data() + 2);
+                    } else {
+                        take_next_value_2(cursor, "-c", ans.color);
+                    }
+                } else {
+                    for (auto it = piece.begin() + 1; it != piece.end(); ++it) {
+                        if (*it == 'f') {
+                            ans.foo = true;
+                        } else if (*it == 'v') {
+                            ans.verbose++;
+                        } else {
+                            throw ArgError("Unknown flag: " + std::string(1, *it));
+                        }
+                    }
+                }
+            }
+        }
+
+        // check required options
+        if (!has_qwer) {
+            throw ArgError("qwer required");
+        }
+        // check positional args
+        if (position_count < 1) {
+            throw ArgError("expect more argument");
+        }
+
+        // drop the items left over from previous parses
+        ans.asdf.resize(n_asdf);
+    }
+
+}
+
+
+MyOption MyOption::parse_args(const std::vector<std::string> &args) {
+    MyOption ans {};   // initialized
+    MyOption::parse_into(ans, args);
+    return ans;
+}
+
+void MyOption::parse_into(MyOption &out, const std::vector<std::string> &args) {
+    reserve_vectors(out, args.size(), [&args](size_t i) { return args[i].c_str(); });
+    ArgsCursor cursor {args, 0};
+    parse_cursor(out, cursor);
+}
+
+
+MyOption MyOption::parse_line(const std::string &line) {
+    MyOption ans {};   // initialized
+    MyOption::parse_line_into(ans, line);
+    return ans;
+}
+
+void MyOption::parse_line_into(MyOption &out, const std::string &line) {
+    LineCursor cursor {line.data(), line.data() + line.size(), {}};
+    parse_cursor(out, cursor);
+}
+
+
+MyOption MyOption::parse_argv(int argc, const char *const argv[]) {
+    MyOption ans {};   // initialized
+    MyOption::parse_argv_into(ans, argc, argv);
+    return ans;
+}
+
+void MyOption::parse_argv_into(MyOption &out, int argc, const char *const argv[]) {
+    reserve_vectors(out, argc > 1 ? (size_t)(argc - 1) : 0, [argv](size_t i) { return argv[i + 1]; });
+    ArgvCursor cursor {argv, argc, 1, {}};
+    parse_cursor(out, cursor);
+}
+
+
+void MyOption::serialize(std::string &buffer) const {
+    buffer += static_cast<char>(1);   // version
+    put_fixed64(buffer, schema_fingerprint);
+    buffer += static_cast<char>(0
+        | (this->foo ? 0x1 : 0)
+    );
+    put_varint(buffer, this->asdf.size());
+    for (const auto &item : this->asdf) {
+        put_string(buffer, item);
+    }
+    put_int(buffer, this->bar);
+    put_varint(buffer, static_cast<uint64_t>(this->color));
+    put_string(buffer, this->hahaha);
+    put_string(buffer, this->qwer);
+    put_int(buffer, this->verbose);
+}
+
+
+MyOption MyOption::deserialize(const std::string &buffer) {
+    MyOption ans {};   // initialized
+    MyOption::deserialize_into(ans, buffer.data(), buffer.size());
+    return ans;
+}
+
+void MyOption::deserialize_into(MyOption &out, const char *data, size_t size) {
+    Reader reader {data, data + size};
+    if (reader.byte() != 1) {
+        throw ArgError("unsupported serialization format");
+    }
+    if (reader.fixed64() != schema_fingerprint) {
+        throw ArgError("serialized by another schema of MyOption");
+    }
+    unsigned char bits = reader.byte();
+    out.foo = (bits & 0x1) != 0;
+    // the existing items are reused
+    out.asdf.resize(reader.count());
+    for (auto &item : out.asdf) {
+        reader.string(item);
+    }
+    out.bar = reader.integer();
+    out.color = static_cast<Color>(reader.index(3));
+    reader.string(out.hahaha);
+    reader.string(out.qwer);
+    out.verbose = reader.integer();
+    if (reader.it != reader.end) {
+        throw ArgError("trailing bytes");
+    }
+}
@@ -0,0 +1,110 @@
+#ifndef ARGGEN_TEST_H
+#define ARGGEN_TEST_H
+
+// WARNING: Automatically generated code by arggen.py. Do not edit.
+
+#include <initializer_list>
+#include <stdexcept>
+#include <string>
+#include <tuple>
+#include <vector>
+
+
+class ArgError : public std::runtime_error {
+public:
+    ArgError(const std::string &msg) : std::runtime_error(msg) {}
+};
+
+
+struct MyOption {
+    // kinds of options, see for_each_field()
+    enum class ArgType {
+        kBool,
+        kCount,
+        kOne,
+        kRest,
+        kAppend,
+    };
+
+    enum class Color {
+        kAuto,
+        kAlways,
+        kNever,
+    };
+
+    // options: ('asdf',), arg_type: ArgType.REST
+    std::vector<std::string> asdf;
+    // options: ('--bar', '-b'), arg_type: ArgType.ONE
+    int bar = 123;
+    // options: ('--color', '-c'), arg_type: ArgType.ONE
+    Color color = Color::kAuto;
+    // options: ('--foo', '-f'), arg_type: ArgType.BOOL
+    bool foo = false;
+    // options: ('haha',), arg_type: ArgType.ONE
+    std::string hahaha;
+    // options: ('--qwer',), arg_type: ArgType.ONE
+    std::string qwer;
+    // options: ('-v', '--verbose'), arg_type: ArgType.COUNT
+    int verbose;
+
+    std::string to_string() const;
+    static const char *to_string(Color value);
+    bool operator==(const MyOption &rhs) const;
+    bool operator!=(const MyOption &rhs) const;
+    static MyOption parse_args(const std::vector<std::string> &args);
+    static void parse_into(MyOption &out, const std::vector<std::string> &args);
+    static MyOption parse_line(const std::string &line);
+    static void parse_line_into(MyOption &out, const std::string &line);
+    static MyOption parse_argv(int argc, const char *const argv[]);
+    static void parse_argv_into(MyOption &out, int argc, const char *const argv[]);
+    // binary format, see serialize_method_gen() of arggen.py
+    void serialize(std::string &buffer) const;
+    static MyOption deserialize(const std::string &buffer);
+    static void deserialize_into(MyOption &out, const char *data, size_t size);
+
+    // laid out by arggen, printed with a single write, e.g.
+    // fwrite(usage, 1, sizeof(usage) - 1, stdout)
+    static constexpr char usage[] =
+        "usage: test [-f] [-v] [-b BAR] --qwer QWER [-c {auto,always,never}] haha\n"
+        "            [asdf ...]\n"
+        "\n"
+        "positional arguments:\n"
+        "  haha                  the haha\n"
+        "  asdf ...\n"
+        "\n"
+        "options:\n"
+        "  -f, --foo             enable foo [env: ARGGEN_TEST_FOO]\n"
+        "  -v, --verbose         more output, repeat for even more\n"
+        "                        [env: ARGGEN_TEST_VERBOSE]\n"
+        "  -b, --bar BAR         (default: 123)\n"
+        "  --qwer QWER           the qwer to use, a long help that wraps onto the next\n"
+        "                        line [env: ARGGEN_TEST_QWER]\n"
+        "  -c, --color {auto,always,never}\n"
+        "                        when to colorize (default: auto)\n";
+
+    // calls visitor(name, options, arg_type, field) on each field in the order of declaration,
+    // everything is resolved at compile time
+    template <class Visitor>
+    void for_each_field(Visitor &&visitor) {
+        visitor("asdf", std::initializer_list<const char *>{"asdf"}, ArgType::kRest, this->asdf);
+        visitor("bar", std::initializer_list<const char *>{"--bar", "-b"}, ArgType::kOne, this->bar);
+        visitor("color", std::initializer_list<const char *>{"--color", "-c"}, ArgType::kOne, this->color);
+        visitor("foo", std::initializer_list<const char *>{"--foo", "-f"}, ArgType::kBool, this->foo);
+        visitor("hahaha", std::initializer_list<const char *>{"haha"}, ArgType::kOne, this->hahaha);
+        visitor("qwer", std::initializer_list<const char *>{"--qwer"}, ArgType::kOne, this->qwer);
+        visitor("verbose", std::initializer_list<const char *>{"-v", "--verbose"}, ArgType::kCount, this->verbose);
+    }
+
+    template <class Visitor>
+    void for_each_field(Visitor &&visitor) const {
+        visitor("asdf", std::initializer_list<const char *>{"asdf"}, ArgType::kRest, this->asdf);
+        visitor("bar", std::initializer_list<const char *>{"--bar", "-b"}, ArgType::kOne, this->bar);
+        visitor("color", std::initializer_list<const char *>{"--color", "-c"}, ArgType::kOne, this->color);
+        visitor("foo", std::initializer_list<const char *>{"--foo", "-f"}, ArgType::kBool, this->foo);
+        visitor("hahaha", std::initializer_list<const char *>{"haha"}, ArgType::kOne, this->hahaha);
+        visitor("qwer", std::initializer_list<const char *>{"--qwer"}, ArgType::kOne, this->qwer);
+        visitor("verbose", std::initializer_list<const char *>{"-v", "--verbose"}, ArgType::kCount, this->verbose);
+    }
+};
+
+#endif // ARGGEN_TEST_H
@@ -0,0 +1,66 @@
+#include <cassert>
+#include <cstring>
+#include <string>
+#include <vector>
+
+#include "append_parser.h"
+
+
+using Strings = std::vector<std::string>;
+
+
+int main() {
+    AppendOption opt = AppendOption::parse_args({
+        "-Isrc", "a.c", "--include", "lib", "-D", "X=1,Y", "--include=inc", "-l1:2", "b.c", "--level", "3",
+    });
+    assert((opt.include == Strings {"src", "lib", "inc"}));
+    assert((opt.define == Strings {"X=1", "Y"}));
+    assert((opt.level == std::vector<int> {1, 2, 3}));
+    assert((opt.inputs == Strings {"a.c", "b.c"}));
+    assert(opt.out == "a.out");
+    // reserved exactly by the first pass
+    assert(opt.include.capacity() == 3);
+    assert(opt.define.capacity() == 2);
+    assert(opt.level.capacity() == 3);
+
+    // each item converted as by atol()
+    opt = AppendOption::parse_args({"--level= 7:+8:-9:x:10y"});
+    assert((opt.level == std::vector<int> {7, 8, -9, 0, 10}));
+
+    // the empty items of the split form are kept
+    opt = AppendOption::parse_args({"-D", ",A,", "-DB"});
+    assert((opt.define == Strings {"", "A", "", "B"}));
+
+    // reparsed into the same struct, the items are overwritten and the capacity is kept
+    AppendOption::parse_into(opt, {"-DC"});
+    assert((opt.define == Strings {"C"}));
+    assert(opt.define.capacity() >= 4);
+    assert(opt.include.empty() && opt.level.empty() && opt.inputs.empty());
+
+    const char *argv[] = {"prog", "-I", "x", "--", "-Iy"};
+    AppendOption::parse_argv_into(opt, 5, argv);
+    assert((opt.include == Strings {"x"}));
+    assert((opt.inputs == Strings {"-Iy"}));
+
+    AppendOption::parse_line_into(opt, "-I 'a b' -l 7:8 -v");
+    assert((opt.include == Strings {"a b"}));
+    assert((opt.level == std::vector<int> {7, 8}));
+    assert(opt.verbose);
+
+    bool failed = false;
+    try {
+        AppendOption::parse_args({"-I"});
+    } catch (const ArgError &) {
+        failed = true;
+    }
+    assert(failed);
+
+    opt = AppendOption::parse_args({"-Ia", "-D", "X,Y", "-l-1", "c"});
+    std::string buffer;
+    opt.serialize(buffer);
+    assert(AppendOption::deserialize(buffer) == opt);
+    assert(opt.to_string() == "<AppendOption verbose=false include=a, define=X,Y, level=-1, out=\"a.out\" inputs=c,>");
+
+    assert(std::strstr(AppendOption::usage, "[-I INCLUDE]... [-D DEFINE[,DEFINE...]]...") != nullptr);
+    return 0;
+}
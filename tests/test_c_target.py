@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from arggen import BadConfiguration, generate_files, parse_config_file
+from tests.test_generated_source import cmd
+
+
+def test_c_target(tmpdir):
+    output = str(tmpdir.join('c_parser'))
+    generate_files(parse_config_file('tests/test.arggen'), output, target='c')
+
+    CC = os.environ.get('CC', 'cc')
+    cflags = ['-std=c99', '-Wall', '-Wextra', '-pedantic', '-Werror', '-I', str(tmpdir)]
+    executable = str(tmpdir.join('test_c'))
+    cmd(CC, *cflags, output + '.c', 'tests/test_main.c', '-o', executable)
+    cmd(executable)
+
+
+def test_append_unsupported(tmpdir):
+    with pytest.raises(BadConfiguration):
+        generate_files(parse_config_file('tests/test_append.arggen'), str(tmpdir.join('parser')), target='c')
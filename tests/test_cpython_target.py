@@ -0,0 +1,89 @@
+import importlib.util
+import os
+import sys
+import sysconfig
+
+import pytest
+
+from arggen import generate_files, parse_config_file
+from tests.test_generated_source import cmd
+
+
+# built with -shared -fPIC, the python symbols are left to be resolved at load time, which
+# only linux does by default. macos would need -undefined dynamic_lookup, windows libpython
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='extension built for linux only')
+
+
+@pytest.fixture(scope='module')
+def mod(tmpdir_factory):
+    tmpdir = tmpdir_factory.mktemp('cpython_target')
+    output = str(tmpdir.join('cparser'))
+    generate_files(parse_config_file('tests/test.arggen'), output, target='cpython')
+
+    CXX = os.environ.get('CXX', 'c++')
+    library = output + sysconfig.get_config_var('EXT_SUFFIX')
+    cmd(
+        CXX, '-std=c++11', '-Wall', '-Wextra', '-Werror', '-shared', '-fPIC',
+        '-I', sysconfig.get_paths()['include'], output + '.module.cpp', '-o', library,
+    )
+
+    spec = importlib.util.spec_from_file_location('cparser', library)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_parse_args(mod):
+    opt = mod.parse_args(['--bar', '456', '-vfv', '--qwer', 'abc', 'haha', '-cnever', 'A1', 'A2'])
+    assert isinstance(opt, mod.MyOption)
+    assert (opt.asdf, opt.bar, opt.color, opt.foo, opt.hahaha, opt.qwer, opt.verbose) == \
+        (['A1', 'A2'], 456, 'never', True, 'haha', 'abc', 2)
+    assert mod.parse_args(('--qwer', 'é', 'haha')).qwer == 'é'
+
+    with pytest.raises(mod.ArgError, match='qwer required'):
+        mod.parse_args(['haha'])
+    with pytest.raises(TypeError):
+        mod.parse_args(['--qwer', 1, 'haha'])
+    with pytest.raises(TypeError):
+        mod.parse_args('--qwer')
+
+
+def test_terminator(mod):
+    args = ['--qwer', 'abc', 'haha'] + ['-v'] * 1000 + ['--'] + ['-v'] * 1000
+    opt = mod.parse_args(args)
+    assert (opt.verbose, opt.asdf) == (1000, ['-v'] * 1000)
+
+
+def test_usage(mod):
+    assert mod.USAGE.startswith('usage: cparser [-f] [-v] [-b BAR] --qwer QWER')
+    with pytest.raises(mod.ArgError, match='did you mean --color'):
+        mod.parse_args(['--qwer', 'abc', 'haha', '--colr'])
+
+
+def test_parse_many(mod):
+    results = mod.parse_many([['--qwer', 'a', 'h1'], ['h2'], ['--qwer', 'b', 'h3', 'A']])
+    assert len(results) == 3
+    assert results[0].hahaha == 'h1'
+    assert isinstance(results[1], mod.ArgError)
+    assert results[2].asdf == ['A']
+
+    with pytest.raises(TypeError):
+        mod.parse_many([['--qwer', 'a', 'h1'], [None]])
+
+
+def test_append(tmpdir):
+    output = str(tmpdir.join('append_parser'))
+    generate_files(parse_config_file('tests/test_append.arggen'), output, target='cpython')
+
+    CXX = os.environ.get('CXX', 'c++')
+    library = output + sysconfig.get_config_var('EXT_SUFFIX')
+    cmd(
+        CXX, '-std=c++11', '-Wall', '-Wextra', '-Werror', '-shared', '-fPIC',
+        '-I', sysconfig.get_paths()['include'], output + '.module.cpp', '-o', library,
+    )
+    spec = importlib.util.spec_from_file_location('append_parser', library)
+    append_mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(append_mod)
+
+    opt = append_mod.parse_args(['-Ia', 'x', '-D', 'X,Y', '-l', '4', '--include=b'])
+    assert (opt.include, opt.define, opt.level, opt.inputs) == (['a', 'b'], ['X', 'Y'], [4], ['x'])
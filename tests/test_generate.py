@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from arggen import (
+    ArgError, BadConfiguration, GenOptions, ValueType, flag, arg, generate, generate_files,
+    parse_config_file, parse_config_string, render_parser_memoized,
+)
+
+CONFIG_TEXT = '''
+MyOption = [
+    flag('--foo', '-f'),
+    arg('--bar', type=ValueType.INT, default=1),
+]
+'''
+
+
+def test_generate(tmpdir):
+    sources = generate(CONFIG_TEXT, source_name='opt')
+    assert set(sources) == {'h', 'cpp'}
+    assert 'struct MyOption {' in sources['h']
+    assert '#include "opt.h"' in sources['cpp']
+    assert tmpdir.listdir() == []
+
+    # same as the files
+    output = str(tmpdir.join('test'))
+    generate_files(parse_config_file('tests/test.arggen'), output)
+    sources = generate(parse_config_file('tests/test.arggen'), source_name='test')
+    for ext in ('h', 'cpp'):
+        with open(f'{output}.{ext}') as fp:
+            assert fp.read() == sources[ext]
+
+    assert set(generate(CONFIG_TEXT, target='python')) == {'py'}
+
+
+def test_generate_files_only_if_changed(tmpdir):
+    output = str(tmpdir.join('opt'))
+    configs = parse_config_string(CONFIG_TEXT)
+    assert sorted(generate_files(configs, output)) == [output + '.cpp', output + '.h']
+
+    # written again by default, so that the mtime moves forward
+    os.utime(output + '.h', ns=(0, 0))
+    assert sorted(generate_files(configs, output)) == [output + '.cpp', output + '.h']
+    assert os.stat(output + '.h').st_mtime_ns != 0
+
+    os.utime(output + '.h', ns=(0, 0))
+    assert generate_files(configs, output, only_if_changed=True) == []
+    assert os.stat(output + '.h').st_mtime_ns == 0
+
+
+def test_generate_memoized():
+    render_parser_memoized.cache_clear()
+    config = [flag('--foo', '-f'), arg('--bar', type=ValueType.INT, default=1)]
+
+    first = generate(config, struct_name='MyOption', source_name='opt')
+    # another writing of the same config
+    second = generate(CONFIG_TEXT.replace('    ', '        '), source_name='opt')
+    assert first == second
+    assert render_parser_memoized.cache_info().hits == 1
+
+    first['h'] = ''
+    assert generate(CONFIG_TEXT, source_name='opt')['h'] != ''
+
+    generate(CONFIG_TEXT, source_name='opt', options=GenOptions(compact=True))
+    assert render_parser_memoized.cache_info().misses == 2
+
+
+def test_generate_bad_config():
+    with pytest.raises(BadConfiguration):
+        generate([flag('--foo')])
+    with pytest.raises(BadConfiguration):
+        generate(CONFIG_TEXT, struct_name='Other')
+    with pytest.raises(BadConfiguration):
+        generate(CONFIG_TEXT + 'Other = [flag("--foo")]')
+    with pytest.raises(BadConfiguration):
+        generate(123)
+
+
+def test_generate_default_types():
+    # 1 == True and lists are not hashable, the defaults are checked before the memo
+    generate([arg('--bar', type=ValueType.INT, default=1)], struct_name='MyOption')
+    for bad in [
+        arg('--bar', type=ValueType.INT, default=True),
+        arg('--bar', type=ValueType.INT, default=1.0),
+        arg('--bar', type=ValueType.INT, default=[1]),
+        arg('--bar', default=1),
+        arg('--bar', default=['a']),
+        arg('--bar', type='int'),
+    ]:
+        with pytest.raises(ArgError):
+            generate([bad], struct_name='MyOption')
+
+
+def test_generate_prog(tmpdir):
+    assert 'usage: opt [-f]' in generate(CONFIG_TEXT, source_name='opt')['h']
+    config = "prog = 'my-tool'\n" + CONFIG_TEXT
+    for target, ext in (('cpp', 'h'), ('c', 'c'), ('python', 'py')):
+        assert 'usage: my-tool [-f]' in generate(config, source_name='opt', target=target)[ext]
+    # given by the user of arggen over the config file
+    assert 'usage: other [-f]' in generate(config, source_name='opt', options=GenOptions(prog='other'))['h']
+
+    output = str(tmpdir.join('opt'))
+    generate_files(parse_config_string(config), output)
+    with open(output + '.h') as fp:
+        assert 'usage: my-tool [-f]' in fp.read()
+
+    for bad in ("prog = ''\n", "prog = 'a b'\n", 'prog = 1\n'):
+        with pytest.raises(BadConfiguration):
+            generate(bad + CONFIG_TEXT)
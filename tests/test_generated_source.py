@@ -1,11 +1,14 @@
+import json
 import subprocess
 import os
+import shutil
 import re
 import sys
 from typing import Sequence, Dict
 
 from arggen import (
-    flag, count, arg, rest, ValueType, generate_files, main,
+    flag, count, arg, rest, ValueType, GenOptions, generate_files, main, parse_config_file,
+    parse_config_string,
 )
 
 
@@ -49,3 +52,119 @@ def test_generate_source():
     link_objects(env, ['tests/test.o', 'tests/test_main.o', 'tests/catch.o'], 'tests/test')
 
     cmd('tests/test', '-d', 'yes', '-s')
+
+
+def test_instrument(tmpdir):
+    shutil.copy('tests/test_main.cpp', str(tmpdir))
+    output = str(tmpdir.join('test'))
+    generate_files(parse_config_file('tests/test.arggen'), output, options=GenOptions(instrument=True))
+
+    env = get_env()
+    env['CXXFLAGS'].extend(['-std=c++11', '-Wall', '-Wextra'])
+    compile_source(env, 'tests/catch.cpp')
+    # the generated test.h first, catch.hpp from tests
+    env['CXXFLAGS'].extend(['-I', str(tmpdir), '-I', 'tests'])
+    objects = [output + '.cpp', str(tmpdir.join('test_main.cpp')), 'tests/catch.o']
+    # the hooks compile to nothing without ARGGEN_INSTRUMENT
+    link_objects(env, objects, output)
+    cmd(output, '-d', 'yes')
+
+    env['CXXFLAGS'].append('-DARGGEN_INSTRUMENT')
+    link_objects(env, objects, output)
+    cmd(output, '-d', 'yes')
+
+
+def test_compact_layout(tmpdir):
+    # the same tests against the packed struct
+    shutil.copy('tests/test_main.cpp', str(tmpdir))
+    output = str(tmpdir.join('test'))
+    generate_files(parse_config_file('tests/test.arggen'), output, options=GenOptions(compact=True))
+
+    env = get_env()
+    env['CXXFLAGS'].extend(['-std=c++11', '-Wall', '-Wextra'])
+    compile_source(env, 'tests/catch.cpp')
+    env['CXXFLAGS'].extend(['-I', 'tests'])
+    link_objects(env, [output + '.cpp', str(tmpdir.join('test_main.cpp')), 'tests/catch.o'], output)
+
+    cmd(output, '-d', 'yes')
+
+
+def test_stream_rest(tmpdir):
+    output = str(tmpdir.join('stream_parser'))
+    generate_files(parse_config_file('tests/test_stream.arggen'), output)
+
+    env = get_env()
+    executable = str(tmpdir.join('test_stream'))
+    cmd(
+        env['CXX'], *env['CXXFLAGS'], '-std=c++11', '-Wall', '-Wextra', '-Werror', '-I', str(tmpdir),
+        output + '.cpp', 'tests/test_stream_main.cpp', '-o', executable,
+    )
+    cmd(executable)
+
+
+def test_append(tmpdir):
+    output = str(tmpdir.join('append_parser'))
+    generate_files(parse_config_file('tests/test_append.arggen'), output)
+
+    env = get_env()
+    executable = str(tmpdir.join('test_append'))
+    cmd(
+        env['CXX'], *env['CXXFLAGS'], '-std=c++11', '-Wall', '-Wextra', '-Werror', '-I', str(tmpdir),
+        output + '.cpp', 'tests/test_append_main.cpp', '-o', executable,
+    )
+    cmd(executable)
+
+
+def test_macro_like_choices(tmpdir):
+    # the enumerators must not expand as NULL, EOF or -DDEBUG=1
+    configs = parse_config_string(
+        "LogOption = [arg('--log', choices=['null', 'eof', 'debug'], default='debug')]"
+    )
+    main_file = str(tmpdir.join('main.cpp'))
+    with open(main_file, 'w') as fp:
+        fp.write(
+            '#include <cstdio>\n'
+            '#include "log_parser.h"\n'
+            'int main() {\n'
+            '    return LogOption::parse_args({"--log", "eof"}).log == LogOption::Log::kEof ? 0 : 1;\n'
+            '}\n'
+        )
+    output = str(tmpdir.join('log_parser'))
+    generate_files(configs, output)
+    env = get_env()
+    executable = str(tmpdir.join('test_log'))
+    cmd(
+        env['CXX'], *env['CXXFLAGS'], '-std=c++11', '-Wall', '-Wextra', '-Werror', '-DDEBUG=1',
+        '-I', str(tmpdir), output + '.cpp', main_file, '-o', executable,
+    )
+    cmd(executable)
+
+    generate_files(configs, output, target='c')
+    cmd(
+        os.environ.get('CC', 'cc'), '-std=c99', '-Wall', '-Wextra', '-Werror', '-DDEBUG=1',
+        '-c', output + '.c', '-o', output + '.o',
+    )
+
+
+def test_profile(tmpdir, capsys):
+    config = str(tmpdir.join('prof.arggen'))
+    shutil.copy('tests/test.arggen', config)
+    stats_file = str(tmpdir.join('stats.json'))
+    main(['--profile', '--stats', stats_file, config])
+
+    summary = capsys.readouterr().err
+    for phase in ('parse_config_file', 'process_config', 'collect_node', 'render', 'write'):
+        assert phase in summary
+
+    with open(stats_file) as fp:
+        stats = json.load(fp)
+    assert set(stats['phases']) == {
+        'parse_config_file', 'process_config', 'collect_node', 'render', 'write',
+    }
+    output = stats['outputs'][str(tmpdir.join('prof.cpp'))]
+    with open(str(tmpdir.join('prof.cpp')), 'rb') as fp:
+        content = fp.read()
+    assert output['bytes'] == len(content)
+    assert output['lines'] == content.count(b'\n') + 1
+    assert output['nodes'] > 1
+    assert output['max_depth'] > 1
@@ -0,0 +1,172 @@
+#define _POSIX_C_SOURCE 200112L     // setenv
+
+#include <assert.h>
+#include <stdlib.h>
+#include <string.h>
+#include "c_parser.h"
+
+
+#define ARGC(argv) ((int)(sizeof(argv) / sizeof(argv[0])))
+
+
+// setenv() and unsetenv() are posix, missing on mingw
+static void set_env(const char *name, const char *value) {
+#ifdef _WIN32
+    _putenv_s(name, value);
+#else
+    setenv(name, value, 1);
+#endif
+}
+
+
+static void unset_env(const char *name) {
+#ifdef _WIN32
+    _putenv_s(name, "");    // an empty value removes the variable
+#else
+    unsetenv(name);
+#endif
+}
+
+
+static void test_parse_argv(void) {
+    char *argv[] = {"prog", "-b456", "A1", "-vfv", "--qwer", "abc", "haha", "A2", "--bar=7", "A3"};
+    MyOption opt;
+    const char *bad_arg = NULL;
+
+    assert(MyOption_parse_argv(&opt, ARGC(argv), argv, &bad_arg) == MyOption_OK);
+    assert(opt.bar == 7);
+    assert(opt.foo);
+    assert(opt.verbose == 2);
+    assert(strcmp(opt.qwer, "abc") == 0);
+    assert(strcmp(opt.hahaha, "A1") == 0);
+    assert(opt.asdf_count == 3);
+    assert(strcmp(opt.asdf[0], "haha") == 0);
+    assert(strcmp(opt.asdf[1], "A2") == 0);
+    assert(strcmp(opt.asdf[2], "A3") == 0);
+    assert(opt.asdf == argv + 1);
+}
+
+
+static void test_defaults(void) {
+    char *argv[] = {"prog", "--qwer", "abc", "haha"};
+    MyOption opt;
+
+    assert(MyOption_parse_argv(&opt, ARGC(argv), argv, NULL) == MyOption_OK);
+    assert(opt.bar == 123);
+    assert(!opt.foo);
+    assert(opt.verbose == 0);
+    assert(opt.asdf_count == 0);
+}
+
+
+static void test_parse_argv_fail(void) {
+    MyOption opt;
+    const char *bad_arg = NULL;
+
+    char *argv1[] = {"prog", "-b456", "-vfv", "--qwer", "abc"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv1), argv1, &bad_arg) == MyOption_ERR_EXPECT_MORE);
+
+    char *argv2[] = {"prog", "-b456", "-vfv", "--qwer"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv2), argv2, &bad_arg) == MyOption_ERR_NO_VALUE);
+    assert(strcmp(bad_arg, "--qwer") == 0);
+
+    char *argv3[] = {"prog", "-b456", "-vfv", "asdf", "bbb"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv3), argv3, &bad_arg) == MyOption_ERR_REQUIRED);
+    assert(strcmp(bad_arg, "qwer") == 0);
+
+    char *argv4[] = {"prog", "-vfvz", "--qwer", "abc", "asdf"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv4), argv4, &bad_arg) == MyOption_ERR_UNKNOWN_FLAG);
+    assert(strcmp(bad_arg, "-vfvz") == 0);
+
+    char *argv5[] = {"prog", "--bbb", "--qwer", "abc", "asdf"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv5), argv5, &bad_arg) == MyOption_ERR_UNKNOWN_OPTION);
+
+    char *argv6[] = {"prog", "--qwer", "abc", "asdf", "-b", "-v"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv6), argv6, &bad_arg) == MyOption_ERR_NO_VALUE);
+    assert(strcmp(bad_arg, "-b") == 0);
+
+    assert(strcmp(MyOption_strerror(MyOption_ERR_NO_VALUE), "no value for option") == 0);
+}
+
+
+static void test_choices(void) {
+    MyOption opt;
+    const char *bad_arg = NULL;
+
+    char *argv1[] = {"prog", "--qwer", "abc", "haha"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv1), argv1, &bad_arg) == MyOption_OK);
+    assert(opt.color == MyOption_color_AUTO);
+
+    char *argv2[] = {"prog", "--qwer", "abc", "haha", "--color", "never"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv2), argv2, &bad_arg) == MyOption_OK);
+    assert(opt.color == MyOption_color_NEVER);
+
+    char *argv3[] = {"prog", "--qwer", "abc", "haha", "-calways"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv3), argv3, &bad_arg) == MyOption_OK);
+    assert(opt.color == MyOption_color_ALWAYS);
+
+    char *argv4[] = {"prog", "--qwer", "abc", "haha", "--color=blue"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv4), argv4, &bad_arg) == MyOption_ERR_BAD_CHOICE);
+    assert(strcmp(bad_arg, "blue") == 0);
+}
+
+
+static void test_env(void) {
+    MyOption opt;
+    const char *bad_arg = NULL;
+
+    set_env("ARGGEN_TEST_QWER", "from env");
+    set_env("ARGGEN_TEST_FOO", "1");
+
+    char *argv1[] = {"prog", "haha"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv1), argv1, &bad_arg) == MyOption_OK);
+    assert(strcmp(opt.qwer, "from env") == 0);
+    assert(opt.foo);
+
+    char *argv2[] = {"prog", "haha", "--qwer", "abc"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv2), argv2, &bad_arg) == MyOption_OK);
+    assert(strcmp(opt.qwer, "abc") == 0);
+
+    unset_env("ARGGEN_TEST_QWER");
+    unset_env("ARGGEN_TEST_FOO");
+    assert(MyOption_parse_argv(&opt, ARGC(argv1), argv1, &bad_arg) == MyOption_ERR_REQUIRED);
+}
+
+
+static void test_terminator(void) {
+    MyOption opt;
+    const char *bad_arg = NULL;
+
+    char *argv1[] = {"prog", "--qwer", "abc", "--", "-haha", "--bar", "-", "--"};
+    assert(MyOption_parse_argv(&opt, ARGC(argv1), argv1, &bad_arg) == MyOption_OK);
+    assert(strcmp(opt.hahaha, "-haha") == 0);
+    assert(opt.bar == 123);
+    assert(opt.asdf_count == 3);
+    assert(strcmp(opt.asdf[0], "--bar") == 0);
+    assert(strcmp(opt.asdf[1], "-") == 0);
+    assert(strcmp(opt.asdf[2], "--") == 0);
+}
+
+
+static void test_usage(void) {
+    assert(sizeof(MyOption_usage) == strlen(MyOption_usage) + 1);
+    assert(strncmp(MyOption_usage, "usage: ", 7) == 0);
+    assert(strstr(MyOption_usage, "  -f, --foo             enable foo [env: ARGGEN_TEST_FOO]\n") != NULL);
+
+    assert(strcmp(MyOption_suggest("--colr"), "--color") == 0);
+    assert(strcmp(MyOption_suggest("--verbsoe=1"), "--verbose") == 0);
+    assert(MyOption_suggest("--bbb") == NULL);
+    assert(MyOption_suggest("--foo=1") == NULL);
+}
+
+
+int main(void) {
+    test_parse_argv();
+    test_defaults();
+    test_parse_argv_fail();
+    test_choices();
+    test_env();
+    test_terminator();
+    test_usage();
+    return 0;
+}
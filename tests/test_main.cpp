@@ -1,4 +1,9 @@
+#include <algorithm>
+#include <cstdlib>
+#include <initializer_list>
 #include <ostream>
+#include <string>
+#include <vector>
 #include "catch.hpp"
 
 #include "test.h"
@@ -7,6 +12,25 @@
 using namespace std;
 
 
+// setenv() and unsetenv() are posix, missing on mingw
+static void set_env(const char *name, const char *value) {
+#ifdef _WIN32
+    _putenv_s(name, value);
+#else
+    setenv(name, value, 1);
+#endif
+}
+
+
+static void unset_env(const char *name) {
+#ifdef _WIN32
+    _putenv_s(name, "");    // an empty value removes the variable
+#else
+    unsetenv(name);
+#endif
+}
+
+
 inline ostream &operator <<(ostream &os, const MyOption &value) {
     os << value.to_string();
     return os;
@@ -82,3 +106,240 @@ TEST_CASE("Test parse_args fail") {
         "-vfv", "--qwer", "abc", "asdf", "-b", "-v",
     }), ArgError);
 }
+
+
+TEST_CASE("Test parse_into reuses struct") {
+    MyOption opt;
+    MyOption::parse_into(opt, {"-b1", "-vv", "--qwer", "abc", "haha", "A1", "A2", "A3"});
+    CHECK(opt.bar == 1);
+    CHECK(opt.verbose == 2);
+    CHECK(opt.asdf.size() == 3);
+
+    MyOption expected;
+    expected.asdf = {"B1"};
+    expected.bar = 123;
+    expected.foo = false;
+    expected.hahaha = "hoho";
+    expected.qwer = "xyz";
+    expected.verbose = 0;
+
+    MyOption::parse_into(opt, {"--qwer", "xyz", "hoho", "B1"});
+    CHECK(opt == expected);
+    CHECK(opt.asdf.capacity() >= 3);
+}
+
+
+TEST_CASE("Test parse_line") {
+    MyOption expected;
+    expected.asdf = {"A 1", "A2", "", "a'b\"c"};
+    expected.bar = 456;
+    expected.foo = true;
+    expected.hahaha = "ha ha";
+    expected.qwer = "$abc\\";
+    expected.verbose = 2;
+
+    CHECK(MyOption::parse_line(
+        "  --bar 456 -vfv\t--qwer \"\\$abc\\\\\" 'ha ha' A\\ 1 A2 '' a\\'b'\"'c \n"
+    ) == expected);
+    CHECK(MyOption::parse_line(
+        "--bar=456 -vfv --qwer='$abc\\' ha\" \"ha \"A 1\" A2 \"\" \"a'b\\\"c\""
+    ) == expected);
+
+    CHECK_THROWS_AS(MyOption::parse_line("--qwer 'abc haha"), ArgError);
+    CHECK_THROWS_AS(MyOption::parse_line("--qwer \"abc haha"), ArgError);
+    CHECK_THROWS_AS(MyOption::parse_line("--qwer abc haha\\"), ArgError);
+    CHECK_THROWS_AS(MyOption::parse_line("--qwer abc -b"), ArgError);
+}
+
+
+TEST_CASE("Test choices") {
+    CHECK(MyOption::parse_args({"--qwer", "abc", "haha"}).color == MyOption::Color::kAuto);
+    CHECK(MyOption::parse_args({"--qwer", "abc", "haha", "--color", "never"}).color
+          == MyOption::Color::kNever);
+    CHECK(MyOption::parse_args({"--qwer", "abc", "haha", "--color=always"}).color
+          == MyOption::Color::kAlways);
+    CHECK(MyOption::parse_args({"--qwer", "abc", "haha", "-cnever"}).color == MyOption::Color::kNever);
+    CHECK(std::string(MyOption::to_string(MyOption::Color::kAlways)) == "always");
+
+    CHECK_THROWS_AS(MyOption::parse_args({"--qwer", "abc", "haha", "--color", "blue"}), ArgError);
+    CHECK_THROWS_AS(MyOption::parse_args({"--qwer", "abc", "haha", "--color", "nevers"}), ArgError);
+    CHECK_THROWS_AS(MyOption::parse_args({"--qwer", "abc", "haha", "--color="}), ArgError);
+}
+
+
+TEST_CASE("Test terminator") {
+    MyOption opt = MyOption::parse_args({"--qwer", "abc", "--", "-haha", "--bar", "-", "--"});
+    CHECK(opt.hahaha == "-haha");
+    CHECK(opt.asdf == vector<string>({"--bar", "-", "--"}));
+    CHECK(opt.bar == 123);
+
+    const char *argv[] = {"prog", "-b", "7", "--qwer=abc", "--", "--color"};
+    opt = MyOption::parse_argv(6, argv);
+    CHECK(opt.hahaha == "--color");
+    CHECK(opt.bar == 7);
+
+    CHECK(MyOption::parse_line("--qwer abc haha -- -v").asdf == vector<string>({"-v"}));
+    CHECK_THROWS_AS(MyOption::parse_args({"--qwer", "abc", "--"}), ArgError);
+}
+
+
+TEST_CASE("Test rest reserved exactly") {
+    vector<string> args = {"-b", "1", "--qwer", "abc", "-c", "never", "haha"};
+    for (int i = 0; i < 1000000; i++) {
+        args.push_back(i % 2 ? "x" : "-v");
+    }
+    args.insert(args.begin() + 100, "--");
+
+    MyOption opt;
+    MyOption::parse_into(opt, args);
+    CHECK(opt.asdf.size() == 1000000 - 47);
+    CHECK(opt.asdf.capacity() == opt.asdf.size());
+    CHECK(opt.verbose == 47);
+}
+
+
+TEST_CASE("Test usage") {
+    const std::string usage = MyOption::usage;
+    CHECK(sizeof(MyOption::usage) == usage.size() + 1);
+    CHECK(usage.compare(0, 12, "usage: test ") == 0);
+    CHECK(usage.find("\n  -b, --bar BAR         (default: 123)\n") != std::string::npos);
+
+    try {
+        MyOption::parse_args({"--qwer", "abc", "haha", "--colour=never"});
+        FAIL("no exception");
+    } catch (const ArgError &e) {
+        CHECK(std::string(e.what()) == "Unknown option: --colour=never, did you mean --color?");
+    }
+    try {
+        MyOption::parse_args({"--qwer", "abc", "haha", "--bbb"});
+        FAIL("no exception");
+    } catch (const ArgError &e) {
+        CHECK(std::string(e.what()) == "Unknown option: --bbb");
+    }
+}
+
+
+struct FieldCollector {
+    std::vector<std::string> names;
+    int count_kinds = 0;
+
+    template <class T>
+    void operator()(const char *name, std::initializer_list<const char *> options,
+                    MyOption::ArgType arg_type, const T &) {
+        std::string item = name;
+        for (const char *opt : options) {
+            item += std::string(" ") + opt;
+        }
+        names.push_back(item);
+        count_kinds += arg_type == MyOption::ArgType::kCount;
+    }
+};
+
+
+struct FieldSetter {
+    void operator()(const char *, std::initializer_list<const char *>, MyOption::ArgType, int &field) {
+        field = 7;
+    }
+    void operator()(const char *, std::initializer_list<const char *>, MyOption::ArgType, bool &field) {
+        field = true;
+    }
+    template <class T>
+    void operator()(const char *, std::initializer_list<const char *>, MyOption::ArgType, T &) {}
+};
+
+
+TEST_CASE("Test for_each_field") {
+    const MyOption opt {};
+    FieldCollector collector;
+    opt.for_each_field(collector);
+    std::sort(collector.names.begin(), collector.names.end());
+    CHECK(collector.names == std::vector<std::string>({
+        "asdf asdf", "bar --bar -b", "color --color -c", "foo --foo -f",
+        "hahaha haha", "qwer --qwer", "verbose -v --verbose",
+    }));
+    CHECK(collector.count_kinds == 1);
+
+    MyOption changed;
+    changed.for_each_field(FieldSetter());
+    CHECK(changed.bar == 7);
+    CHECK(changed.verbose == 7);
+    CHECK(changed.foo);
+}
+
+
+TEST_CASE("Test serialize") {
+    MyOption opt = MyOption::parse_args({"-b-300", "-vfv", "--qwer", "", "haha", "-cnever", "A1", "A2"});
+    std::string buffer;
+    opt.serialize(buffer);
+    CHECK(MyOption::deserialize(buffer) == opt);
+
+    // reuses the struct
+    MyOption other = MyOption::parse_args({"--qwer", "xyz", "hoho", "B1", "B2", "B3"});
+    MyOption::deserialize_into(other, buffer.data(), buffer.size());
+    CHECK(other == opt);
+
+    // appends
+    std::string twice = buffer;
+    opt.serialize(twice);
+    MyOption::deserialize_into(other, twice.data() + buffer.size(), buffer.size());
+    CHECK(other == opt);
+
+    CHECK_THROWS_AS(MyOption::deserialize(""), ArgError);
+    CHECK_THROWS_AS(MyOption::deserialize(buffer.substr(0, buffer.size() - 1)), ArgError);
+    CHECK_THROWS_AS(MyOption::deserialize(buffer + "x"), ArgError);
+    std::string bad_fingerprint = buffer;
+    bad_fingerprint[3] ^= 1;
+    CHECK_THROWS_AS(MyOption::deserialize(bad_fingerprint), ArgError);
+}
+
+
+TEST_CASE("Test environment variables") {
+    set_env("ARGGEN_TEST_QWER", "from env");
+    set_env("ARGGEN_TEST_FOO", "1");
+    set_env("ARGGEN_TEST_VERBOSE", "3");
+
+    // the required option is satisfied by the environment
+    MyOption opt = MyOption::parse_args({"haha"});
+    CHECK(opt.qwer == "from env");
+    CHECK(opt.foo);
+    CHECK(opt.verbose == 3);
+
+    // args override the environment
+    opt = MyOption::parse_args({"haha", "--qwer", "abc", "-v"});
+    CHECK(opt.qwer == "abc");
+    CHECK(opt.verbose == 4);
+
+    set_env("ARGGEN_TEST_FOO", "0");
+    CHECK(!MyOption::parse_args({"haha"}).foo);
+
+    unset_env("ARGGEN_TEST_QWER");
+    unset_env("ARGGEN_TEST_FOO");
+    unset_env("ARGGEN_TEST_VERBOSE");
+    CHECK_THROWS_AS(MyOption::parse_args({"haha"}), ArgError);
+}
+
+
+#ifdef ARGGEN_INSTRUMENT
+static long long last_parse_time = -1;
+
+TEST_CASE("Test instrumentation") {
+    MyOption::stats.on_parse_time = [](std::chrono::nanoseconds ns) {
+        last_parse_time = ns.count();
+    };
+    unsigned long foo_hits = MyOption::stats.option_hits[MyOption::Stats::opt_foo];
+    unsigned long verbose_hits = MyOption::stats.option_hits[MyOption::Stats::opt_verbose];
+    unsigned long no_value = MyOption::stats.errors[MyOption::Stats::err_no_value];
+
+    MyOption::parse_args({"-vfv", "--foo", "--qwer", "abc", "haha"});
+    CHECK(MyOption::stats.option_hits[MyOption::Stats::opt_foo] == foo_hits + 2);
+    CHECK(MyOption::stats.option_hits[MyOption::Stats::opt_verbose] == verbose_hits + 2);
+    CHECK(last_parse_time >= 0);
+
+    last_parse_time = -1;
+    CHECK_THROWS_AS(MyOption::parse_args({"--qwer"}), ArgError);
+    CHECK(MyOption::stats.errors[MyOption::Stats::err_no_value] == no_value + 1);
+    CHECK(last_parse_time >= 0);
+
+    MyOption::stats.on_parse_time = nullptr;
+}
+#endif
@@ -1,4 +1,9 @@
-from arggen import Root, Block, Condition, If, ElseIf, Else, Context, collect_node
+from functools import partial
+
+from arggen import (
+    Root, Block, Condition, If, ElseIf, Else, Context, HelperSlot,
+    collect_node, node_stats, make_fragment, outline_fragments,
+)
 
 
 def test_block():
@@ -100,3 +105,75 @@ def test_collect_node():
                 .add_child(If('b').add_child('BBB'))
                 .add_child(Else().add_child('CCC')))\
             .add_child('zzz'))
+
+
+def test_suite():
+    def g(ctx: Context):
+        with ctx.SUITE('def f()'):
+            with ctx.SUITE('if a'):
+                yield 'return 1'
+            with ctx.SUITE('else'):
+                pass
+
+    assert '\n'.join(collect_node(g).to_source(0)) == '''
+def f():
+    if a:
+        return 1
+    else:
+        pass'''[1:]
+
+
+def test_node_stats():
+    root = Root().add_child('a').add_child(
+        Block('b').add_child(Condition().add_child(If('c').add_child('d'))))
+    assert node_stats(root) == (4, 3)
+
+
+def test_structural_hash():
+    def tree(text):
+        return Root().add_child(Block('head').add_child(If('a').add_child(text)))
+
+    assert tree('x') == tree('x')
+    assert hash(tree('x')) == hash(tree('x'))
+    assert tree('x') != tree('y')
+    assert len({tree('x'), tree('x'), tree('y')}) == 2
+    assert Block('a') != Block('a', trailing_semicolon=True)
+
+
+def test_outline_fragments():
+    def body_gen(ctx: Context, value: str):
+        with ctx.IF('check()'):
+            yield 'fail();'
+        yield f'use({value});'
+
+    def g(ctx: Context):
+        yield HelperSlot()
+        for value in ('1', '2'):
+            yield make_fragment(
+                'helper', [('int value', value)],
+                partial(body_gen, value=value), partial(body_gen, value='value'),
+            )
+        yield make_fragment(
+            'helper', [('const char *value', '"3"')],
+            partial(body_gen, value='"3"'), partial(body_gen, value='value'),
+        )
+
+    root = collect_node(g)
+    before = '\n'.join(root.to_source(0))
+    assert before.count('fail();') == 3
+
+    outline_fragments(root)
+    assert '\n'.join(root.to_source(0)) == '''
+static inline void helper(int value) {
+    if (check()) {
+        fail();
+    }
+    use(value);
+}
+
+helper(1);
+helper(2);
+if (check()) {
+    fail();
+}
+use("3");'''[1:]
@@ -2,8 +2,8 @@ import pytest
 
 from arggen import (
     ArgError, ArgType, ArgInfo, ValueType,
-    flag, count, arg, rest,
-    process_config, parse_config_string,
+    flag, count, arg, rest, append,
+    process_config, parse_config_string, find_perfect_hash, fnv1a_hash, usage_text,
 )
 
 
@@ -80,6 +80,90 @@ def test_invalid_user_arg_info():
     # positional args with default value is not on tail
     E(arg('a'), arg('b', default='b'), arg('c'))
 
+    # invalid choices
+    E(arg('--color', choices=[]))
+    E(arg('--color', choices='abc'))
+    E(arg('--color', choices=['1x']))
+    E(arg('--color', choices=['a-b', 'a_b']))
+    E(arg('--color', choices=['ab', 'Ab']))
+    E(arg('--color', choices=['a', 'b'], default='c'))
+    E(arg('--color', choices=['a', 'b'], type=ValueType.STRING))
+    E(arg('--color', type=ValueType.ENUM))
+    E(rest('color', choices=['a', 'b']))
+    E(arg('--stats', choices=['a', 'b']))
+    E(arg('--a-b', choices=['a']), arg('--aB', choices=['b']))
+
+    # invalid environment variables
+    E(arg('--qwer', env='A-B'))
+    E(arg('qwer', env='QWER'))
+    E(rest('qwer', env='QWER'))
+    E(arg('--qwer', env='X'), flag('--foo', env='X'))
+    # invalid help
+    E(flag('--foo', help=1))
+
+    # invalid append
+    E(append('include'))
+    E(append('-I', default='x'))
+    E(append('-I', env='INCLUDE'))
+    E(append('-I', choices=['a', 'b']))
+    E(append('-I', type=ValueType.BOOL))
+    E(append('-I', split=''))
+    E(append('-I', split=',;'))
+    E(append('-I', split='='))
+    E(rest('files', split=','))
+    E(arg('-I', split=','))
+
+
+def test_choices():
+    assert process_config([arg('--log-level', choices=('debug', 'no-log'), default='no-log')]) == [
+        ArgInfo(
+            name='log_level', options=('--log-level',), arg_type=ArgType.ONE,
+            value_type=ValueType.ENUM, default='no-log', choices=('debug', 'no-log'),
+        ),
+    ]
+
+
+def test_usage_text():
+    argsinfo = process_config([
+        flag('--foo', '-f', help='enable   foo'),
+        arg('--log-level', choices=('debug', 'info'), default='info', env='LOG_LEVEL'),
+        arg('--output', '-o', help='write the result to this file instead of the standard output, ' * 2),
+        arg('input'),
+        rest('files'),
+    ])
+    assert usage_text('prog', argsinfo) == '''\
+usage: prog [-f] [--log-level {debug,info}] -o OUTPUT input [files ...]
+
+positional arguments:
+  input
+  files ...
+
+options:
+  -f, --foo             enable foo
+  --log-level {debug,info}
+                        (default: info) [env: LOG_LEVEL]
+  -o, --output OUTPUT   write the result to this file instead of the standard
+                        output, write the result to this file instead of the
+                        standard output,
+'''
+    assert usage_text('prog', []) == 'usage: prog\n'
+
+    argsinfo = process_config([append('-I', '--include'), append('-D', name='define', split=',')])
+    assert usage_text('prog', argsinfo).splitlines() == [
+        'usage: prog [-I INCLUDE]... [-D DEFINE[,DEFINE...]]...',
+        '',
+        'options:',
+        '  -I, --include INCLUDE',
+        '  -D DEFINE[,DEFINE...]',
+    ]
+
+
+def test_find_perfect_hash():
+    keys = ['k%d' % i for i in range(40)]
+    seed, size = find_perfect_hash(keys)
+    assert size & (size - 1) == 0
+    assert len({fnv1a_hash(key.encode(), seed) % size for key in keys}) == len(keys)
+
 
 def test_parse_config_string():
     input = f'''
@@ -0,0 +1,153 @@
+import importlib.util
+
+import pytest
+
+from arggen import BadConfiguration, generate_files, parse_config_file, parse_config_string
+
+
+@pytest.fixture(scope='module')
+def mod(tmpdir_factory):
+    output = str(tmpdir_factory.mktemp('python_target').join('test_parser'))
+    generate_files(parse_config_file('tests/test.arggen'), output, target='python')
+
+    spec = importlib.util.spec_from_file_location('test_parser', output + '.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_parse_args(mod):
+    expected = mod.MyOption()
+    expected.asdf = ['A1', 'A2']
+    expected.bar = 456
+    expected.foo = True
+    expected.hahaha = 'haha'
+    expected.qwer = 'abc'
+    expected.verbose = 2
+
+    assert mod.parse_args(
+        ['--bar', '456', '-f', '-v', '-v', '--qwer', 'abc', 'haha', 'A1', 'A2']) == expected
+    assert mod.parse_args(['--bar', '456', '-vfv', '--qwer', 'abc', 'haha', 'A1', 'A2']) == expected
+    assert mod.parse_args(['--bar=456', '-vfv', '--qwer', 'abc', 'haha', 'A1', 'A2']) == expected
+    assert mod.parse_args(['-b456', '-vfv', '--qwer', 'abc', 'haha', 'A1', 'A2']) == expected
+    assert mod.parse_args(['-b', '456', '-vfv', '--qwer', 'abc', 'haha', 'A1', 'A2']) == expected
+    assert mod.parse_argv(['prog', '-b', '456x', '-vfv', '--qwer=abc', 'haha', 'A1', 'A2']) == expected
+
+    expected.bar = 123
+    assert mod.parse_args(['-vfv', 'haha', 'A1', 'A2', '--qwer', 'abc']) == expected
+    assert repr(expected) == \
+        '<MyOption foo=true verbose=2 bar=123 qwer="abc" hahaha="haha" color=auto asdf=A1,A2,>'
+
+
+def test_parse_args_fail(mod):
+    mod.parse_args(['-b456', '-vfv', '--qwer', 'abc', 'asdf'])
+
+    for args in [
+        ['-b456', '-vfv', '--qwer', 'abc'],
+        ['-b456', '-vfv', '--qwer'],
+        ['-b456', '-vfv', 'asfd', 'bbb'],
+        ['-b456', '-vfvz', '--qwer', 'abc', 'asdf'],
+        ['-b456', '-vfv', '--bbb', '--qwer', 'abc', 'asdf'],
+        ['-b456', '-vfv', '--foo=1', '--qwer', 'abc', 'asdf'],
+        ['-vfv', '--qwer', 'abc', 'asdf', '--bar'],
+        ['-vfv', '--qwer', 'abc', 'asdf', '--bar', '-v'],
+        ['-vfv', '--qwer', 'abc', 'asdf', '-b', '-v'],
+        ['-vfv', '--qwer', 'abc', 'asdf', '--color', 'blue'],
+    ]:
+        with pytest.raises(mod.ArgError):
+            mod.parse_args(args)
+
+
+def test_choices(mod):
+    assert mod.parse_args(['--qwer', 'abc', 'haha']).color == 'auto'
+    assert mod.parse_args(['--qwer', 'abc', 'haha', '--color', 'never']).color == 'never'
+    assert mod.parse_args(['--qwer', 'abc', 'haha', '-calways']).color == 'always'
+
+    with pytest.raises(mod.ArgError, match='expect one of auto, always, never'):
+        mod.parse_args(['--qwer', 'abc', 'haha', '--color=Never'])
+
+
+def test_env(mod, monkeypatch):
+    monkeypatch.setenv('ARGGEN_TEST_QWER', 'from env')
+    monkeypatch.setenv('ARGGEN_TEST_FOO', '1')
+    monkeypatch.setenv('ARGGEN_TEST_VERBOSE', '3')
+
+    opt = mod.parse_args(['haha'])
+    assert (opt.qwer, opt.foo, opt.verbose) == ('from env', True, 3)
+    opt = mod.parse_args(['haha', '--qwer', 'abc', '-v'])
+    assert (opt.qwer, opt.verbose) == ('abc', 4)
+
+    monkeypatch.setenv('ARGGEN_TEST_FOO', '0')
+    assert not mod.parse_args(['haha']).foo
+    monkeypatch.delenv('ARGGEN_TEST_QWER')
+    with pytest.raises(mod.ArgError):
+        mod.parse_args(['haha'])
+
+
+def test_terminator(mod):
+    opt = mod.parse_args(['--qwer', 'abc', '--', '-haha', '--bar', '-', '--'])
+    assert (opt.hahaha, opt.asdf, opt.bar) == ('-haha', ['--bar', '-', '--'], 123)
+    with pytest.raises(mod.ArgError):
+        mod.parse_args(['--qwer', 'abc', '--'])
+
+
+def test_usage(mod):
+    assert mod.USAGE.startswith('usage: test_parser [-f] [-v] [-b BAR] --qwer QWER')
+    assert '\n  -c, --color {auto,always,never}\n                        when to colorize' in mod.USAGE
+
+    with pytest.raises(mod.ArgError, match=r'^Unknown option: --colour=never, did you mean --color\?$'):
+        mod.parse_args(['--qwer', 'abc', 'haha', '--colour=never'])
+    with pytest.raises(mod.ArgError, match=r'^Unknown option: --verbsoe, did you mean --verbose\?$'):
+        mod.parse_args(['--qwer', 'abc', 'haha', '--verbsoe'])
+    with pytest.raises(mod.ArgError, match=r'^Unknown option: --bbb$'):
+        mod.parse_args(['--qwer', 'abc', 'haha', '--bbb'])
+
+
+def test_atol(mod):
+    assert mod._atol('  -12ab') == -12
+    assert mod._atol('+7') == 7
+    assert mod._atol('-') == 0
+    assert mod._atol('x1') == 0
+    assert mod._atol('') == 0
+
+
+def test_append(tmpdir):
+    output = str(tmpdir.join('append_parser'))
+    generate_files(parse_config_file('tests/test_append.arggen'), output, target='python')
+    spec = importlib.util.spec_from_file_location('append_parser', output + '.py')
+    append_mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(append_mod)
+
+    opt = append_mod.parse_args(
+        ['-Isrc', 'a.c', '--include', 'lib', '-DX=1,Y', '--include=inc', '-l1:2', '--level', '3'])
+    assert opt.include == ['src', 'lib', 'inc']
+    assert opt.define == ['X=1', 'Y']
+    assert opt.level == [1, 2, 3]
+    assert opt.inputs == ['a.c']
+    assert repr(opt) == \
+        '<AppendOption verbose=false include=src,lib,inc, define=X=1,Y, level=1,2,3, out="a.out" inputs=a.c,>'
+    assert append_mod.parse_args([]).include == []
+    assert '[-I INCLUDE]... [-D DEFINE[,DEFINE...]]...' in append_mod.USAGE
+
+    with pytest.raises(append_mod.ArgError):
+        append_mod.parse_args(['-I'])
+    with pytest.raises(append_mod.ArgError):
+        append_mod.parse_args(['-vI', 'x'])
+
+
+def test_stream_rest_unsupported(tmpdir):
+    with pytest.raises(BadConfiguration):
+        generate_files(
+            parse_config_file('tests/test_stream.arggen'), str(tmpdir.join('parser')), target='python',
+        )
+
+
+@pytest.mark.parametrize('target', ['python', 'cpython'])
+def test_keyword_name_rejected(tmpdir, target):
+    for config in ["Opt = [flag('--global')]", "Opt = [arg('--from')]", "Opt = [rest('import')]"]:
+        with pytest.raises(BadConfiguration, match='python keyword'):
+            generate_files(parse_config_string(config), str(tmpdir.join('parser')), target=target)
+
+    # renamed
+    config = "Opt = [arg('--from', name='source')]"
+    generate_files(parse_config_string(config), str(tmpdir.join('parser')), target=target)
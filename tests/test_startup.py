@@ -0,0 +1,98 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from arggen import parse_all_args, parse_common_args
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(code: str):
+    """Runs code in a new interpreter, returns {module: cumulative import time in us}."""
+    env = dict(os.environ)
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stderr=subprocess.PIPE, universal_newlines=True, cwd=REPO_DIR, env=env, check=True,
+    )
+
+    times = dict()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_arggen():
+    times = import_times('import arggen')
+    assert 'arggen' in times
+    for module in ('argparse', 'json', 're', 'typing', 'ctypes'):
+        assert module not in times, f'{module} imported by arggen'
+
+
+def test_generate_imports():
+    code = '''
+import arggen
+for target in arggen.TARGETS:
+    arggen.generate(open('tests/test.arggen').read(), source_name='parser', target=target)
+'''
+    times = import_times(code)
+    for module in ('argparse', 'json', 're', 'typing'):
+        assert module not in times, f'{module} imported by generate()'
+
+
+def test_cli_imports(tmpdir):
+    config = tmpdir.join('cli.arggen')
+    config.write("Opt = [flag('--foo')]\n")
+    times = import_times(f'import arggen; arggen.main([{str(config)!r}, "--target", "python", "--profile"])')
+    assert tmpdir.join('cli.py').check()
+    # the plain invocations are parsed without argparse
+    for module in ('argparse', 'json', 'typing'):
+        assert module not in times, f'{module} imported by the command line'
+
+    # anything else is left to argparse
+    times = import_times(f'import arggen; arggen.main([{str(config)!r}, "--instrument", "--compac"])')
+    assert tmpdir.join('cli.cpp').check()
+    assert 'argparse' in times
+
+
+@pytest.mark.parametrize('args', [
+    ['a.arggen'],
+    ['a=b.arggen'],
+    ['a.arggen', '--target', 'python'],
+    ['--target=c', 'a.arggen', '--compact'],
+    ['--instrument', '--compact', '--profile', 'a.arggen'],
+    ['a.arggen', '--stats', '-'],
+    ['a.arggen', '--stats', 'out.json', '--target', 'cpython'],
+    ['a.arggen', '--stats='],
+    ['a.arggen', '--stats=--x', '--target=cpp'],
+    ['a.arggen', '--target', 'cpp', '--target', 'c'],
+])
+def test_common_args_as_argparse(args):
+    # the fast path of the command line agrees with argparse
+    assert vars(parse_common_args(args)) == vars(parse_all_args(args))
+
+
+@pytest.mark.parametrize('args', [
+    [],
+    ['--watch', 'dir'],
+    ['a.arggen', '--watch', 'dir'],
+    ['a.arggen', 'b.arggen'],
+    ['a.arggen', '--target'],
+    ['a.arggen', '--target', 'x'],
+    ['a.arggen', '--target=x'],
+    ['a.arggen', '--stats', '--profile'],
+    ['a.arggen', '--instrument=1'],
+    ['a.arggen', '--inst'],
+    ['a.arggen', '--'],
+    ['-'],
+    ['--help'],
+    ['-V'],
+])
+def test_common_args_fallback(args):
+    assert parse_common_args(args) is None
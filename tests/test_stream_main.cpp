@@ -0,0 +1,41 @@
+#include <cassert>
+#include <string>
+#include <vector>
+
+#include "stream_parser.h"
+
+
+int main() {
+    std::vector<int> seen;
+    StreamOption opt;
+    opt.numbers = [&seen, &opt](int value) {
+        // the options before the item are parsed already
+        seen.push_back(value * opt.scale);
+    };
+
+    StreamOption::parse_into(opt, {"1", "-s", "10", "2", "-v", "3x"});
+    assert((seen == std::vector<int> {1, 20, 30}));
+    assert(opt.verbose);
+
+    // the callback is kept between parses
+    seen.clear();
+    const char *argv[] = {"prog", "4", "--scale=2", "5"};
+    StreamOption::parse_argv_into(opt, 4, argv);
+    assert((seen == std::vector<int> {4, 10}));
+    assert(!opt.verbose);
+
+    seen.clear();
+    StreamOption::parse_line_into(opt, "6 '7'");
+    assert((seen == std::vector<int> {6, 7}));
+
+    // no callback, the items are not dropped silently
+    assert(StreamOption::parse_args({"-v"}).verbose);
+    bool failed = false;
+    try {
+        StreamOption::parse_args({"-v", "1"});
+    } catch (const ArgError &err) {
+        failed = std::string(err.what()) == "no callback for numbers";
+    }
+    assert(failed);
+    return 0;
+}
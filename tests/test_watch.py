@@ -0,0 +1,104 @@
+import os
+import sys
+
+import pytest
+
+from arggen import Inotify, Watcher
+
+CONFIG = '''
+MyOption = [
+    flag('--foo', '-f'),
+]
+'''
+
+
+def test_poll(tmpdir):
+    logs = []
+    watcher = Watcher([str(tmpdir)], target='python', log=logs.append)
+    config = tmpdir.join('sub', 'opt.arggen')
+    config.write(CONFIG, ensure=True)
+
+    assert watcher.poll() == [str(config)]
+    assert tmpdir.join('sub', 'opt.py').check()
+    assert watcher.poll() == []
+
+    # same content, new mtime
+    config.write(CONFIG)
+    os.utime(str(config), ns=(0, 0))
+    assert watcher.poll() == []
+
+    config.write(CONFIG.replace('foo', 'bar'))
+    assert watcher.poll() == [str(config)]
+    assert 'bar' in tmpdir.join('sub', 'opt.py').read()
+
+    config.write('MyOption = [nonsense()]')
+    assert watcher.poll() == []
+    assert 'NameError' in logs[-1]
+
+
+def test_poll_retry(tmpdir):
+    logs = []
+    watcher = Watcher([str(tmpdir)], target='python', retry_interval=0, log=logs.append)
+    config = str(tmpdir.join('opt.arggen'))
+    tmpdir.join('opt.arggen').write(CONFIG)
+    # the output is not writable
+    tmpdir.join('opt.py').mkdir()
+
+    assert watcher.poll() == []
+    configs = watcher.parsed[config][1]
+    assert watcher.retry() == []
+    assert len(logs) == 1
+
+    # retried by the timer without a change of the config, which is not parsed again
+    tmpdir.join('opt.py').remove()
+    assert watcher.poll() == []
+    assert watcher.retry() == [config]
+    assert tmpdir.join('opt.py').check(file=1)
+    assert watcher.parsed[config][1] is configs
+    assert watcher.retry() == []
+    assert watcher.poll() == []
+
+
+def test_poll_bad_config(tmpdir):
+    logs = []
+    watcher = Watcher([str(tmpdir)], target='python', retry_interval=0, log=logs.append)
+    runs = tmpdir.join('runs')
+    tmpdir.join('opt.arggen').write(f"open({str(runs)!r}, 'a').write('x')\nMyOption = [nonsense()]")
+
+    # not run again until the config changes
+    for _ in range(3):
+        assert watcher.poll() + watcher.retry() == []
+    assert runs.read() == 'x'
+    assert len(logs) == 1 and 'NameError' in logs[0]
+
+    tmpdir.join('opt.arggen').write(CONFIG)
+    assert watcher.poll() == [str(tmpdir.join('opt.arggen'))]
+    assert str(tmpdir.join('opt.arggen')) not in watcher.errors
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='linux only')
+def test_inotify(tmpdir):
+    with Inotify() as inotify:
+        inotify.add_tree(str(tmpdir))
+        tmpdir.join('opt.arggen').write(CONFIG)
+        events = inotify.read()
+
+    assert (str(tmpdir.join('opt.arggen')), Inotify.IN_CLOSE_WRITE) in events
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='linux only')
+def test_inotify_retry(tmpdir):
+    watcher = Watcher([str(tmpdir)], target='python', retry_interval=0.05, log=lambda msg: None)
+    config = str(tmpdir.join('opt.arggen'))
+    tmpdir.join('opt.arggen').write(CONFIG)
+    tmpdir.join('opt.py').mkdir()
+    assert watcher.poll() == []
+    tmpdir.join('opt.py').remove()
+
+    with Inotify() as inotify:
+        inotify.add_tree(str(tmpdir))
+        # no event arrives, the read times out for the retry
+        assert watcher.wait(inotify) == [config]
+
+    assert tmpdir.join('opt.py').check(file=1)
+    assert watcher.retries == {}